@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import json
+import time
+
+import main
+
+# Representative telemetry frame (same shape as post_data / websocket telemetry events).
+EVENT = {
+    "type": "data_update",
+    "device_id": "device_one",
+    "value": {"rpm": 1234, "temp_c": 24.71, "mode": "auto"},
+    "timestamp_utc": "2024-01-01T00:00:00.000000+00:00",
+    "source": "rest",
+}
+
+
+class NullWebSocket:
+    """Stands in for a connected socket; accepts frames and discards them."""
+
+    async def accept(self, subprotocol=None) -> None:
+        pass
+
+    async def send_text(self, data: str) -> None:
+        pass
+
+    async def send_bytes(self, data: bytes) -> None:
+        pass
+
+    async def send_json(self, data) -> None:
+        # What Starlette does for every send_json call.
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        pass
+
+
+async def bench_per_subscriber(subscribers: int, rounds: int) -> float:
+    # The previous broadcast: send_json (and so json.dumps) once per socket.
+    sockets = [NullWebSocket() for _ in range(subscribers)]
+    start = time.process_time()
+    for _ in range(rounds):
+        for ws in sockets:
+            await ws.send_json(EVENT)
+    return (time.process_time() - start) / rounds
+
+
+async def bench_encode_once(subscribers: int, rounds: int) -> float:
+    manager = main.ConnectionManager(max_queue=rounds + 1)
+    conns = [await manager.connect(NullWebSocket()) for _ in range(subscribers)]
+    start = time.process_time()
+    for _ in range(rounds):
+        await manager.broadcast(EVENT)
+    # Let every writer task drain its queue so socket sends are counted too.
+    while any(c.queue_depth for c in conns):
+        await asyncio.sleep(0)
+    elapsed = (time.process_time() - start) / rounds
+    for c in conns:
+        await manager.disconnect(c.websocket)
+    return elapsed
+
+
+async def run(counts, rounds: int) -> None:
+    print(f"json backend: {main.JSON_BACKEND}, rounds per size: {rounds}")
+    print(f"{'subscribers':>12} {'per-subscriber ms':>18} {'encode-once ms':>15} {'speedup':>8}")
+    for n in counts:
+        old = await bench_per_subscriber(n, rounds)
+        new = await bench_encode_once(n, rounds)
+        print(f"{n:>12} {old * 1e3:>18.3f} {new * 1e3:>15.3f} {old / new if new else 0:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU time per broadcast as subscriber count grows.")
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[10, 100, 500, 1000, 2000])
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.subscribers, args.rounds))
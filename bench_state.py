@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import random
+import time
+
+from state import ShardedState
+
+
+class GlobalLockState:
+    """The previous layout: one dict behind one asyncio.Lock for every read and write."""
+
+    def __init__(self) -> None:
+        self._data = {}
+        self._lock = asyncio.Lock()
+        self.seq = 0
+        self.lock_wait_s = 0.0
+        self.lock_waits = 0
+
+    def lock_for(self, device_id: str) -> asyncio.Lock:
+        return self._lock
+
+    async def acquire(self, lock: asyncio.Lock) -> None:
+        if lock.locked():
+            start = time.perf_counter()
+            await lock.acquire()
+            self.lock_wait_s += time.perf_counter() - start
+            self.lock_waits += 1
+        else:
+            await lock.acquire()
+
+    async def put(self, device_id, value, updated_at_utc):
+        await self.acquire(self._lock)
+        try:
+            self.seq += 1
+            self._data[device_id] = {"value": value, "updated_at_utc": updated_at_utc, "seq": self.seq}
+            return self.seq
+        finally:
+            self._lock.release()
+
+    async def snapshot(self):
+        # get_data used to hold the lock while copying everything.
+        async with self._lock:
+            return self.seq, dict(self._data)
+
+
+def lock_for(state, device_id):
+    if isinstance(state, GlobalLockState):
+        return state.lock_for(device_id)
+    return state._locks[state.shard_index(device_id)]
+
+
+async def read_all(state):
+    if isinstance(state, GlobalLockState):
+        return await state.snapshot()
+    # The sharded layout copies without taking any lock.
+    return state.copy()
+
+
+async def held_put(state, device_id):
+    # A write that awaits while holding its lock, as a write path doing I/O
+    # under the lock would; this is where one global lock serializes everyone.
+    lock = lock_for(state, device_id)
+    await state.acquire(lock)
+    try:
+        await asyncio.sleep(0)
+        state.seq += 1
+    finally:
+        lock.release()
+
+
+async def writer(state, devices, ops, hold):
+    for _ in range(ops):
+        device_id = random.choice(devices)
+        if hold:
+            await held_put(state, device_id)
+        else:
+            await state.put(device_id, 1.0, "2024-01-01T00:00:00+00:00")
+
+
+async def reader(state, stop):
+    snapshots = 0
+    while not stop.is_set():
+        await read_all(state)
+        snapshots += 1
+        await asyncio.sleep(0)
+    return snapshots
+
+
+async def run_one(name, state, args):
+    devices = [f"device_{i}" for i in range(args.devices)]
+    stop = asyncio.Event()
+    readers = [asyncio.create_task(reader(state, stop)) for _ in range(args.readers)]
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(state, devices, args.ops, args.hold) for _ in range(args.writers)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    snapshots = sum(await asyncio.gather(*readers))
+
+    total = args.writers * args.ops
+    avg_wait_us = state.lock_wait_s / state.lock_waits * 1e6 if state.lock_waits else 0.0
+    print(f"{name:>12} {total / elapsed:>12,.0f} {state.lock_waits:>11,} {avg_wait_us:>12.1f} {snapshots:>10,}")
+
+
+async def main(args):
+    print(
+        f"writers={args.writers} writes/writer={args.ops} devices={args.devices} "
+        f"readers={args.readers} await-under-lock={args.hold}"
+    )
+    print(f"{'layout':>12} {'writes/s':>12} {'lock waits':>11} {'avg wait us':>12} {'snapshots':>10}")
+    await run_one("global lock", GlobalLockState(), args)
+    await run_one(f"{args.shards} shards", ShardedState(shards=args.shards), args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="State lock contention with thousands of concurrent writers.")
+    parser.add_argument("--writers", type=int, default=2000)
+    parser.add_argument("--ops", type=int, default=50, help="writes per writer")
+    parser.add_argument("--devices", type=int, default=5000)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=4, help="concurrent full-snapshot readers")
+    parser.add_argument("--hold", action="store_true", help="await once while holding the lock")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
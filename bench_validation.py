@@ -0,0 +1,54 @@
+import argparse
+import timeit
+
+from pydantic import ValidationError
+
+import main
+
+TELEMETRY = {"type": "telemetry", "device_id": "device_one", "value": {"rpm": 1234, "temp_c": 24.71, "mode": "auto"}}
+BAD_TELEMETRY = {"type": "telemetry", "value": 1}
+CONTROL = {"type": "control", "target": "device_one", "command": "set_threshold", "args": {"min": 22.0, "max": 28.0}}
+
+
+def adhoc(msg):
+    # The previous /ws path: a few msg.get() calls; a missing device_id raised
+    # HTTPException and tore the connection down. Other fields were unchecked.
+    if msg.get("type") == "telemetry":
+        if not msg.get("device_id"):
+            return False
+        msg.get("value")
+    return True
+
+
+def pydantic_model(msg):
+    # The REST path: validate through the DataUpdate / ControlCommand models.
+    model = main.DataUpdate if msg.get("type") == "telemetry" else main.ControlCommand
+    try:
+        model.model_validate(msg)
+    except ValidationError:
+        return False
+    return True
+
+
+def validator(msg):
+    return main.ws_validator.validate(msg) is None
+
+
+def main_() -> None:
+    parser = argparse.ArgumentParser(description="Per-message validation cost for /ws messages.")
+    parser.add_argument("--number", type=int, default=200000, help="messages per measurement")
+    args = parser.parse_args()
+
+    cases = [("telemetry", TELEMETRY), ("telemetry (invalid)", BAD_TELEMETRY), ("control", CONTROL)]
+    paths = [("ad hoc msg.get", adhoc), ("pydantic model", pydantic_model), ("MessageValidator", validator)]
+    print(f"{'message':>20} " + " ".join(f"{name:>18}" for name, _ in paths) + "   (ns per message)")
+    for label, msg in cases:
+        row = []
+        for _, fn in paths:
+            seconds = min(timeit.repeat(lambda: fn(msg), number=args.number, repeat=3))
+            row.append(f"{seconds / args.number * 1e9:>18.0f}")
+        print(f"{label:>20} " + " ".join(row))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# One capture record per line:
+#   {"ts": <epoch seconds>, "src": "rest" | "ws", "conn": <client key>, "op": <what>, "body": <payload>}
+# op is the REST route ("POST /api/data", ...) or, for /ws, "open" (body: the
+# query string), "message" (body: the decoded client message) or "close".
+
+
+class TrafficRecorder:
+    """Opt-in capture of inbound REST and /ws traffic to a JSONL file, for replay.py.
+
+    ``record`` only appends a tuple to an in-memory buffer, so the request
+    path never waits on disk (or on JSON encoding); a background task writes
+    the buffer every ``flush_interval_ms`` in a worker thread. If the disk
+    falls behind and ``max_buffer`` records are waiting, new records are
+    dropped and counted rather than growing memory.
+    """
+
+    def __init__(self, path: str, flush_interval_ms: int = 200, max_buffer: int = 100000) -> None:
+        self.path = path
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_buffer = max_buffer
+        self._buffer: List[Tuple[float, str, str, str, Any]] = []
+        self._file = None
+        self._task: Optional[asyncio.Task] = None
+        # A cancelled flush's worker thread may still be writing; never overlap two.
+        self._flush_lock = asyncio.Lock()
+
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+
+    def record(self, src: str, conn: str, op: str, body: Any = None) -> None:
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append((time.time(), src, conn, op, body))
+        self.recorded += 1
+
+    def start(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                self.write_errors += 1
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._buffer or self._file is None:
+                return
+            records, self._buffer = self._buffer, []
+            self.bytes_written += await asyncio.to_thread(self._write, records)
+            self.written += len(records)
+
+    def _write(self, records: List[Tuple[float, str, str, str, Any]]) -> int:
+        lines = []
+        for ts, src, conn, op, body in records:
+            rec = {"ts": round(ts, 6), "src": src, "conn": conn, "op": op, "body": body}
+            # default=str: a value that can't be encoded is still captured as text.
+            lines.append(json.dumps(rec, separators=(",", ":"), default=str) + "\n")
+        data = "".join(lines)
+        self._file.write(data)
+        self._file.flush()
+        return len(data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "path": self.path,
+            "recorded": self.recorded,
+            "pending": len(self._buffer),
+            "written": self.written,
+            "bytes_written": self.bytes_written,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+        }
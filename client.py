@@ -0,0 +1,639 @@
+"""Client library for main.py: a pooled async REST client, a blocking wrapper
+around it, and a reconnecting WebSocket client for devices.
+
+    async with AsyncClient("http://127.0.0.1:8000") as api:
+        await api.post_data("device_two", {"rpm": 1200})
+        # Concurrent send() calls are merged into POST /api/data/batch requests.
+        await asyncio.gather(*(api.send(f"sensor-{i}", i) for i in range(1000)))
+
+    with Client("http://127.0.0.1:8000") as api:  # same calls, blocking
+        api.post_data("device_two", 1)
+
+    async with DeviceSocket("ws://127.0.0.1:8000/ws", topics=["device:device_one"]) as ws:
+        await ws.send({"type": "telemetry", "device_id": "device_one", "value": 21.5})
+        async for msg in ws:
+            ...
+
+HTTP connections are kept alive and reused, so a steady stream of updates
+pays for one TCP (and TLS) handshake per pooled connection, not per request.
+GETs of ETag-tagged resources are revalidated with If-None-Match, so polling
+``get_data()`` or ``get_device()`` while nothing changes moves no body.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote, urlencode, urlsplit
+
+import websockets
+from websockets.exceptions import ConnectionClosed, WebSocketException
+
+# Final command states, as reported by GET /api/control/{id}.
+COMMAND_FINAL_STATES = ("acked", "rejected", "delivered", "failed", "expired")
+
+
+class ApiError(Exception):
+    """The server answered with an error status (or rejected one batch item)."""
+
+    def __init__(self, status: int, detail: Any, retry_after: Optional[float] = None) -> None:
+        super().__init__(f"HTTP {status}: {detail}")
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _StaleConnection(ConnectionError):
+    pass
+
+
+class Response:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: Dict[str, str], body: bytes) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> Any:
+        return json.loads(self.body) if self.body else None
+
+
+class HttpConnection:
+    """One keep-alive HTTP/1.1 connection, like a requests.Session with a single socket.
+
+    One request at a time. If the server has closed the connection while it
+    sat idle, the request is retried once on a fresh connection.
+    """
+
+    def __init__(self, host: str, port: int, tls: bool = False, timeout: float = 10.0) -> None:
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self.connects = 0
+        self.requests = 0
+
+    async def request(
+        self, method: str, path: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None
+    ) -> Response:
+        reused = self._writer is not None
+        try:
+            return await asyncio.wait_for(self._exchange(method, path, body, headers, reused), self.timeout)
+        except _StaleConnection:
+            await self.close()
+            return await asyncio.wait_for(self._exchange(method, path, body, headers, False), self.timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def post_json(self, path: str, body: bytes) -> int:
+        return (await self.request("POST", path, body)).status
+
+    async def _exchange(
+        self, method: str, path: str, body: Optional[bytes], extra: Optional[Dict[str, str]], reused: bool
+    ) -> Response:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port, ssl=self.tls or None)
+            self.connects += 1
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+        for name, value in (extra or {}).items():
+            head += f"{name}: {value}\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        try:
+            self._writer.write(head.encode("ascii") + b"\r\n" + (body or b""))
+            await self._writer.drain()
+            status_line = await self._reader.readline()
+        except ConnectionError:
+            if reused:
+                raise _StaleConnection()
+            raise
+        if not status_line:
+            if reused:
+                raise _StaleConnection()
+            raise ConnectionError("server closed the connection")
+        self.requests += 1
+        status = int(status_line.split()[1])
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if status in (204, 304) or method == "HEAD":
+            data = b""
+        elif "content-length" in headers:
+            data = await self._reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self._read_chunked()
+        else:
+            data = await self._reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return Response(status, headers, data)
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            size = int((await self._reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Trailers, then the blank line ending the body.
+                while (await self._reader.readline()) not in (b"\r\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await self._reader.readexactly(size))
+            await self._reader.readexactly(2)
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._reader = None
+
+
+class AsyncClient:
+    """Async REST client for main.py over a pool of keep-alive connections.
+
+    Up to ``pool_size`` requests run concurrently, each on its own
+    connection; idle connections are kept for the next request. ``send()``
+    buffers single updates for up to ``linger_ms`` (or until ``batch_size``
+    are waiting) and posts them together to ``/api/data/batch``; against a
+    server without the batch endpoint it falls back to concurrent
+    ``/api/data`` posts. ``429`` answers are retried up to ``max_retries``
+    times after the server's ``Retry-After``. The last body of every GET that
+    came with an ETag is kept and returned again on ``304 Not Modified``.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://127.0.0.1:8000",
+        pool_size: int = 8,
+        timeout: float = 10.0,
+        batch_size: int = 500,
+        linger_ms: float = 5.0,
+        max_retries: int = 3,
+    ) -> None:
+        parts = urlsplit(base_url)
+        self.tls = parts.scheme == "https"
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if self.tls else 80)
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000.0
+        self.max_retries = max_retries
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle: List[HttpConnection] = []
+        self._conns: List[HttpConnection] = []
+        self._batch_supported: Optional[bool] = None
+        self._buffer: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flushing: set = set()
+        # GET path -> (ETag, decoded body)
+        self._validated: Dict[str, Tuple[str, Any]] = {}
+
+        self.requests = 0
+        self.retries = 0
+        self.not_modified = 0
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    async def request(self, method: str, path: str, payload: Any = None) -> Any:
+        """Send one request and return the decoded JSON body; raises ApiError on error statuses."""
+        body = json.dumps(payload).encode("utf-8") if payload is not None else None
+        cached = self._validated.get(path) if method == "GET" else None
+        headers = {"If-None-Match": cached[0]} if cached is not None else None
+        attempt = 0
+        while True:
+            async with self._slots:
+                conn = self._idle.pop() if self._idle else self._open()
+                try:
+                    resp = await conn.request(method, self.prefix + path, body, headers)
+                finally:
+                    self._idle.append(conn)
+            self.requests += 1
+            if resp.status == 304 and cached is not None:
+                self.not_modified += 1
+                return cached[1]
+            if resp.status < 400:
+                result = resp.json()
+                etag = resp.headers.get("etag")
+                if method == "GET" and etag:
+                    self._validated[path] = (etag, result)
+                return result
+
+            try:
+                detail = resp.json().get("detail")
+            except (ValueError, AttributeError):
+                detail = resp.body.decode("utf-8", "replace")
+            retry_after = resp.headers.get("retry-after")
+            retry_after = float(retry_after) if retry_after else None
+            if resp.status == 429 and attempt < self.max_retries:
+                attempt += 1
+                self.retries += 1
+                await asyncio.sleep((retry_after or 1.0) * random.uniform(1.0, 1.5))
+                continue
+            raise ApiError(resp.status, detail, retry_after)
+
+    def _open(self) -> HttpConnection:
+        conn = HttpConnection(self.host, self.port, self.tls, self.timeout)
+        self._conns.append(conn)
+        return conn
+
+    async def status(self) -> Dict[str, Any]:
+        return await self.request("GET", "/api/status")
+
+    async def get_data(self, since: Optional[int] = None, epoch: Optional[str] = None) -> Dict[str, Any]:
+        query = {k: v for k, v in (("since", since), ("epoch", epoch)) if v is not None}
+        return await self.request("GET", "/api/data" + ("?" + urlencode(query) if query else ""))
+
+    async def get_device(self, device_id: str) -> Dict[str, Any]:
+        return await self.request("GET", f"/api/data/{quote(device_id, safe='')}")
+
+    async def post_data(self, device_id: str, value: Any) -> Dict[str, Any]:
+        return await self.request("POST", "/api/data", {"device_id": device_id, "value": value})
+
+    async def post_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Post many {device_id, value} updates; returns {"accepted", "rejected_count", "rejected"}.
+
+        Large lists are split into ``batch_size`` requests sent concurrently.
+        """
+        if self._batch_supported is not False:
+            chunks = [items[i : i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+            try:
+                results = await asyncio.gather(*(self.request("POST", "/api/data/batch", {"items": c}) for c in chunks))
+            except ApiError as exc:
+                if exc.status not in (404, 405):
+                    raise
+                self._batch_supported = False
+            else:
+                self._batch_supported = True
+                rejected = [
+                    {**r, "index": r["index"] + n * self.batch_size}
+                    for n, result in enumerate(results)
+                    for r in result["rejected"]
+                ]
+                accepted = sum(result["accepted"] for result in results)
+                return {"accepted": accepted, "rejected_count": len(rejected), "rejected": rejected}
+
+        # No batch endpoint: one request per item, as many at once as the pool allows.
+        outcomes = await asyncio.gather(
+            *(self.post_data(item["device_id"], item["value"]) for item in items), return_exceptions=True
+        )
+        rejected = [
+            {"index": index, "error": str(out.detail if isinstance(out, ApiError) else out)}
+            for index, out in enumerate(outcomes)
+            if isinstance(out, BaseException)
+        ]
+        return {"accepted": len(items) - len(rejected), "rejected_count": len(rejected), "rejected": rejected}
+
+    async def send(self, device_id: str, value: Any) -> None:
+        """Queue one update for the next batch; returns once the server stored it.
+
+        Raises ApiError if the server rejected this update.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._buffer.append(({"device_id": device_id, "value": value}, future))
+        if len(self._buffer) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.linger, self._flush)
+        await future
+
+    async def flush(self) -> None:
+        """Send buffered updates now and wait for every batch in flight."""
+        self._flush()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._buffer:
+            return
+        pending, self._buffer = self._buffer, []
+        task = asyncio.create_task(self._send_batch(pending))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _send_batch(self, pending: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        try:
+            result = await self.post_batch([item for item, _ in pending])
+        except Exception as exc:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        rejected = {r["index"]: r for r in result["rejected"]}
+        for index, (_, future) in enumerate(pending):
+            if future.done():
+                continue
+            r = rejected.get(index)
+            if r is None:
+                future.set_result(None)
+            else:
+                status = 429 if "retry_after_s" in r else 422
+                future.set_exception(ApiError(status, r["error"], r.get("retry_after_s")))
+
+    async def control(
+        self, target: str, command: str, args: Optional[Dict[str, Any]] = None, require_ack: bool = False
+    ) -> Dict[str, Any]:
+        """Queue a control command; the reply carries its ``command_id`` and ``status``."""
+        payload = {"target": target, "command": command, "args": args or {}, "require_ack": require_ack}
+        return await self.request("POST", "/api/control", payload)
+
+    async def command(self, command_id: str) -> Dict[str, Any]:
+        return await self.request("GET", f"/api/control/{command_id}")
+
+    async def wait_for_command(self, command_id: str, timeout: float = 30.0, poll: float = 0.25) -> Dict[str, Any]:
+        """Poll a command until it reaches a final state (or ``timeout`` passes) and return it."""
+        deadline = time.monotonic() + timeout
+        while True:
+            cmd = await self.command(command_id)
+            if cmd["status"] in COMMAND_FINAL_STATES or time.monotonic() >= deadline:
+                return cmd
+            await asyncio.sleep(poll)
+
+    async def add_rule(self, device_id: str, kind: str = "threshold", **spec: Any) -> Dict[str, Any]:
+        """Create a server-side alert rule, e.g. ``add_rule("d1", min=22, max=28)``; returns the rule."""
+        return (await self.request("POST", "/api/rules", {"device_id": device_id, "kind": kind, **spec}))["rule"]
+
+    async def rules(self, device_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = "?" + urlencode({"device_id": device_id}) if device_id is not None else ""
+        return (await self.request("GET", "/api/rules" + query))["rules"]
+
+    async def delete_rule(self, rule_id: str) -> Dict[str, Any]:
+        return (await self.request("DELETE", f"/api/rules/{rule_id}"))["rule"]
+
+    async def close(self) -> None:
+        await self.flush()
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            # TCP connections opened so far; compare with "requests".
+            "connections_opened": sum(conn.connects for conn in self._conns),
+            "idle_connections": len(self._idle),
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "retries": self.retries,
+            "batch_endpoint": self._batch_supported,
+        }
+
+
+class Client:
+    """Blocking wrapper: an AsyncClient running on a private event-loop thread.
+
+    Safe to share between threads; calls from several threads run
+    concurrently over the same connection pool.
+    """
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8000", **kwargs: Any) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="wsapi-client", daemon=True)
+        self._thread.start()
+        self._async = AsyncClient(base_url, **kwargs)
+
+    def _call(self, coro: Any) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def status(self) -> Dict[str, Any]:
+        return self._call(self._async.status())
+
+    def get_data(self, since: Optional[int] = None, epoch: Optional[str] = None) -> Dict[str, Any]:
+        return self._call(self._async.get_data(since, epoch))
+
+    def get_device(self, device_id: str) -> Dict[str, Any]:
+        return self._call(self._async.get_device(device_id))
+
+    def post_data(self, device_id: str, value: Any) -> Dict[str, Any]:
+        return self._call(self._async.post_data(device_id, value))
+
+    def post_batch(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return self._call(self._async.post_batch(items))
+
+    def control(
+        self, target: str, command: str, args: Optional[Dict[str, Any]] = None, require_ack: bool = False
+    ) -> Dict[str, Any]:
+        return self._call(self._async.control(target, command, args, require_ack))
+
+    def command(self, command_id: str) -> Dict[str, Any]:
+        return self._call(self._async.command(command_id))
+
+    def wait_for_command(self, command_id: str, timeout: float = 30.0, poll: float = 0.25) -> Dict[str, Any]:
+        return self._call(self._async.wait_for_command(command_id, timeout, poll))
+
+    def add_rule(self, device_id: str, kind: str = "threshold", **spec: Any) -> Dict[str, Any]:
+        return self._call(self._async.add_rule(device_id, kind, **spec))
+
+    def rules(self, device_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self._call(self._async.rules(device_id))
+
+    def delete_rule(self, rule_id: str) -> Dict[str, Any]:
+        return self._call(self._async.delete_rule(rule_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return self._async.stats()
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        self._call(self._async.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class DeviceSocket:
+    """WebSocket client for devices that stays connected.
+
+    Lost connections are re-established with exponential backoff and full
+    jitter (a random delay up to ``min_backoff * 2**n``, capped at
+    ``max_backoff``), so a fleet of devices doesn't reconnect in lockstep
+    after a server restart. Heartbeats are answered automatically. With
+    ``resume`` the reconnect asks for ``?since=<seq>``, so the ``hello``
+    after a reconnect only carries what changed. Received messages wait in a
+    queue of ``max_queue`` (oldest dropped first); ``send()`` waits for a
+    connection. With ``device_id`` the socket connects as that device
+    (``?device=<id>``), so control commands for it count as delivered.
+    """
+
+    def __init__(
+        self,
+        url: str = "ws://127.0.0.1:8000/ws",
+        topics: Optional[Iterable[str]] = None,
+        min_backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        max_queue: int = 1000,
+        resume: bool = True,
+        device_id: Optional[str] = None,
+    ) -> None:
+        self.url = url
+        self.topics = list(topics) if topics else None
+        self.device_id = device_id
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.resume = resume
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self.max_queue = max_queue
+        self._ws: Any = None
+        self._connected = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        self.epoch: Optional[str] = None
+        self.seq: Optional[int] = None
+
+        self.connects = 0
+        self.dropped = 0
+
+    async def __aenter__(self) -> "DeviceSocket":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    def __aiter__(self) -> "DeviceSocket":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        msg = await self.recv()
+        if msg is None:
+            raise StopAsyncIteration
+        return msg
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._inbox.put_nowait(None)
+
+    async def wait_connected(self, timeout: Optional[float] = None) -> None:
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def recv(self) -> Optional[Dict[str, Any]]:
+        """The next message from the server; None once the socket is closed."""
+        return await self._inbox.get()
+
+    async def send(self, msg: Dict[str, Any]) -> None:
+        """Send one message, waiting for (re)connection if necessary."""
+        data = json.dumps(msg)
+        while not self._closing:
+            await self._connected.wait()
+            ws = self._ws
+            try:
+                await ws.send(data)
+                return
+            except ConnectionClosed:
+                # The reader notices too and reconnects; try again on the new socket.
+                self._connected.clear()
+        raise ConnectionError("socket is closed")
+
+    async def ack(self, command_id: str, ok: bool = True, detail: Any = None) -> None:
+        """Acknowledge a control command so the server stops resending it."""
+        await self.send({"type": "control_ack", "command_id": command_id, "ok": ok, "detail": detail})
+
+    def _connect_url(self) -> str:
+        query: Dict[str, Any] = {}
+        if self.topics:
+            query["topics"] = ",".join(self.topics)
+        if self.device_id:
+            query["device"] = self.device_id
+        if self.resume and self.seq is not None:
+            query["since"] = self.seq
+            query["epoch"] = self.epoch
+        if not query:
+            return self.url
+        return self.url + ("&" if "?" in self.url else "?") + urlencode(query)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.min_backoff * 2 ** attempt))
+
+    async def _run(self) -> None:
+        attempt = 0
+        while not self._closing:
+            try:
+                ws = await websockets.connect(self._connect_url(), max_size=None)
+            except (OSError, asyncio.TimeoutError, WebSocketException):
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            attempt = 0
+            self.connects += 1
+            self._ws = ws
+            self._connected.set()
+            try:
+                async for raw in ws:
+                    try:
+                        msg = json.loads(raw)
+                    except ValueError:
+                        continue
+                    if msg.get("type") == "heartbeat":
+                        await ws.send('{"type":"pong"}')
+                        continue
+                    self._track(msg)
+                    if self._inbox.qsize() >= self.max_queue:
+                        self._inbox.get_nowait()
+                        self.dropped += 1
+                    self._inbox.put_nowait(msg)
+            except ConnectionClosed:
+                pass
+            finally:
+                self._connected.clear()
+                self._ws = None
+                await ws.close()
+            if not self._closing:
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+
+    def _track(self, msg: Dict[str, Any]) -> None:
+        # Remember the newest state sequence number for ?since= on reconnect.
+        msg_type = msg.get("type")
+        if msg_type == "hello":
+            self.epoch = msg.get("epoch")
+            self.seq = msg.get("seq")
+        elif msg_type == "data_update" and isinstance(msg.get("seq"), int):
+            self.seq = max(self.seq or 0, msg["seq"])
+        elif msg_type == "data_update_batch":
+            for update in msg.get("updates", ()):
+                if isinstance(update.get("seq"), int):
+                    self.seq = max(self.seq or 0, update["seq"])
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+# Command lifecycle:
+#   queued   -> no client for the target yet; sent when one subscribes
+#   sent     -> delivered to the target's subscribers, waiting for control_ack
+#   acked    -> the device confirmed it (ok: true)
+#   rejected -> the device answered ok: false
+#   delivered-> sent to the target, no ack requested
+#   failed   -> no ack after max_attempts deliveries
+#   expired  -> not acked within ttl
+FINAL_STATES = ("acked", "rejected", "delivered", "failed", "expired")
+
+
+def _utc(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts is not None else None
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Command:
+    __slots__ = (
+        "id", "target", "command", "args", "source", "require_ack", "status", "attempts",
+        "created_at", "expires_at", "last_sent_at", "finished_at", "detail", "_sent_mono",
+    )
+
+    def __init__(
+        self, target: str, command: str, args: Dict[str, Any], source: str, require_ack: bool, ttl: float
+    ) -> None:
+        now = time.time()
+        self.id = uuid.uuid4().hex
+        self.target = target
+        self.command = command
+        self.args = args
+        self.source = source
+        self.require_ack = require_ack
+        self.status = "queued"
+        self.attempts = 0
+        self.created_at = now
+        self.expires_at = now + ttl
+        self.last_sent_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.detail: Any = None
+        self._sent_mono = 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINAL_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "command_id": self.id,
+            "target": self.target,
+            "command": self.command,
+            "args": self.args,
+            "source": self.source,
+            "require_ack": self.require_ack,
+            "status": self.status,
+            "attempts": self.attempts,
+            "created_utc": _utc(self.created_at),
+            "expires_utc": _utc(self.expires_at),
+            "last_sent_utc": _utc(self.last_sent_at),
+            "finished_utc": _utc(self.finished_at),
+            "detail": self.detail,
+        }
+
+
+class CommandQueue:
+    """Per-target queues of control commands with acks, retries and expiry.
+
+    ``send(command)`` publishes one delivery attempt and returns how many
+    clients it reached. A command nobody received stays queued until a client
+    for its target subscribes (``flush_target``). Unacknowledged commands are
+    resent every ``ack_timeout`` seconds, up to ``max_attempts`` deliveries,
+    and expire after ``ttl`` seconds. At most ``max_pending_per_target``
+    commands wait per target, and the status of at most ``max_tracked``
+    commands is remembered.
+
+    With ``assume_delivered`` (multi-worker buses, where the device may be
+    attached to another process) every publish counts as a delivery.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Command], Awaitable[int]],
+        ack_timeout: float = 5.0,
+        max_attempts: int = 5,
+        ttl: float = 300.0,
+        max_pending_per_target: int = 100,
+        max_tracked: int = 10000,
+        assume_delivered: bool = False,
+        tick: float = 0.5,
+    ) -> None:
+        self.send = send
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        self.ttl = ttl
+        self.max_pending_per_target = max_pending_per_target
+        self.max_tracked = max_tracked
+        self.assume_delivered = assume_delivered
+        self.tick = tick
+        self._pending: Dict[str, Deque[Command]] = {}
+        self._pending_count = 0
+        self._records: "OrderedDict[str, Command]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.counts: Dict[str, int] = {state: 0 for state in FINAL_STATES}
+        self.retries = 0
+        self.rejected_full = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.check_timeouts()
+            except Exception:
+                # Never let one bad pass stop retries and expiry.
+                pass
+
+    async def submit(
+        self, target: str, command: str, args: Dict[str, Any], source: str, require_ack: bool = False
+    ) -> Command:
+        """Queue a command and try to deliver it right away. Raises QueueFull."""
+        queue = self._pending.get(target)
+        if queue is not None and len(queue) >= self.max_pending_per_target:
+            self.rejected_full += 1
+            raise QueueFull(f"{len(queue)} commands already pending for {target!r}")
+        if self._pending_count >= self.max_tracked:
+            self.rejected_full += 1
+            raise QueueFull("too many pending commands")
+
+        cmd = Command(target, command, args, source, require_ack, self.ttl)
+        self._remember(cmd)
+        if queue is None:
+            queue = self._pending[target] = deque()
+        queue.append(cmd)
+        self._pending_count += 1
+        await self._deliver(cmd)
+        return cmd
+
+    @property
+    def pending(self) -> int:
+        return self._pending_count
+
+    def get(self, command_id: str) -> Optional[Command]:
+        return self._records.get(command_id)
+
+    def ack(self, command_id: str, ok: bool = True, detail: Any = None) -> Optional[Command]:
+        """Apply a device acknowledgement. Unknown or finished commands are ignored."""
+        cmd = self._records.get(command_id)
+        if cmd is None or cmd.done:
+            return cmd
+        cmd.detail = detail
+        self._finish(cmd, "acked" if ok else "rejected")
+        return cmd
+
+    async def flush_target(self, target: str) -> int:
+        """A client for ``target`` just subscribed: send everything still waiting for it."""
+        sent = 0
+        for cmd in list(self._pending.get(target, ())):
+            if not cmd.done and cmd.status == "queued":
+                await self._deliver(cmd)
+                sent += 1
+        return sent
+
+    async def check_timeouts(self) -> None:
+        now = time.time()
+        mono = time.monotonic()
+        for queue in list(self._pending.values()):
+            for cmd in list(queue):
+                if cmd.done:
+                    continue
+                if now >= cmd.expires_at:
+                    self._finish(cmd, "expired")
+                elif cmd.status == "sent" and mono - cmd._sent_mono >= self.ack_timeout:
+                    if cmd.attempts >= self.max_attempts:
+                        self._finish(cmd, "failed")
+                    else:
+                        self.retries += 1
+                        await self._deliver(cmd)
+
+    async def _deliver(self, cmd: Command) -> None:
+        recipients = await self.send(cmd)
+        if recipients == 0 and not self.assume_delivered:
+            cmd.status = "queued"
+            return
+        cmd.attempts += 1
+        cmd.last_sent_at = time.time()
+        cmd._sent_mono = time.monotonic()
+        if cmd.require_ack:
+            cmd.status = "sent"
+        else:
+            self._finish(cmd, "delivered")
+
+    def _finish(self, cmd: Command, status: str) -> None:
+        cmd.status = status
+        cmd.finished_at = time.time()
+        self.counts[status] += 1
+        queue = self._pending.get(cmd.target)
+        if queue is not None:
+            try:
+                queue.remove(cmd)
+                self._pending_count -= 1
+            except ValueError:
+                pass
+            if not queue:
+                del self._pending[cmd.target]
+
+    def _remember(self, cmd: Command) -> None:
+        records = self._records
+        records[cmd.id] = cmd
+        # Forget the oldest finished commands; pending ones are bounded by submit().
+        while len(records) > self.max_tracked:
+            for command_id, old in records.items():
+                if old.done:
+                    del records[command_id]
+                    break
+            else:
+                break
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "targets_with_pending": len(self._pending),
+            "tracked": len(self._records),
+            "retries": self.retries,
+            "rejected_queue_full": self.rejected_full,
+            "ack_timeout_s": self.ack_timeout,
+            "max_attempts": self.max_attempts,
+            "ttl_s": self.ttl,
+            **self.counts,
+        }
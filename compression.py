@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:  # Optional brotli support for REST responses
+    import brotli
+except ImportError:  # pragma: no cover - depends on environment
+    brotli = None
+
+# Streams and already-compressed bodies are passed through untouched.
+SKIP_CONTENT_TYPES = ("text/event-stream", "image/", "audio/", "video/", "application/gzip", "application/zip")
+
+
+class CompressionStats:
+    """Bytes in/out and CPU time per codec, so it's visible where compression pays off."""
+
+    def __init__(self) -> None:
+        # codec -> [count, raw_bytes, wire_bytes, cpu_seconds]
+        self._codecs: Dict[str, List[float]] = {}
+        self.skipped_small = 0
+        self.cache_hits = 0
+
+    def record(self, codec: str, raw_bytes: int, wire_bytes: int, cpu_s: float) -> None:
+        c = self._codecs.get(codec)
+        if c is None:
+            c = self._codecs[codec] = [0, 0, 0, 0.0]
+        c[0] += 1
+        c[1] += raw_bytes
+        c[2] += wire_bytes
+        c[3] += cpu_s
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "skipped_below_threshold": self.skipped_small,
+            "served_from_cache": self.cache_hits,
+            "codecs": {
+                codec: {
+                    "count": int(count),
+                    "raw_bytes": int(raw),
+                    "wire_bytes": int(wire),
+                    "ratio": round(raw / wire, 3) if wire else None,
+                    "cpu_ms": round(cpu_s * 1000, 3),
+                    "cpu_us_per_kib": round(cpu_s * 1e6 / (raw / 1024), 3) if raw else None,
+                }
+                for codec, (count, raw, wire, cpu_s) in self._codecs.items()
+            },
+        }
+
+
+def deflate(data: bytes, level: int) -> Tuple[bytes, float]:
+    """zlib-wrapped deflate (what browsers' DecompressionStream("deflate") reads) plus CPU seconds spent."""
+    start = time.perf_counter()
+    out = zlib.compress(data, level)
+    return out, time.perf_counter() - start
+
+
+def _accepted_codings(header: str) -> Dict[str, float]:
+    # "br;q=1.0, gzip;q=0.8, *;q=0" -> {"br": 1.0, "gzip": 0.8, "*": 0.0}
+    accepted: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+class HTTPCompressionMiddleware:
+    """ASGI middleware: brotli or gzip for complete REST responses of at least ``minimum_size`` bytes.
+
+    Only single-message bodies are compressed; streaming responses (e.g.
+    server-sent events) pass through unchanged so nothing is held back.
+    ``codecs`` lists what the server may use, in order of preference.
+    Responses that carry an ETag are compressed once per URL, ETag and codec:
+    the last ``cache_size`` such bodies are kept, so a polled resource that
+    hasn't changed is not compressed again.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        minimum_size: int = 1024,
+        codecs: Sequence[str] = ("br", "gzip"),
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        stats: Optional[CompressionStats] = None,
+        cache_size: int = 32,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.codecs = [c for c in codecs if c == "gzip" or (c == "br" and brotli is not None)]
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.stats = stats if stats is not None else CompressionStats()
+        self.cache_size = cache_size
+        # (path, query string, ETag, codec) -> compressed body
+        self._cache: "OrderedDict[Tuple[str, bytes, bytes, str], bytes]" = OrderedDict()
+
+    def _choose(self, scope: Dict[str, Any]) -> Optional[str]:
+        header = ""
+        for name, value in scope.get("headers") or ():
+            if name == b"accept-encoding":
+                header = value.decode("latin-1")
+                break
+        if not header:
+            return None
+        accepted = _accepted_codings(header)
+        for codec in self.codecs:
+            if accepted.get(codec, accepted.get("*", 0.0)) > 0:
+                return codec
+        return None
+
+    def _compress(self, codec: str, body: bytes) -> bytes:
+        start = time.perf_counter()
+        if codec == "br":
+            out = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            out = zlib.compress(body, self.gzip_level, wbits=16 + zlib.MAX_WBITS)
+        self.stats.record(codec, len(body), len(out), time.perf_counter() - start)
+        return out
+
+    def _cached_compress(self, scope: Dict[str, Any], start: Dict[str, Any], codec: str, body: bytes) -> bytes:
+        etag = dict(start.get("headers") or ()).get(b"etag")
+        if etag is None or self.cache_size <= 0:
+            return self._compress(codec, body)
+        key = (scope.get("path", ""), scope.get("query_string", b""), etag, codec)
+        out = self._cache.get(key)
+        if out is not None:
+            self._cache.move_to_end(key)
+            self.stats.cache_hits += 1
+            return out
+        out = self._cache[key] = self._compress(codec, body)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return out
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not self.codecs:
+            await self.app(scope, receive, send)
+            return
+        codec = self._choose(scope)
+        if codec is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Dict[str, Any]] = None
+        passthrough = False
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = dict(message.get("headers") or ())
+                content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+                if (
+                    b"content-encoding" in headers
+                    or content_type.startswith(SKIP_CONTENT_TYPES)
+                    or message.get("status") in (204, 304)
+                ):
+                    passthrough = True
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            if message.get("more_body", False):
+                # Streaming response: send as-is.
+                passthrough = True
+            elif len(body) < self.minimum_size:
+                self.stats.skipped_small += 1
+            else:
+                body = self._cached_compress(scope, start, codec, body)
+                headers = [(k, v) for k, v in start.get("headers") or () if k != b"content-length"]
+                headers += [
+                    (b"content-encoding", codec.encode("ascii")),
+                    (b"content-length", str(len(body)).encode("ascii")),
+                    (b"vary", b"Accept-Encoding"),
+                ]
+                start = {**start, "headers": headers}
+                message = {**message, "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,25 +1,37 @@
 import asyncio
-import json
 import random
-import websockets
 
+from client import DeviceSocket
+
+# Connect as device_one: only events about / addressed to this device (e.g.
+# control commands) are received, and commands count as delivered to it.
+# DeviceSocket reconnects with jittered backoff and answers server heartbeats.
 WS_URL = "ws://127.0.0.1:8000/ws"
+DEVICE_ID = "device_one"
 
 async def run():
-    async with websockets.connect(WS_URL) as ws:
+    async with DeviceSocket(WS_URL, device_id=DEVICE_ID) as ws:
         # Receive initial hello
         hello = await ws.recv()
         print("[device_one] server hello:", hello)
+        applied = set()
 
         for i in range(10):
             value = round(random.uniform(20.0, 30.0), 2)
             msg = {"type": "telemetry", "device_id": "device_one", "value": value}
-            await ws.send(json.dumps(msg))
+            await ws.send(msg)
             print("[device_one] sent telemetry:", msg)
 
             # Listen for one broadcast (optional)
-            broadcast = await ws.recv()
-            print("[device_one] received:", broadcast)
+            event = await ws.recv()
+            print("[device_one] received:", event)
+            if event.get("type") == "control" and event.get("target") == "device_one":
+                # Acknowledge so the server stops resending; a resend has the same
+                # command_id, so apply each command only once.
+                if event["command_id"] not in applied:
+                    applied.add(event["command_id"])
+                    print("[device_one] applying:", event["command"], event["args"])
+                await ws.ack(event["command_id"])
 
             await asyncio.sleep(1)
 
@@ -1,32 +1,34 @@
-import time
 import random
-import requests
+import time
+
+from client import Client
 
 BASE = "http://127.0.0.1:8000"
 
-def post_data(device_id: str, value):
-    r = requests.post(f"{BASE}/api/data", json={"device_id": device_id, "value": value}, timeout=5)
-    r.raise_for_status()
-    return r.json()
+if __name__ == "__main__":
+    # One pooled keep-alive client for every call, instead of a new connection per request.
+    with Client(BASE) as api:
+        for _ in range(5):
+            v = {"rpm": random.randint(900, 1600), "mode": "auto"}
+            out = api.post_data("device_two", v)
+            print("[device_two] posted REST data:", out["event"])
+            time.sleep(1)
 
-def send_control(target: str, command: str, args=None):
-    r = requests.post(
-        f"{BASE}/api/control",
-        json={"target": target, "command": command, "args": args or {}},
-        timeout=5,
-    )
-    r.raise_for_status()
-    return r.json()
+        # The server checks device_one's readings against the range and publishes
+        # "alert" events when it leaves or re-enters it (subscribe to type:alert).
+        existing = [r for r in api.rules("device_one") if r["name"] == "device_one range"]
+        rule = existing[0] if existing else api.add_rule(
+            "device_one", "threshold", min=22.0, max=28.0, hysteresis=0.5, name="device_one range"
+        )
+        print("[device_two] rule:", rule["rule_id"], rule["state"])
 
-if __name__ == "__main__":
-    for _ in range(5):
-        v = {"rpm": random.randint(900, 1600), "mode": "auto"}
-        out = post_data("device_two", v)
-        print("[device_two] posted REST data:", out["event"])
-        time.sleep(1)
+        out = api.control("device_one", "set_threshold", {"min": 22.0, "max": 28.0}, require_ack=True)
+        print("[device_two] sent control:", out["command_id"], out["status"])
 
-    out = send_control("device_one", "set_threshold", {"min": 22.0, "max": 28.0})
-    print("[device_two] sent control:", out["event"])
+        # "sent" until device_one acknowledges it; "queued" while it is offline.
+        cmd = api.wait_for_command(out["command_id"], timeout=5)
+        print("[device_two] control status:", cmd["status"], "after", cmd["attempts"], "attempt(s)")
 
-    status = requests.get(f"{BASE}/api/status", timeout=5).json()
-    print("[device_two] status:", status)
+        status = api.status()
+        print("[device_two] status:", status)
+        print("[device_two] client:", api.stats())
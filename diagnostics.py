@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+def _utc(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class StallWatchdog:
+    """Catches the code that is blocking the event loop, while it is blocking it.
+
+    A heartbeat task on the loop stamps the time every ``interval`` seconds. A
+    separate thread checks the stamp; once it is more than ``threshold``
+    seconds old the loop is stuck, and the thread samples the loop thread's
+    Python stack (and the asyncio task it is running) every ``interval``
+    until the heartbeat resumes. Each stall is kept with its duration and
+    the distinct stacks seen, newest last.
+    """
+
+    def __init__(
+        self, threshold: float = 0.1, interval: float = 0.02, max_stalls: int = 50, max_samples: int = 20
+    ) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.max_samples = max_samples
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self._beat = time.perf_counter()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # Guards self.stalls between the watchdog thread and readers on the loop.
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        stall: Optional[Dict[str, Any]] = None
+        stall_beat = 0.0
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            behind = time.perf_counter() - beat - self.interval
+            if behind < self.threshold:
+                stall = None
+                continue
+            if stall is None or beat != stall_beat:
+                stall_beat = beat
+                stall = {"started_utc": _utc(time.time() - behind), "duration_ms": 0.0, "samples": 0, "stacks": []}
+                with self._lock:
+                    self.stalls.append(stall)
+                    self.stall_count += 1
+            self._sample(stall, behind)
+
+    def _sample(self, stall: Dict[str, Any], behind: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = [line.rstrip() for line in traceback.format_stack(frame)]
+        task = asyncio.current_task(self._loop)
+        task_name = None
+        if task is not None:
+            coro = task.get_coro()
+            task_name = f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+        with self._lock:
+            stall["duration_ms"] = round(behind * 1000, 3)
+            stall["samples"] += 1
+            for seen in stall["stacks"]:
+                if seen["stack"] == stack:
+                    seen["samples"] += 1
+                    return
+            if len(stall["stacks"]) < self.max_samples:
+                stall["stacks"].append({"task": task_name, "samples": 1, "stack": stack})
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            stalls = [dict(s, stacks=list(s["stacks"])) for s in self.stalls]
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "sample_interval_ms": self.interval * 1000,
+            "stalls_total": self.stall_count,
+            "recent_stalls": stalls,
+        }
+
+
+class HandlerTimings:
+    """Per-handler duration totals plus the N slowest individual calls.
+
+    ``kind`` is "rest" or "ws"; ``name`` is the route (``GET /api/data``) or
+    WebSocket message type. Only called from the event loop.
+    """
+
+    def __init__(self, slowest: int = 20) -> None:
+        self.keep = slowest
+        # (kind, name) -> [count, total_s, max_s]
+        self._totals: Dict[Tuple[str, str], List[float]] = {}
+        # min-heap of (seconds, tiebreak, record): the root is the fastest kept
+        self._slowest: List[Tuple[float, int, Dict[str, Any]]] = []
+        self._n = 0
+
+    def record(self, kind: str, name: str, seconds: float, detail: Optional[str] = None) -> None:
+        t = self._totals.get((kind, name))
+        if t is None:
+            t = self._totals[(kind, name)] = [0, 0.0, 0.0]
+        t[0] += 1
+        t[1] += seconds
+        if seconds > t[2]:
+            t[2] = seconds
+
+        heap = self._slowest
+        if len(heap) < self.keep or seconds > heap[0][0]:
+            self._n += 1
+            rec = {"kind": kind, "name": name, "ms": round(seconds * 1000, 3), "at_utc": _utc(time.time())}
+            if detail:
+                rec["detail"] = detail
+            if len(heap) < self.keep:
+                heapq.heappush(heap, (seconds, self._n, rec))
+            else:
+                heapq.heapreplace(heap, (seconds, self._n, rec))
+
+    def report(self) -> Dict[str, Any]:
+        handlers = [
+            {
+                "kind": kind,
+                "name": name,
+                "count": int(count),
+                "avg_ms": round(total / count * 1000, 3),
+                "max_ms": round(worst * 1000, 3),
+                "total_ms": round(total * 1000, 3),
+            }
+            for (kind, name), (count, total, worst) in self._totals.items()
+        ]
+        handlers.sort(key=lambda h: h["max_ms"], reverse=True)
+        return {
+            "slowest_calls": [rec for _, _, rec in sorted(self._slowest, reverse=True)],
+            "handlers": handlers,
+        }
+
+
+class HandlerTimingMiddleware:
+    """ASGI middleware timing every REST request by its route template."""
+
+    def __init__(self, app: Any, timings: HandlerTimings) -> None:
+        self.app = app
+        self.timings = timings
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        streaming = False
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal streaming
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers") or ())
+                streaming = headers.get(b"content-type", b"").startswith(b"text/event-stream")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # An event stream lasts as long as its subscriber; that's not handler time.
+            if not streaming:
+                route = scope.get("route")
+                path = getattr(route, "path", None) or scope.get("path", "?")
+                self.timings.record("rest", f"{scope['method']} {path}", time.perf_counter() - start)
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import random
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+# handler(event, remote) -> result of delivering it to this process's clients
+Handler = Callable[[Dict[str, Any], bool], Awaitable[Any]]
+
+
+class EventBus:
+    """In-process bus: published events are only delivered to this process."""
+
+    name = "local"
+
+    def __init__(self) -> None:
+        self.node_id = uuid.uuid4().hex[:12]
+        self._handler: Optional[Handler] = None
+        self.published = 0
+        self.received = 0
+
+    def set_handler(self, handler: Handler) -> None:
+        self._handler = handler
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, event: Dict[str, Any]) -> Any:
+        """Deliver locally, then forward to the other processes (if any)."""
+        self.published += 1
+        result = await self._handler(event, False)
+        self._forward(event)
+        return result
+
+    def _forward(self, event: Dict[str, Any]) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "node_id": self.node_id,
+            "published": self.published,
+            "received": self.received,
+        }
+
+
+class UnixSocketBus(EventBus):
+    """Cross-process bus through a small broker on a Unix domain socket.
+
+    Every worker connects to the broker; each line a worker sends is relayed
+    to every other worker. The first worker to take an flock on
+    ``<path>.lock`` hosts the broker in its own event loop, so
+    ``uvicorn --workers N`` needs no extra process; a standalone broker can
+    also be run with ``python event_bus.py --socket <path>``. If the hosting
+    worker exits, the others reconnect and one of them takes over.
+    """
+
+    name = "unix"
+
+    def __init__(self, path: str, embed_broker: bool = True, max_buffer: int = 16 * 1024 * 1024) -> None:
+        super().__init__()
+        self.path = path
+        self.embed_broker = embed_broker
+        self.max_buffer = max_buffer
+        self._broker: Optional[Broker] = None
+        self._lock_fd: Optional[int] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        self.reconnects = 0
+        self.dropped = 0
+        self.decode_errors = 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._broker is not None:
+            await self._broker.stop()
+            self._broker = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def _maybe_host_broker(self) -> None:
+        if not self.embed_broker or self._broker is not None:
+            return
+        fd = _take_broker_lock(self.path, block=False)
+        if fd is None:
+            return
+        self._lock_fd = fd
+        self._broker = Broker(self.path, self.max_buffer)
+        await self._broker.start()
+
+    async def _run(self) -> None:
+        backoff = 0.05
+        while True:
+            try:
+                await self._maybe_host_broker()
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=self.max_buffer)
+            except OSError:
+                await asyncio.sleep(backoff * (1 + random.random()))
+                backoff = min(backoff * 2, 2.0)
+                continue
+
+            backoff = 0.05
+            self._writer = writer
+            self.connected = True
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        frame = json.loads(line)
+                    except ValueError:
+                        self.decode_errors += 1
+                        continue
+                    if frame.get("node") == self.node_id:
+                        continue
+                    self.received += 1
+                    try:
+                        await self._handler(frame["event"], True)
+                    except Exception:
+                        # A bad remote event must not take the bus down.
+                        pass
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                pass
+            finally:
+                self.connected = False
+                self._writer = None
+                writer.close()
+            self.reconnects += 1
+
+    def _forward(self, event: Dict[str, Any]) -> None:
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            self.dropped += 1
+            return
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            # Broker isn't keeping up; shed rather than grow without bound.
+            self.dropped += 1
+            return
+        line = json.dumps({"node": self.node_id, "event": event}, separators=(",", ":"))
+        writer.write(line.encode("utf-8") + b"\n")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "socket": self.path,
+            "connected": self.connected,
+            "hosts_broker": self._broker is not None,
+            "reconnects": self.reconnects,
+            "dropped": self.dropped,
+            "decode_errors": self.decode_errors,
+        }
+
+
+def _take_broker_lock(path: str, block: bool) -> Optional[int]:
+    """flock ``<path>.lock``; whoever holds it is the one broker for ``path``."""
+    fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if block else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Broker:
+    """Relays newline-delimited frames from each peer to every other peer."""
+
+    def __init__(self, path: str, max_buffer: int = 16 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_buffer = max_buffer
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        # Only called while holding the election lock, so any existing socket
+        # file belongs to a broker that is gone.
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._serve, self.path, limit=self.max_buffer)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        await self._server.serve_forever()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._peers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                for peer in list(self._peers):
+                    if peer is writer:
+                        continue
+                    if peer.transport.get_write_buffer_size() > self.max_buffer:
+                        # Stuck peer: drop it; it will reconnect.
+                        self._peers.discard(peer)
+                        peer.close()
+                        continue
+                    peer.write(line)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+
+def make_bus(backend: str, socket_path: str) -> EventBus:
+    if backend == "local":
+        return EventBus()
+    if backend == "unix":
+        return UnixSocketBus(socket_path)
+    raise RuntimeError(f"EVENT_BUS must be 'local' or 'unix', got {backend!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Standalone event-bus broker for multi-worker deployments.")
+    parser.add_argument("--socket", default="/tmp/wsapi-bus.sock")
+    args = parser.parse_args()
+
+    # Wait for (and then keep) the broker lock so embedded brokers stand down.
+    _take_broker_lock(args.socket, block=True)
+    asyncio.run(Broker(args.socket).serve_forever())
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import math
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+class _Ring:
+    """Fixed-capacity ring of parallel ``array('d')`` columns, ordered oldest first.
+
+    Memory grows with the number of rows actually stored, up to ``capacity``.
+    Column 0 is the (non-decreasing) timestamp used for range lookups.
+    """
+
+    def __init__(self, capacity: int, columns: int) -> None:
+        self.capacity = capacity
+        self.cols = [array("d") for _ in range(columns)]
+        self.start = 0
+
+    def __len__(self) -> int:
+        return len(self.cols[0])
+
+    def phys(self, i: int) -> int:
+        return (self.start + i) % len(self.cols[0])
+
+    def append(self, row: Sequence[float]) -> None:
+        if len(self) < self.capacity:
+            for col, v in zip(self.cols, row):
+                col.append(v)
+        else:
+            idx = self.start
+            for col, v in zip(self.cols, row):
+                col[idx] = v
+            self.start = (self.start + 1) % self.capacity
+
+    def oldest(self) -> Optional[float]:
+        return self.cols[0][self.start] if len(self) else None
+
+    def _lower_bound(self, t: float) -> int:
+        ts = self.cols[0]
+        lo, hi = 0, len(ts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[self.phys(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def scan(self, t0: float, t1: float) -> Iterator[int]:
+        """Physical row indexes with t0 <= t < t1, oldest first."""
+        n = len(self)
+        if not n:
+            return iter(())
+        lo, hi = self._lower_bound(t0), self._lower_bound(t1)
+        a, b = self.start + lo, self.start + hi
+        if b <= n:
+            return iter(range(a, b))
+        if a >= n:
+            return iter(range(a - n, b - n))
+        return iter([*range(a, n), *range(0, b - n)])
+
+    def nbytes(self) -> int:
+        return sum(col.itemsize * len(col) for col in self.cols)
+
+
+class _Tier:
+    """Rollup buckets (start, min, max, sum, count, last) of a fixed resolution.
+
+    Only the newest ("open") bucket is ever updated.
+    """
+
+    def __init__(self, resolution: float, capacity: int) -> None:
+        self.resolution = resolution
+        self.ring = _Ring(capacity, 6)
+        self.open_bucket: Optional[float] = None
+        self.open_row = 0
+
+    def add(self, t: float, v: float) -> None:
+        bucket = t - (t % self.resolution)
+        if bucket == self.open_bucket:
+            i = self.open_row
+            _, mins, maxs, sums, counts, lasts = self.ring.cols
+            if v < mins[i]:
+                mins[i] = v
+            if v > maxs[i]:
+                maxs[i] = v
+            sums[i] += v
+            counts[i] += 1
+            lasts[i] = v
+        elif self.open_bucket is None or bucket > self.open_bucket:
+            ring = self.ring
+            ring.append((bucket, v, v, v, 1.0, v))
+            self.open_bucket = bucket
+            self.open_row = ring.phys(len(ring) - 1)
+        # Samples older than the open bucket only land in the raw ring.
+
+
+class Series:
+    """History of one numeric signal: raw samples plus pre-aggregated rollup tiers."""
+
+    def __init__(self, raw_points: int, tiers: Sequence[Tuple[float, int]]) -> None:
+        self.raw = _Ring(raw_points, 2)
+        self.tiers = [_Tier(resolution, capacity) for resolution, capacity in tiers]
+
+    def add(self, t: float, v: float) -> None:
+        raw = self.raw
+        ts, vs = raw.cols
+        if len(ts) < raw.capacity:
+            ts.append(t)
+            vs.append(v)
+        else:
+            ts[raw.start] = t
+            vs[raw.start] = v
+            raw.start = (raw.start + 1) % raw.capacity
+        for tier in self.tiers:
+            tier.add(t, v)
+
+    def _source(self, t0: float, step: float) -> Tuple[float, _Ring]:
+        # Coarsest level that is no coarser than the step and still reaches t0;
+        # if none reaches back that far, the coarsest one allowed by the step.
+        levels: List[Tuple[float, _Ring]] = [(0.0, self.raw)] + [
+            (tier.resolution, tier.ring) for tier in self.tiers if tier.resolution <= step
+        ]
+        for resolution, ring in reversed(levels):
+            oldest = ring.oldest()
+            if oldest is not None and oldest <= t0:
+                return resolution, ring
+        return levels[-1]
+
+    def query(self, t0: float, t1: float, step: float) -> List[Dict[str, Any]]:
+        resolution, ring = self._source(t0, step)
+        buckets: Dict[float, List[float]] = {}
+        cols = ring.cols
+        if resolution == 0.0:
+            ts, vs = cols
+            for i in ring.scan(t0, t1):
+                key = math.floor(ts[i] / step) * step
+                v = vs[i]
+                b = buckets.get(key)
+                if b is None:
+                    buckets[key] = [v, v, v, 1.0, v]
+                else:
+                    if v < b[0]:
+                        b[0] = v
+                    if v > b[1]:
+                        b[1] = v
+                    b[2] += v
+                    b[3] += 1
+                    b[4] = v
+        else:
+            # Include the rollup bucket that t0 falls inside.
+            ts, mins, maxs, sums, counts, lasts = cols
+            for i in ring.scan(t0 - (t0 % resolution), t1):
+                key = math.floor(ts[i] / step) * step
+                b = buckets.get(key)
+                if b is None:
+                    buckets[key] = [mins[i], maxs[i], sums[i], counts[i], lasts[i]]
+                else:
+                    if mins[i] < b[0]:
+                        b[0] = mins[i]
+                    if maxs[i] > b[1]:
+                        b[1] = maxs[i]
+                    b[2] += sums[i]
+                    b[3] += counts[i]
+                    b[4] = lasts[i]
+
+        return [
+            {
+                "t": key,
+                "min": b[0],
+                "max": b[1],
+                "avg": b[2] / b[3],
+                "last": b[4],
+                "count": int(b[3]),
+            }
+            for key, b in buckets.items()
+        ]
+
+    def nbytes(self) -> int:
+        return self.raw.nbytes() + sum(tier.ring.nbytes() for tier in self.tiers)
+
+
+def is_number(v: Any) -> bool:
+    """A finite int or float (not a bool); the test for a usable numeric sample."""
+    if not isinstance(v, (int, float)) or isinstance(v, bool):
+        return False
+    try:
+        return math.isfinite(v)
+    except OverflowError:
+        # An int too large for a float (e.g. 10**400) is not a usable sample.
+        return False
+
+
+class HistoryStore:
+    """Bounded per-device time series for numeric telemetry.
+
+    A scalar value is stored under the device itself (field ``None``); numeric
+    members of an object value (e.g. ``{"rpm": 1200}``) are stored per field.
+    At most ``max_series`` series are tracked; samples for new series beyond
+    that are counted in ``rejected_series_samples`` and dropped.
+    """
+
+    def __init__(
+        self,
+        max_series: int = 1000,
+        raw_points: int = 10000,
+        tiers: Sequence[Tuple[float, int]] = ((1.0, 21600), (60.0, 10080)),
+    ) -> None:
+        self.max_series = max_series
+        self.raw_points = raw_points
+        self.tiers = tuple(tiers)
+        self._series: Dict[Tuple[str, Optional[str]], Series] = {}
+        self.samples = 0
+        self.rejected_series_samples = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_series > 0
+
+    def _add(self, key: Tuple[str, Optional[str]], t: float, v: float) -> None:
+        series = self._series.get(key)
+        if series is None:
+            if len(self._series) >= self.max_series:
+                self.rejected_series_samples += 1
+                return
+            series = self._series[key] = Series(self.raw_points, self.tiers)
+        series.add(t, float(v))
+        self.samples += 1
+
+    def record(self, device_id: str, value: Any, t: float) -> None:
+        if not self.enabled:
+            return
+        if is_number(value):
+            self._add((device_id, None), t, value)
+        elif isinstance(value, dict):
+            for field, v in value.items():
+                if is_number(v):
+                    self._add((device_id, field), t, v)
+
+    def fields(self, device_id: str) -> List[Optional[str]]:
+        return [field for dev, field in self._series if dev == device_id]
+
+    def query(
+        self, device_id: str, field: Optional[str], t0: float, t1: float, step: float
+    ) -> Optional[List[Dict[str, Any]]]:
+        series = self._series.get((device_id, field))
+        if series is None:
+            return None
+        return series.query(t0, t1, step)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "series": len(self._series),
+            "max_series": self.max_series,
+            "raw_points_per_series": self.raw_points,
+            "rollup_tiers": [{"resolution_s": res, "buckets": cap} for res, cap in self.tiers],
+            "samples": self.samples,
+            "rejected_series_samples": self.rejected_series_samples,
+            "bytes": sum(s.nbytes() for s in self._series.values()),
+        }
@@ -0,0 +1,321 @@
+"""Load generator for main.py.
+
+Simulates many WebSocket devices (like device_one.py) and REST devices (like
+device_two.py) sending telemetry at a fixed rate, plus passive dashboard
+subscribers. Every value carries its send time, so subscribers can measure
+fan-out latency (sent -> received). Prints one JSON report on stdout.
+
+    python loadgen.py --ws-devices 500 --rest-devices 100 --rate 2 --subscribers 20 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import websockets
+
+from client import HttpConnection
+
+REPORT_VERSION = 1
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.sent = {"websocket": 0, "rest": 0}
+        self.send_errors = {"websocket": 0, "rest": 0}
+        self.throttled = {"websocket": 0, "rest": 0}
+        self.connect_errors = 0
+        self.behind_schedule = 0
+        self.received = 0
+        self.late = 0
+        self.latencies = array("d")
+        self.subscriber_disconnects = 0
+
+
+def make_value(device_id: str, n: int, payload: str) -> Dict[str, Any]:
+    value = {"lg": device_id, "n": n, "t": time.perf_counter()}
+    if payload == "object":
+        value.update({"rpm": random.randint(900, 1600), "temp_c": round(random.uniform(20.0, 30.0), 2), "mode": "auto"})
+    else:
+        value["v"] = round(random.uniform(20.0, 30.0), 2)
+    return value
+
+
+async def paced(interval: float, deadline: float, stats: Stats, send) -> None:
+    # Fixed schedule from a random phase, so devices don't all fire together.
+    next_at = time.perf_counter() + random.uniform(0, interval)
+    n = 0
+    while next_at < deadline:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -interval:
+            stats.behind_schedule += 1
+        n += 1
+        await send(n)
+        next_at += interval
+
+
+async def ws_device(args: argparse.Namespace, device_id: str, deadline: float, stats: Stats) -> None:
+    # Connect as the device, as device_one.py does: only its own control commands arrive.
+    url = f"{args.ws_url}?device={device_id}"
+    try:
+        ws = await websockets.connect(url, compression=args.compression, max_size=None)
+    except Exception:
+        stats.connect_errors += 1
+        return
+
+    async def drain() -> None:
+        try:
+            async for raw in ws:
+                # Answer server heartbeats so an idle-timeout server doesn't reap us.
+                msg_type = json.loads(raw).get("type")
+                if msg_type == "heartbeat":
+                    await ws.send('{"type":"pong"}')
+                elif msg_type == "throttle":
+                    stats.throttled["websocket"] += 1
+        except Exception:
+            pass
+
+    async def send(n: int) -> None:
+        msg = {"type": "telemetry", "device_id": device_id, "value": make_value(device_id, n, args.payload)}
+        try:
+            await ws.send(json.dumps(msg))
+            stats.sent["websocket"] += 1
+        except Exception:
+            stats.send_errors["websocket"] += 1
+
+    drainer = asyncio.create_task(drain())
+    try:
+        await paced(1.0 / args.rate, deadline, stats, send)
+    finally:
+        await ws.close()
+        drainer.cancel()
+
+
+async def rest_device(args: argparse.Namespace, device_id: str, deadline: float, stats: Stats) -> None:
+    conn = HttpConnection(args.host, args.port, args.tls)
+
+    async def send(n: int) -> None:
+        body = json.dumps({"device_id": device_id, "value": make_value(device_id, n, args.payload)})
+        try:
+            status = await conn.post_json("/api/data", body.encode("utf-8"))
+        except Exception:
+            stats.send_errors["rest"] += 1
+            return
+        if status == 200:
+            stats.sent["rest"] += 1
+        elif status == 429:
+            stats.throttled["rest"] += 1
+        else:
+            stats.send_errors["rest"] += 1
+
+    try:
+        await paced(1.0 / args.rate, deadline, stats, send)
+    finally:
+        await conn.close()
+
+
+def _observe(value: Any, now: float, stats: Stats, late_s: float) -> None:
+    if not isinstance(value, dict) or "t" not in value or "lg" not in value:
+        return  # someone else's traffic
+    latency = now - value["t"]
+    stats.received += 1
+    stats.latencies.append(latency)
+    if latency > late_s:
+        stats.late += 1
+
+
+async def subscriber(args: argparse.Namespace, ready: asyncio.Event, stop: asyncio.Event, stats: Stats) -> None:
+    late_s = args.late_ms / 1000.0
+    try:
+        ws = await websockets.connect(
+            f"{args.ws_url}?topics=type:data_update", compression=args.compression, max_size=None
+        )
+    except Exception:
+        stats.connect_errors += 1
+        return
+    try:
+        await ws.recv()  # hello
+        ready.set()
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=0.25)
+            except asyncio.TimeoutError:
+                continue
+            now = time.perf_counter()
+            event = json.loads(raw)
+            if event.get("type") == "heartbeat":
+                await ws.send('{"type":"pong"}')
+            elif event.get("type") == "data_update":
+                _observe(event.get("value"), now, stats, late_s)
+            elif event.get("type") == "data_update_batch":
+                for update in event.get("updates", ()):
+                    _observe(update.get("value"), now, stats, late_s)
+    except websockets.ConnectionClosed:
+        stats.subscriber_disconnects += 1
+    finally:
+        await ws.close()
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+async def fetch_status(args: argparse.Namespace) -> Optional[Dict[str, Any]]:
+    # Plain GET on a fresh connection; /api/status is small.
+    try:
+        reader, writer = await asyncio.open_connection(args.host, args.port, ssl=args.tls or None)
+        writer.write(f"GET /api/status HTTP/1.1\r\nHost: {args.host}\r\nConnection: close\r\n\r\n".encode("ascii"))
+        raw = await reader.read()
+        writer.close()
+        return json.loads(raw.split(b"\r\n\r\n", 1)[1])
+    except Exception:
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stats = Stats()
+    stop = asyncio.Event()
+
+    readies = [asyncio.Event() for _ in range(args.subscribers)]
+    subscribers = [asyncio.create_task(subscriber(args, ready, stop, stats)) for ready in readies]
+    if readies:
+        await asyncio.wait([asyncio.create_task(r.wait()) for r in readies], timeout=10)
+    subscribed = sum(r.is_set() for r in readies)
+
+    status_before = await fetch_status(args)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    devices = []
+    for i in range(args.ws_devices):
+        devices.append(ws_device(args, f"{args.prefix}-ws-{i}", deadline, stats))
+    for i in range(args.rest_devices):
+        devices.append(rest_device(args, f"{args.prefix}-rest-{i}", deadline, stats))
+
+    async def started(coro, delay: float):
+        await asyncio.sleep(delay)
+        await coro
+
+    # Spread connection setup over the ramp period.
+    ramp = min(args.ramp, args.duration)
+    await asyncio.gather(*(started(c, ramp * i / max(len(devices), 1)) for i, c in enumerate(devices)))
+    send_elapsed = time.perf_counter() - start
+
+    # Let in-flight messages arrive before counting what's missing.
+    await asyncio.sleep(args.drain)
+    stop.set()
+    await asyncio.gather(*subscribers)
+    status_after = await fetch_status(args)
+
+    sent = stats.sent["websocket"] + stats.sent["rest"]
+    expected = sent * subscribed
+    latencies = sorted(stats.latencies)
+
+    report: Dict[str, Any] = {
+        "report_version": REPORT_VERSION,
+        "label": args.label,
+        "started_utc": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "url": args.url,
+            "ws_devices": args.ws_devices,
+            "rest_devices": args.rest_devices,
+            "rate_per_device": args.rate,
+            "subscribers": args.subscribers,
+            "duration_s": args.duration,
+            "payload": args.payload,
+            "late_ms": args.late_ms,
+        },
+        "send_elapsed_s": round(send_elapsed, 3),
+        "sent": {**stats.sent, "total": sent},
+        "send_rate_per_s": round(sent / send_elapsed, 1) if send_elapsed else None,
+        "send_errors": stats.send_errors,
+        "throttled": stats.throttled,
+        "connect_errors": stats.connect_errors,
+        "behind_schedule": stats.behind_schedule,
+        "subscribers_connected": subscribed,
+        "subscriber_disconnects": stats.subscriber_disconnects,
+        "delivered": stats.received,
+        "expected_deliveries": expected,
+        "dropped": max(expected - stats.received, 0),
+        "late": stats.late,
+        "fanout_rate_per_s": round(stats.received / send_elapsed, 1) if send_elapsed else None,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p90": ms(percentile(latencies, 90)),
+            "p99": ms(percentile(latencies, 99)),
+            "p999": ms(percentile(latencies, 99.9)),
+            "max": ms(latencies[-1] if latencies else None),
+            "mean": ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+    }
+    if status_before is not None and status_after is not None:
+        report["server"] = {
+            "state_seq_delta": status_after.get("state_seq", 0) - status_before.get("state_seq", 0),
+            "websocket_dropped_messages": status_after.get("websocket_dropped_messages"),
+            "websocket_slow_consumer_disconnects": status_after.get("websocket_slow_consumer_disconnects"),
+            "broadcast_coalescing": status_after.get("broadcast_coalescing", {}).get("enabled"),
+        }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load generator for the REST + WebSocket server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server base URL")
+    parser.add_argument("--ws-devices", type=int, default=100, help="simulated WebSocket devices")
+    parser.add_argument("--rest-devices", type=int, default=20, help="simulated REST devices")
+    parser.add_argument("--rate", type=float, default=1.0, help="messages per second per device")
+    parser.add_argument("--subscribers", type=int, default=5, help="passive dashboard subscribers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of sending")
+    parser.add_argument("--ramp", type=float, default=1.0, help="seconds over which devices connect")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight messages")
+    parser.add_argument("--payload", choices=("scalar", "object"), default="scalar")
+    parser.add_argument("--late-ms", type=float, default=1000.0, help="latency above which a delivery counts as late")
+    parser.add_argument("--permessage-deflate", action="store_true", help="offer WebSocket compression")
+    parser.add_argument("--prefix", default="lg", help="device id prefix")
+    parser.add_argument("--label", default="", help="free-form label stored in the report (e.g. a release)")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.rate <= 0:
+        parser.error("--rate must be > 0")
+    parts = urlsplit(args.url)
+    args.host = parts.hostname or "127.0.0.1"
+    args.tls = parts.scheme == "https"
+    args.port = parts.port or (443 if args.tls else 80)
+    args.ws_url = ("wss" if parts.scheme == "https" else "ws") + f"://{parts.netloc}/ws"
+    args.compression = "deflate" if args.permessage_deflate else None
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    lat = report["latency_ms"]
+    print(
+        f"sent {report['sent']['total']} ({report['send_rate_per_s']}/s), delivered {report['delivered']}"
+        f"/{report['expected_deliveries']}, dropped {report['dropped']}, late {report['late']}, "
+        f"p50 {lat['p50']} ms, p99 {lat['p99']} ms",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
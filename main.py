@@ -1,72 +1,1563 @@
 from __future__ import annotations
 
 import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional, Set
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
+from capture import TrafficRecorder
+from commands import CommandQueue, QueueFull
+from compression import CompressionStats, HTTPCompressionMiddleware, brotli, deflate
+from diagnostics import HandlerTimingMiddleware, HandlerTimings, StallWatchdog
+from event_bus import make_bus
+from history import HistoryStore
+from messages import MessageValidator, json_value
+from metrics import LoopLagMonitor, Registry
+from persistence import make_store
+from ratelimit import ConcurrencyLimit, RateLimiter
+from rules import InvalidRule, RuleEngine
+from state import ShardedState
+
+try:  # Optional fast JSON backend
+    import orjson
+except ImportError:  # pragma: no cover - depends on environment
+    orjson = None
+
+try:  # Optional binary wire encodings for /ws
+    import msgpack
+except ImportError:  # pragma: no cover - depends on environment
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover - depends on environment
+    cbor2 = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Warm start from the persistence backend, then start background tasks.
+    STATE.load(*state_store.load())
+    if RULES_FILE:
+        rules.load_file(RULES_FILE)
+    state_store.start(STATE.copy)
+    await bus.start()
+    if recorder is not None:
+        recorder.start()
+    coalescer.start()
+    reaper.start()
+    commands.start()
+    loop_lag.start()
+    if stall_watchdog is not None:
+        stall_watchdog.start()
+    try:
+        yield
+    finally:
+        if stall_watchdog is not None:
+            await stall_watchdog.stop()
+        await loop_lag.stop()
+        await commands.stop()
+        await reaper.stop()
+        await coalescer.stop()
+        if recorder is not None:
+            await recorder.stop()
+        await bus.stop()
+        await state_store.stop()
+
+
 app = FastAPI(
     title="WebSocket & REST API using Python",
     description="Integrated REST + WebSocket backend with shared state and broadcast updates.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+# -------------------------
+# Configuration
+# -------------------------
+def _env_int(name: str, default: int) -> int:
+    raw = os.environ.get(name)
+    return int(raw) if raw else default
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name) or default
+
+
+# Per-client outbound queue bound and what to do once a client falls that far behind:
+#   drop_oldest -> discard the oldest queued message
+#   coalesce    -> keep only the newest queued update per device (else drop oldest)
+#   disconnect  -> close the slow client
+WS_SEND_QUEUE_SIZE = _env_int("WS_SEND_QUEUE_SIZE", 256)
+WS_SLOW_CONSUMER_POLICY = _env_str("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+# Direct replies (hello, pong, errors, ...) are never dropped; they have their
+# own bound, and a client with more than WS_REPLY_QUEUE_SIZE of them unread
+# (one that keeps sending but never reads) is disconnected.
+WS_REPLY_QUEUE_SIZE = _env_int("WS_REPLY_QUEUE_SIZE", 64)
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+if WS_SLOW_CONSUMER_POLICY not in SLOW_CONSUMER_POLICIES:
+    raise RuntimeError(
+        f"WS_SLOW_CONSUMER_POLICY must be one of {SLOW_CONSUMER_POLICIES}, got {WS_SLOW_CONSUMER_POLICY!r}"
+    )
+
+# Liveness. Every WS_HEARTBEAT_S the server sends {"type":"heartbeat"} to clients
+# it hasn't heard from in that long; with WS_IDLE_TIMEOUT_S > 0, clients that
+# send nothing at all (not even a reply to a heartbeat) for that long are
+# closed. Clients whose writer has been stuck on one frame for
+# WS_SEND_TIMEOUT_S (e.g. half-open TCP) are closed too. 0 disables each.
+WS_HEARTBEAT_S = _env_int("WS_HEARTBEAT_S", 30)
+WS_IDLE_TIMEOUT_S = _env_int("WS_IDLE_TIMEOUT_S", 0)
+WS_SEND_TIMEOUT_S = _env_int("WS_SEND_TIMEOUT_S", 30)
+
+# GET /api/stream (Server-Sent Events) subscribers share the /ws queue size,
+# slow-consumer policy and liveness settings above. SSE_RETRY_MS is the
+# reconnect delay the server suggests to EventSource clients.
+SSE_RETRY_MS = _env_int("SSE_RETRY_MS", 2000)
+
+# Optional server-side coalescing of data updates. When BROADCAST_COALESCE_MS > 0,
+# updates are buffered and flushed once per tick as one data_update_batch frame:
+#   latest -> only the newest value per device within the tick
+#   all    -> every sample, in arrival order
+# BROADCAST_COALESCE_DEVICES limits coalescing to a comma-separated list of device
+# IDs (empty = every device); other devices are broadcast immediately.
+BROADCAST_COALESCE_MS = _env_int("BROADCAST_COALESCE_MS", 0)
+BROADCAST_COALESCE_MODE = _env_str("BROADCAST_COALESCE_MODE", "latest")
+BROADCAST_COALESCE_DEVICES = _env_str("BROADCAST_COALESCE_DEVICES", "")
+
+if BROADCAST_COALESCE_MODE not in ("latest", "all"):
+    raise RuntimeError(
+        f"BROADCAST_COALESCE_MODE must be 'latest' or 'all', got {BROADCAST_COALESCE_MODE!r}"
+    )
+
+# How many recent state changes are kept for delta resync (?since=<seq>).
+STATE_CHANGELOG_SIZE = _env_int("STATE_CHANGELOG_SIZE", 10000)
+
+# Device state is split across this many independently locked shards.
+STATE_SHARDS = _env_int("STATE_SHARDS", 16)
+
+# Where device state survives restarts:
+#   memory -> nothing is persisted (default)
+#   file   -> append-only log + periodic compacted snapshot in STATE_DIR, written
+#             behind the ingest path every STATE_FLUSH_MS
+STATE_BACKEND = _env_str("STATE_BACKEND", "memory")
+STATE_DIR = _env_str("STATE_DIR", "data")
+STATE_FLUSH_MS = _env_int("STATE_FLUSH_MS", 200)
+STATE_SNAPSHOT_EVERY = _env_int("STATE_SNAPSHOT_EVERY", 10000)
+STATE_FSYNC = _env_int("STATE_FSYNC", 0) == 1
+
+# In-process history of numeric telemetry (0 series disables it). Per series:
+# HISTORY_RAW_POINTS raw samples, plus 1-second and 1-minute rollup buckets.
+# Worst-case memory is roughly
+#   HISTORY_MAX_SERIES * (16 * RAW_POINTS + 48 * (SECOND_BUCKETS + MINUTE_BUCKETS)) bytes.
+HISTORY_MAX_SERIES = _env_int("HISTORY_MAX_SERIES", 1000)
+HISTORY_RAW_POINTS = _env_int("HISTORY_RAW_POINTS", 10000)
+HISTORY_SECOND_BUCKETS = _env_int("HISTORY_SECOND_BUCKETS", 21600)
+HISTORY_MINUTE_BUCKETS = _env_int("HISTORY_MINUTE_BUCKETS", 10080)
+HISTORY_MAX_QUERY_BUCKETS = _env_int("HISTORY_MAX_QUERY_BUCKETS", 5000)
+
+# How events reach clients attached to other worker processes:
+#   local -> this process only (single worker)
+#   unix  -> relayed through a broker on EVENT_BUS_SOCKET (uvicorn --workers N)
+EVENT_BUS = _env_str("EVENT_BUS", "local")
+EVENT_BUS_SOCKET = _env_str("EVENT_BUS_SOCKET", "/tmp/wsapi-bus.sock")
+
+if EVENT_BUS == "unix" and STATE_BACKEND == "file":
+    # Every worker would append its own copy of each update to the same state.log.
+    raise RuntimeError("STATE_BACKEND=file supports a single worker; it can't be combined with EVENT_BUS=unix")
+
+# Largest telemetry_batch / POST /api/data/batch accepted in one message.
+INGEST_MAX_BATCH = _env_int("INGEST_MAX_BATCH", 5000)
+
+# Ingest admission control, each 0 to disable: token buckets per device
+# (INGEST_DEVICE_RATE updates/s, bursts of INGEST_DEVICE_BURST; off by default,
+# since legitimate devices may sample at 100 Hz or more) and per client
+# connection (INGEST_CONN_RATE / INGEST_CONN_BURST; a REST client is keyed by
+# its address and port), and at most INGEST_MAX_INFLIGHT ingest requests in
+# progress at once. Over a limit, REST answers 429 with Retry-After and /ws
+# sends a "throttle" message.
+INGEST_DEVICE_RATE = _env_int("INGEST_DEVICE_RATE", 0)
+INGEST_DEVICE_BURST = _env_int("INGEST_DEVICE_BURST", 100)
+INGEST_CONN_RATE = _env_int("INGEST_CONN_RATE", 1000)
+INGEST_CONN_BURST = _env_int("INGEST_CONN_BURST", 2000)
+INGEST_MAX_INFLIGHT = _env_int("INGEST_MAX_INFLIGHT", 256)
+
+# Control commands. Each gets an ID and waits in a per-target queue (at most
+# CONTROL_MAX_PENDING per target) until a client subscribed to "device:<target>"
+# receives it; commands sent with require_ack are resent every
+# CONTROL_ACK_TIMEOUT_S until the device answers with control_ack, at most
+# CONTROL_MAX_ATTEMPTS times. Every command gives up after CONTROL_TTL_S. The status of the last CONTROL_MAX_TRACKED commands is
+# kept for GET /api/control/{id}.
+CONTROL_ACK_TIMEOUT_S = _env_int("CONTROL_ACK_TIMEOUT_S", 5)
+CONTROL_MAX_ATTEMPTS = _env_int("CONTROL_MAX_ATTEMPTS", 5)
+CONTROL_TTL_S = _env_int("CONTROL_TTL_S", 300)
+CONTROL_MAX_PENDING = _env_int("CONTROL_MAX_PENDING", 100)
+CONTROL_MAX_TRACKED = _env_int("CONTROL_MAX_TRACKED", 10000)
+
+# Server-side alert rules (threshold, rate of change, rolling window), checked
+# on every ingested sample; see rules.py. RULES_FILE is an optional JSON list
+# of rules loaded at startup, more can be added at runtime on /api/rules. A
+# window keeps at most RULES_WINDOW_MAX_SAMPLES samples. A rate rule measures
+# change since a sample at least RULES_RATE_MIN_INTERVAL_MS older; samples
+# closer than that (a batch, a burst) don't produce a rate.
+RULES_FILE = _env_str("RULES_FILE", "")
+RULES_MAX = _env_int("RULES_MAX", 10000)
+RULES_WINDOW_MAX_SAMPLES = _env_int("RULES_WINDOW_MAX_SAMPLES", 10000)
+RULES_RATE_MIN_INTERVAL_MS = _env_int("RULES_RATE_MIN_INTERVAL_MS", 10)
+
+# Compression. /ws clients opt in with ?compress=deflate; frames of at least
+# WS_COMPRESS_MIN_BYTES then go out deflated (each broadcast compressed once and
+# shared by every subscriber). REST responses of at least HTTP_COMPRESS_MIN_BYTES
+# are compressed with the first of HTTP_COMPRESSION the client accepts
+# ("br" needs the optional brotli package; "off" disables).
+WS_COMPRESS_MIN_BYTES = _env_int("WS_COMPRESS_MIN_BYTES", 1024)
+WS_COMPRESS_LEVEL = _env_int("WS_COMPRESS_LEVEL", 6)
+HTTP_COMPRESSION = _env_str("HTTP_COMPRESSION", "br,gzip")
+HTTP_COMPRESS_MIN_BYTES = _env_int("HTTP_COMPRESS_MIN_BYTES", 1024)
+
+# How often the event-loop lag probe wakes up (0 disables it).
+LOOP_LAG_INTERVAL_MS = _env_int("LOOP_LAG_INTERVAL_MS", 100)
+
+# Opt-in diagnostics (DIAGNOSTICS=1): a watchdog thread samples the loop's stack
+# whenever the loop has been stuck for DIAG_STALL_MS, and the DIAG_SLOWEST
+# slowest REST/WS handlers are kept. Served on /api/debug/diagnostics.
+DIAGNOSTICS = _env_int("DIAGNOSTICS", 0) == 1
+DIAG_STALL_MS = _env_int("DIAG_STALL_MS", 100)
+DIAG_SAMPLE_MS = _env_int("DIAG_SAMPLE_MS", 20)
+DIAG_SLOWEST = _env_int("DIAG_SLOWEST", 20)
+
+# Traffic capture (off unless CAPTURE_FILE is set): every inbound REST ingest/
+# control request and /ws message is appended to CAPTURE_FILE as JSONL, written
+# behind the request path every CAPTURE_FLUSH_MS. Feed it back with replay.py.
+# With several workers, put "{pid}" in the name to give each its own file.
+CAPTURE_FILE = _env_str("CAPTURE_FILE", "")
+CAPTURE_FLUSH_MS = _env_int("CAPTURE_FLUSH_MS", 200)
+CAPTURE_MAX_BUFFER = _env_int("CAPTURE_MAX_BUFFER", 100000)
+
+ws_compression = CompressionStats()
+http_compression = CompressionStats()
+app.add_middleware(
+    HTTPCompressionMiddleware,
+    minimum_size=HTTP_COMPRESS_MIN_BYTES,
+    codecs=[c.strip() for c in HTTP_COMPRESSION.split(",") if c.strip() and c.strip() != "off"],
+    stats=http_compression,
+)
+
+
+# -------------------------
+# Metrics
+# -------------------------
+# Prometheus-format instruments served on /metrics. Recording is a few
+# attribute updates on the event loop (no locks), so they stay on in production.
+METRICS = Registry()
+INGEST_TOTAL = METRICS.counter(
+    "wsapi_ingest_total", "Device updates stored, by source (rest, websocket, remote worker)", ["source"]
+)
+INGEST_REST = INGEST_TOTAL.labels("rest")
+INGEST_WS = INGEST_TOTAL.labels("websocket")
+INGEST_REMOTE = INGEST_TOTAL.labels("remote")
+INGEST_REMOTE_STALE = METRICS.counter(
+    "wsapi_ingest_remote_stale_total", "Updates from another worker skipped because the device already had a newer one"
+)
+INGEST_REJECTED = METRICS.counter(
+    "wsapi_ingest_rejected_total", "Updates refused by admission control, by limit and source", ["scope", "source"]
+)
+FANOUT_SECONDS = METRICS.histogram(
+    "wsapi_broadcast_fanout_seconds", "Time to route one event and enqueue it for every subscriber"
+)
+FANOUT_DELIVERIES = METRICS.counter("wsapi_broadcast_deliveries_total", "Frames enqueued for subscribers")
+WS_SEND_SECONDS = METRICS.histogram(
+    "wsapi_ws_send_latency_seconds", "Per-socket send latency: from enqueue until the frame is written"
+)
+SERIALIZE_SECONDS = METRICS.histogram(
+    "wsapi_serialize_seconds", "Time to encode one outgoing event", ["encoding"]
+)
+WS_DEAD_SOCKETS = METRICS.counter(
+    "wsapi_ws_dead_socket_cleanups_total", "Connections removed after a failed send"
+)
+WS_SLOW_DISCONNECTS = METRICS.counter(
+    "wsapi_ws_slow_consumer_disconnects_total", "Connections closed by the disconnect slow-consumer policy"
+)
+WS_IDLE_EVICTIONS = METRICS.counter("wsapi_ws_idle_evictions_total", "Connections closed by the idle timeout")
+WS_STUCK_EVICTIONS = METRICS.counter(
+    "wsapi_ws_send_timeout_evictions_total", "Connections closed because a send was stuck past WS_SEND_TIMEOUT_S"
+)
+LOOP_LAG_SECONDS = METRICS.histogram("wsapi_event_loop_lag_seconds", "How late the loop-lag probe timer fired")
+loop_lag = LoopLagMonitor(LOOP_LAG_SECONDS, interval=LOOP_LAG_INTERVAL_MS / 1000.0)
+
+recorder: Optional[TrafficRecorder] = None
+if CAPTURE_FILE:
+    recorder = TrafficRecorder(
+        CAPTURE_FILE.replace("{pid}", str(os.getpid())),
+        flush_interval_ms=CAPTURE_FLUSH_MS,
+        max_buffer=CAPTURE_MAX_BUFFER,
+    )
+
+handler_timings: Optional[HandlerTimings] = None
+stall_watchdog: Optional[StallWatchdog] = None
+if DIAGNOSTICS:
+    handler_timings = HandlerTimings(slowest=DIAG_SLOWEST)
+    stall_watchdog = StallWatchdog(threshold=DIAG_STALL_MS / 1000.0, interval=DIAG_SAMPLE_MS / 1000.0)
+    app.add_middleware(HandlerTimingMiddleware, timings=handler_timings)
+
+
+# -------------------------
+# Serialization
+# -------------------------
+def encode_message(message: Dict[str, Any]) -> str:
+    """Encode an event to JSON text once so the same buffer can go to every socket."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(message).decode("utf-8")
+        except TypeError:
+            # e.g. integers wider than 64 bits; the stdlib encoder handles those.
+            pass
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+# Wire encodings a /ws client can negotiate. JSON goes out as text frames,
+# the binary encodings as binary frames.
+ENCODERS: Dict[str, Callable[[Dict[str, Any]], Union[str, bytes]]] = {"json": encode_message}
+DECODERS: Dict[str, Callable[[bytes], Any]] = {}
+if msgpack is not None:
+    ENCODERS["msgpack"] = msgpack.packb
+    DECODERS["msgpack"] = msgpack.unpackb
+if cbor2 is not None:
+    ENCODERS["cbor"] = cbor2.dumps
+    DECODERS["cbor"] = cbor2.loads
+
+
+def encode_sse(message: Dict[str, Any]) -> str:
+    """One Server-Sent Events frame. State changes get an ``id: <epoch>:<seq>`` to resume from."""
+    seq = message.get("seq")
+    if seq is None and message.get("type") == "data_update_batch":
+        seq = max((u["seq"] for u in message["updates"] if u.get("seq") is not None), default=None)
+    # Encoded JSON never contains a raw newline, so it always fits on one data: line.
+    if seq is None:
+        return f"data: {encode_message(message)}\n\n"
+    return f"id: {STATE.epoch}:{seq}\ndata: {encode_message(message)}\n\n"
+
+
+# Every format a ClientConnection can be served in: the /ws encodings plus
+# "sse" for GET /api/stream (not negotiable on /ws).
+FRAME_ENCODERS: Dict[str, Callable[[Dict[str, Any]], Union[str, bytes]]] = {**ENCODERS, "sse": encode_sse}
+
+
+class EncodedEvent:
+    """One event plus its wire encodings, each produced at most once.
+
+    Broadcasts hand the same EncodedEvent to every recipient, so an event is
+    encoded (and, for compressing clients, deflated) once per format in use
+    rather than once per client.
+    """
+
+    __slots__ = ("message", "_encoded", "_compressed")
+
+    def __init__(self, message: Dict[str, Any]) -> None:
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+        self._compressed: Dict[str, Union[str, bytes]] = {}
+
+    def encoded(self, encoding: str) -> Union[str, bytes]:
+        payload = self._encoded.get(encoding)
+        if payload is None:
+            start = time.perf_counter()
+            payload = self._encoded[encoding] = FRAME_ENCODERS[encoding](self.message)
+            SERIALIZE_SECONDS.labels(encoding).observe(time.perf_counter() - start)
+        return payload
+
+    def compressed(self, encoding: str) -> Tuple[Union[str, bytes], float]:
+        """(frame for a compressing client, CPU seconds spent on it by this call)."""
+        frame = self._compressed.get(encoding)
+        if frame is not None:
+            return frame, 0.0
+        frame, cpu_s = compress_frame(self.encoded(encoding))
+        self._compressed[encoding] = frame
+        return frame, cpu_s
+
+
+def compress_frame(payload: Union[str, bytes]) -> Tuple[Union[str, bytes], float]:
+    """Deflate a frame if it is at least WS_COMPRESS_MIN_BYTES; returns (frame, CPU seconds).
+
+    Compressed frames are binary zlib streams, which always start with 0x78.
+    Every event is a JSON/msgpack/CBOR map, which never does, so clients can
+    tell the two apart by the first byte.
+    """
+    if len(payload) < WS_COMPRESS_MIN_BYTES:
+        ws_compression.skipped_small += 1
+        return payload, 0.0
+    raw = payload.encode("utf-8") if isinstance(payload, str) else payload
+    frame, cpu_s = deflate(raw, WS_COMPRESS_LEVEL)
+    if len(frame) >= len(raw):
+        # Incompressible; not worth making the client inflate it.
+        ws_compression.record("incompressible", len(raw), len(raw), cpu_s)
+        return payload, cpu_s
+    ws_compression.record("deflate", len(raw), len(frame), cpu_s)
+    return frame, cpu_s
+
+
+class MalformedFrame(Exception):
+    """A /ws frame that could not be decoded in the connection's encoding."""
+
+
+def negotiate_encoding(websocket: WebSocket) -> Tuple[str, Optional[str]]:
+    """Pick the wire encoding for a new /ws connection.
+
+    ``?encoding=msgpack`` wins; otherwise the first supported entry of the
+    client's Sec-WebSocket-Protocol list is accepted and echoed back.
+    Unknown or unavailable encodings fall back to JSON.
+    Returns (encoding, subprotocol to accept or None).
+    """
+    requested = websocket.query_params.get("encoding")
+    subprotocol = None
+    for offered in websocket.scope.get("subprotocols") or ():
+        if offered in ENCODERS:
+            subprotocol = offered
+            break
+    if requested in ENCODERS:
+        return requested, subprotocol if subprotocol == requested else None
+    if subprotocol is not None:
+        return subprotocol, subprotocol
+    return "json", None
+
+
 # -------------------------
 # Shared State + WS Manager
 # -------------------------
-class ConnectionManager:
+# Topics a client can subscribe to:
+#   "*"              -> every event except the WILDCARD_EXCLUDED_TYPES below
+#   "type:<type>"    -> events of one type, e.g. "type:control"
+#   "device:<id>"    -> events about or addressed to one device (device_id / target)
+WILDCARD_TOPIC = "*"
+TOPIC_KINDS = ("type", "device")
+DEFAULT_TOPICS = (WILDCARD_TOPIC,)
+# Not telemetry, so "*" leaves them out: a control command only reaches its
+# target's "device:<id>" subscribers and clients subscribed to "type:control";
+# rule_change (rule replication between workers) only "type:rule_change".
+WILDCARD_EXCLUDED_TYPES = frozenset({"control", "rule_change"})
+
+
+def event_topics(message: Dict[str, Any]) -> List[str]:
+    msg_type = message.get("type")
+    topics = [] if msg_type in WILDCARD_EXCLUDED_TYPES else [WILDCARD_TOPIC]
+    if msg_type:
+        topics.append(f"type:{msg_type}")
+    for field in ("device_id", "target"):
+        value = message.get(field)
+        if value:
+            topics.append(f"device:{value}")
+    return topics
+
+
+def parse_topics(raw: Any) -> Optional[List[str]]:
+    """Accept a list of topic strings or a comma-separated string; None if any is invalid."""
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    if not isinstance(raw, list):
+        return None
+    topics = [t.strip() for t in raw if isinstance(t, str)]
+    if not topics or len(topics) != len(raw):
+        return None
+    for topic in topics:
+        if topic == WILDCARD_TOPIC:
+            continue
+        kind, _, name = topic.partition(":")
+        if kind not in TOPIC_KINDS or not name:
+            return None
+    return topics
+
+
+def _coalesce_key(message: Dict[str, Any]) -> Optional[Tuple[Any, Any]]:
+    # Only per-device updates can be safely collapsed to "latest wins".
+    device_id = message.get("device_id")
+    if device_id is None:
+        return None
+    return (message.get("type"), device_id)
+
+
+class ClientConnection:
+    """One connected websocket with its own bounded outbound queue and writer task."""
+
+    def __init__(
+        self,
+        client_id: int,
+        websocket: WebSocket,
+        max_queue: int,
+        policy: str,
+        encoding: str = "json",
+        compress: bool = False,
+        max_replies: int = WS_REPLY_QUEUE_SIZE,
+    ) -> None:
+        self.client_id = client_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.max_replies = max_replies
+        self.policy = policy
+        self.encoding = encoding
+        self.compress = compress
+        self.connected_at_utc = utc_now_iso()
+
+        # Entries are [key, payload, uncompressed size, enqueued at, is reply] so
+        # coalescing can swap the payload in place.
+        self._queue: Deque[List[Any]] = deque()
+        self._pending: Dict[Tuple[Any, Any], List[Any]] = {}
+        self._replies = 0
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._on_overflow: Optional[Callable[["ClientConnection"], None]] = None
+
+        self.topics: Set[str] = set()
+        # Set when the client connected as a device (/ws?device=<id>): it is
+        # then the recipient that control commands for <id> count.
+        self.device_id: Optional[str] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.compress_s = 0.0
+
+        # Liveness (time.monotonic()): last frame received from the client, last
+        # heartbeat sent to it, and when the writer started the frame it is on.
+        self.last_seen = time.monotonic()
+        self.heartbeat_sent_at = 0.0
+        self.send_started: Optional[float] = None
+
+        # No further throttle notices until then (time.monotonic()).
+        self.throttled_until = 0.0
+        self.throttled = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def start(
+        self, on_dead: Callable[["ClientConnection"], None], on_overflow: Callable[["ClientConnection"], None]
+    ) -> None:
+        self._on_overflow = on_overflow
+        self._writer = asyncio.create_task(self._run(on_dead))
+
+    def send(self, message: Dict[str, Any]) -> None:
+        # Direct replies (hello, pong, echo) go through the same queue so only the
+        # writer task ever touches the socket. Broadcasts never evict them; past
+        # max_replies unread replies the client is disconnected instead.
+        if self.closed:
+            return
+        if self._replies >= self.max_replies:
+            self.closed = True
+            if self._on_overflow is not None:
+                self._on_overflow(self)
+            return
+        start = time.perf_counter()
+        payload = FRAME_ENCODERS[self.encoding](message)
+        SERIALIZE_SECONDS.labels(self.encoding).observe(time.perf_counter() - start)
+        frame = payload
+        if self.compress:
+            frame, cpu_s = compress_frame(payload)
+            self.compress_s += cpu_s
+        self._push(None, frame, len(payload), reply=True)
+
+    async def receive(self) -> Any:
+        """Receive one message: text frames are JSON, binary frames use the negotiated encoding.
+
+        Raises MalformedFrame if the frame can't be decoded, or if a binary
+        frame holds something JSON can't (bytes, a CBOR tag, ...): values are
+        stored and re-sent as JSON. The connection stays usable.
+        """
+        frame = await self.websocket.receive()
+        if frame["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(frame.get("code", 1000), frame.get("reason"))
+        data = frame.get("bytes")
+        try:
+            if data is None:
+                return json.loads(frame["text"])
+            decoder = DECODERS.get(self.encoding)
+            if decoder is None:
+                return json.loads(data)
+            msg = decoder(data)
+        except Exception as exc:
+            kind = self.encoding if data is not None else "json"
+            raise MalformedFrame(f"could not decode {kind} frame: {str(exc) or type(exc).__name__}")
+        error = json_value(msg)
+        if error is not None:
+            raise MalformedFrame(f"{self.encoding} frame {error}")
+        return msg
+
+    def offer(self, event: EncodedEvent) -> bool:
+        """Enqueue a broadcast without blocking. Returns False if the client must be dropped."""
+        if self.closed:
+            return True
+
+        payload = event.encoded(self.encoding)
+        size = len(payload)
+        if self.compress:
+            payload, cpu_s = event.compressed(self.encoding)
+            self.compress_s += cpu_s
+        key = _coalesce_key(event.message) if self.policy == "coalesce" else None
+        if key is not None:
+            entry = self._pending.get(key)
+            if entry is not None:
+                entry[1] = payload
+                entry[2] = size
+                self.coalesced += 1
+                return True
+
+        if len(self._queue) - self._replies >= self.max_queue:
+            if self.policy == "disconnect":
+                return False
+            self._drop_oldest()
+            self.dropped += 1
+
+        self._push(key, payload, size)
+        return True
+
+    def _push(
+        self, key: Optional[Tuple[Any, Any]], payload: Union[str, bytes], size: int, reply: bool = False
+    ) -> None:
+        entry = [key, payload, size, time.perf_counter(), reply]
+        self._queue.append(entry)
+        if key is not None:
+            self._pending[key] = entry
+        if reply:
+            self._replies += 1
+        self._wakeup.set()
+
+    def _pop(self) -> List[Any]:
+        entry = self._queue.popleft()
+        self._forget_entry(entry)
+        return entry
+
+    def _drop_oldest(self) -> None:
+        # The oldest broadcast; only the few (bounded) replies ahead of it are skipped.
+        for index, entry in enumerate(self._queue):
+            if not entry[4]:
+                del self._queue[index]
+                self._forget_entry(entry)
+                return
+
+    def _forget_entry(self, entry: List[Any]) -> None:
+        key = entry[0]
+        if key is not None and self._pending.get(key) is entry:
+            del self._pending[key]
+        if entry[4]:
+            self._replies -= 1
+
+    async def _run(self, on_dead: Callable[["ClientConnection"], None]) -> None:
+        try:
+            while True:
+                while not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                _, payload, size, queued_at, _ = self._pop()
+                self.send_started = time.monotonic()
+                if isinstance(payload, str):
+                    await self.websocket.send_text(payload)
+                else:
+                    await self.websocket.send_bytes(payload)
+                self.send_started = None
+                WS_SEND_SECONDS.observe(time.perf_counter() - queued_at)
+                self.sent += 1
+                self.raw_bytes += size
+                self.wire_bytes += len(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.closed = True
+            on_dead(self)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "client_id": self.client_id,
+            "connected_at_utc": self.connected_at_utc,
+            "queue_depth": self.queue_depth,
+            "queue_limit": self.max_queue,
+            "policy": self.policy,
+            "encoding": self.encoding,
+            "compression": "deflate" if self.compress else None,
+            "topics": sorted(self.topics),
+            "device_id": self.device_id,
+            "idle_s": round(time.monotonic() - self.last_seen, 3),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "throttled": self.throttled,
+            "raw_bytes": self.raw_bytes,
+            "wire_bytes": self.wire_bytes,
+            "compression_ratio": round(self.raw_bytes / self.wire_bytes, 3) if self.wire_bytes else None,
+            "compress_cpu_ms": round(self.compress_s * 1000, 3),
+        }
+
+
+class SSETransport:
+    """Stands in for the WebSocket of a ClientConnection serving GET /api/stream.
+
+    The connection's writer task hands over one frame at a time and the
+    response body iterates ``frames()``, so an SSE subscriber goes through
+    the same topic routing, bounded queue, slow-consumer policy and reaper
+    as a /ws client. At most one frame waits here; while the HTTP write is
+    blocked the writer is too, which is what the send timeout watches.
+    """
+
     def __init__(self) -> None:
-        self._connections: Set[WebSocket] = set()
+        self._frames: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.closed = False
+
+    async def accept(self, subprotocol: Optional[str] = None) -> None:
+        pass
+
+    async def send_text(self, frame: str) -> None:
+        await self._frames.put(frame)
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._frames.put_nowait(None)
+        except asyncio.QueueFull:
+            # The body is still on the last frame; it sees `closed` once that is written.
+            pass
+
+    async def frames(self) -> AsyncIterator[str]:
+        while not self.closed:
+            frame = await self._frames.get()
+            if frame is None:
+                return
+            yield frame
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        max_queue: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_SLOW_CONSUMER_POLICY,
+    ) -> None:
+        self._connections: Dict[WebSocket, ClientConnection] = {}
+        # Least recently heard-from first, so the reaper only walks idle clients.
+        self._by_last_seen: "OrderedDict[ClientConnection, None]" = OrderedDict()
+        # topic -> subscribed connections, so routing only touches matching clients
+        self._subscribers: Dict[str, Set[ClientConnection]] = {}
+        # device_id -> connections of that device itself (not viewers of its topic)
+        self._devices: Dict[str, Set[ClientConnection]] = {}
         self._lock = asyncio.Lock()
+        self._next_id = 0
+        self.max_queue = max_queue
+        self.policy = policy
+        self.slow_consumer_disconnects = 0
+        self.sse_clients = 0
 
-    async def connect(self, websocket: WebSocket) -> None:
-        await websocket.accept()
+    async def connect(
+        self,
+        websocket: WebSocket,
+        topics: Iterable[str] = DEFAULT_TOPICS,
+        encoding: str = "json",
+        subprotocol: Optional[str] = None,
+        compress: bool = False,
+        device_id: Optional[str] = None,
+    ) -> ClientConnection:
+        await websocket.accept(subprotocol=subprotocol)
         async with self._lock:
-            self._connections.add(websocket)
+            self._next_id += 1
+            conn = ClientConnection(self._next_id, websocket, self.max_queue, self.policy, encoding, compress)
+            self._connections[websocket] = conn
+            self._by_last_seen[conn] = None
+            if encoding == "sse":
+                self.sse_clients += 1
+            self._add_topics(conn, topics)
+            if device_id is not None:
+                conn.device_id = device_id
+                self._devices.setdefault(device_id, set()).add(conn)
+                self._add_topics(conn, (f"device:{device_id}",))
+        conn.start(self._on_dead, self._on_overflow)
+        return conn
 
     async def disconnect(self, websocket: WebSocket) -> None:
         async with self._lock:
-            self._connections.discard(websocket)
+            conn = self._forget(websocket)
+        if conn is not None:
+            await conn.close()
 
-    async def broadcast(self, message: Dict[str, Any]) -> None:
-        # Send to all currently connected websockets.
+    async def subscribe(self, conn: ClientConnection, topics: Iterable[str]) -> None:
         async with self._lock:
-            conns = list(self._connections)
+            if conn.websocket in self._connections:
+                self._add_topics(conn, topics)
 
-        # Send outside lock to avoid blocking new connects.
-        dead: list[WebSocket] = []
-        for ws in conns:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                dead.append(ws)
+    async def unsubscribe(self, conn: ClientConnection, topics: Iterable[str]) -> None:
+        async with self._lock:
+            self._remove_topics(conn, list(topics))
+
+    def _add_topics(self, conn: ClientConnection, topics: Iterable[str]) -> None:
+        for topic in topics:
+            conn.topics.add(topic)
+            self._subscribers.setdefault(topic, set()).add(conn)
+
+    def _remove_topics(self, conn: ClientConnection, topics: Iterable[str]) -> None:
+        for topic in topics:
+            conn.topics.discard(topic)
+            subs = self._subscribers.get(topic)
+            if subs is not None:
+                subs.discard(conn)
+                if not subs:
+                    del self._subscribers[topic]
+
+    def _forget(self, websocket: WebSocket) -> Optional[ClientConnection]:
+        conn = self._connections.pop(websocket, None)
+        if conn is not None:
+            self._by_last_seen.pop(conn, None)
+            self._remove_topics(conn, list(conn.topics))
+            if conn.encoding == "sse":
+                self.sse_clients -= 1
+            if conn.device_id is not None:
+                devices = self._devices[conn.device_id]
+                devices.discard(conn)
+                if not devices:
+                    del self._devices[conn.device_id]
+        return conn
+
+    def touch(self, conn: ClientConnection) -> None:
+        """Record that the client just sent something (O(1))."""
+        conn.last_seen = time.monotonic()
+        if conn in self._by_last_seen:
+            self._by_last_seen.move_to_end(conn)
+
+    def idle_since(self, cutoff: float) -> List[ClientConnection]:
+        """Connections not heard from since ``cutoff``, oldest first; stops at the first recent one."""
+        idle = []
+        for conn in self._by_last_seen:
+            if conn.last_seen >= cutoff:
+                break
+            idle.append(conn)
+        return idle
+
+    def stuck_writers(self, cutoff: float) -> List[ClientConnection]:
+        """Connections whose writer has been on one frame since before ``cutoff``."""
+        return [
+            conn
+            for conn in self._connections.values()
+            if conn.send_started is not None and conn.send_started < cutoff
+        ]
+
+    async def evict(self, conns: Iterable[ClientConnection], code: int, reason: str) -> int:
+        """Drop connections from routing now and close them in the background."""
+        conns = list(conns)
+        async with self._lock:
+            evicted = [conn for conn in conns if self._forget(conn.websocket) is not None]
+        for conn in evicted:
+            asyncio.create_task(conn.close(code=code, reason=reason))
+        return len(evicted)
+
+    def _on_dead(self, conn: ClientConnection) -> None:
+        # Writer task hit a send error: forget the socket; the receive loop
+        # in websocket_endpoint will see the disconnect and finish cleanup.
+        if self._forget(conn.websocket) is not None:
+            WS_DEAD_SOCKETS.inc()
+
+    def _on_overflow(self, conn: ClientConnection) -> None:
+        # The client keeps sending requests but doesn't read the replies.
+        if self._forget(conn.websocket) is not None:
+            self.slow_consumer_disconnects += 1
+            WS_SLOW_DISCONNECTS.inc()
+        asyncio.create_task(conn.close(code=1008, reason="slow consumer"))
+
+    def _recipients(self, message: Dict[str, Any]) -> Set[ClientConnection]:
+        recipients: Set[ClientConnection] = set()
+        for topic in event_topics(message):
+            subs = self._subscribers.get(topic)
+            if subs:
+                recipients.update(subs)
+        return recipients
+
+    async def broadcast(self, message: Dict[str, Any]) -> int:
+        # Encode once per wire format, then enqueue the same buffer on each
+        # subscribed client's own queue; never waits on a socket, so one slow viewer can't hold up
+        # ingest or the other subscribers.
+        async with self._lock:
+            conns = self._recipients(message)
+        if not conns:
+            return 0
+        return await self._deliver(conns, EncodedEvent(message))
 
-        # Cleanup dead sockets
-        if dead:
-            async with self._lock:
-                for ws in dead:
-                    self._connections.discard(ws)
+    async def broadcast_batch(self, message: Dict[str, Any]) -> int:
+        """Fan out a data_update_batch event.
+
+        Clients watching all data updates get the combined frame (encoded once per format);
+        clients subscribed only to specific devices get plain data_update events
+        for just those devices.
+        """
+        async with self._lock:
+            full = self._recipients(message)
+            full.update(self._subscribers.get("type:data_update", ()))
+            per_device: List[Tuple[Dict[str, Any], Set[ClientConnection]]] = []
+            for update in message["updates"]:
+                subs = self._subscribers.get(f"device:{update['device_id']}")
+                if subs:
+                    subs = subs - full
+                    if subs:
+                        per_device.append((update, subs))
+
+        delivered = 0
+        if full:
+            delivered += await self._deliver(full, EncodedEvent(message))
+        for update, subs in per_device:
+            event = {
+                "type": "data_update",
+                "device_id": update["device_id"],
+                "value": update["value"],
+                "seq": update.get("seq"),
+                "timestamp_utc": update.get("timestamp_utc", message["timestamp_utc"]),
+                "source": update.get("source", message["source"]),
+            }
+            delivered += await self._deliver(subs, EncodedEvent(event))
+        return delivered
+
+    async def _deliver(self, conns: Iterable[ClientConnection], event: EncodedEvent) -> int:
+        slow: list[ClientConnection] = []
+        delivered = 0
+        for conn in conns:
+            if conn.offer(event):
+                delivered += 1
+            else:
+                slow.append(conn)
+
+        if slow:
+            evicted = await self.evict(slow, code=1008, reason="slow consumer")
+            self.slow_consumer_disconnects += evicted
+            WS_SLOW_DISCONNECTS.inc(evicted)
+        return delivered
 
     async def count(self) -> int:
         async with self._lock:
             return len(self._connections)
 
+    def device_connections(self, device_id: str) -> int:
+        # Lock-free read: is the device itself connected here? Viewers of its
+        # "device:<id>" topic (dashboards, SSE streams) don't count.
+        return len(self._devices.get(device_id, ()))
+
+    def __len__(self) -> int:
+        # Lock-free read for metrics scrapes.
+        return len(self._connections)
+
+    def queued_messages(self) -> int:
+        return sum(conn.queue_depth for conn in list(self._connections.values()))
+
+    async def stats(self) -> List[Dict[str, Any]]:
+        async with self._lock:
+            conns = list(self._connections.values())
+        return [conn.stats() for conn in conns]
+
 
 manager = ConnectionManager()
 
-# A minimal shared state model for "devices"
-# device_id -> {"value": ..., "updated_at": ...}
-STATE: Dict[str, Dict[str, Any]] = {}
-STATE_LOCK = asyncio.Lock()
+
+class ConnectionReaper:
+    """Background heartbeats and eviction of unresponsive clients.
+
+    Each tick: send a heartbeat to clients silent for ``heartbeat_s``, close
+    clients silent for ``idle_timeout_s``, and close clients whose writer has
+    been blocked on one frame for ``send_timeout_s``. Idle clients are found
+    by walking the manager's last-seen order from the oldest end, so the
+    cost is proportional to the number of idle clients, not all clients.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        heartbeat_s: float = WS_HEARTBEAT_S,
+        idle_timeout_s: float = WS_IDLE_TIMEOUT_S,
+        send_timeout_s: float = WS_SEND_TIMEOUT_S,
+        tick_s: float = 1.0,
+    ) -> None:
+        self.manager = manager
+        self.heartbeat_s = heartbeat_s
+        self.idle_timeout_s = idle_timeout_s
+        self.send_timeout_s = send_timeout_s
+        self.tick_s = tick_s
+        self._task: Optional[asyncio.Task] = None
+
+        self.heartbeats_sent = 0
+        self.idle_evictions = 0
+        self.stuck_evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.heartbeat_s > 0 or self.idle_timeout_s > 0 or self.send_timeout_s > 0
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick_s)
+            try:
+                await self.reap()
+            except Exception:
+                # A failed pass must not stop future ones.
+                pass
+
+    async def reap(self) -> None:
+        now = time.monotonic()
+        if self.idle_timeout_s > 0:
+            idle = self.manager.idle_since(now - self.idle_timeout_s)
+            if idle:
+                evicted = await self.manager.evict(idle, code=1001, reason="idle timeout")
+                self.idle_evictions += evicted
+                WS_IDLE_EVICTIONS.inc(evicted)
+
+        if self.send_timeout_s > 0:
+            stuck = self.manager.stuck_writers(now - self.send_timeout_s)
+            if stuck:
+                evicted = await self.manager.evict(stuck, code=1001, reason="send timeout")
+                self.stuck_evictions += evicted
+                WS_STUCK_EVICTIONS.inc(evicted)
+
+        if self.heartbeat_s > 0:
+            message = None
+            for conn in self.manager.idle_since(now - self.heartbeat_s):
+                # One heartbeat per heartbeat_s of silence, not one per tick.
+                if now - conn.heartbeat_sent_at < self.heartbeat_s:
+                    continue
+                if message is None:
+                    message = {"type": "heartbeat", "timestamp_utc": utc_now_iso()}
+                conn.heartbeat_sent_at = now
+                conn.send(message)
+                self.heartbeats_sent += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "heartbeat_s": self.heartbeat_s,
+            "idle_timeout_s": self.idle_timeout_s,
+            "send_timeout_s": self.send_timeout_s,
+            "heartbeats_sent": self.heartbeats_sent,
+            "idle_evictions": self.idle_evictions,
+            "stuck_evictions": self.stuck_evictions,
+        }
+
+
+reaper = ConnectionReaper(manager)
+
+# Every outgoing event goes through the bus: delivered to this process's
+# clients and, with a cross-process backend, to every other worker too.
+bus = make_bus(EVENT_BUS, EVENT_BUS_SOCKET)
+
+
+class BroadcastCoalescer:
+    """Buffers data updates and flushes them once per tick as a data_update_batch."""
+
+    def __init__(
+        self,
+        publish: Callable[[Dict[str, Any]], Awaitable[Any]],
+        interval_ms: int = BROADCAST_COALESCE_MS,
+        mode: str = BROADCAST_COALESCE_MODE,
+        devices: Iterable[str] = (),
+        max_pending: int = INGEST_MAX_BATCH,
+    ) -> None:
+        self.publish = publish
+        self.interval = interval_ms / 1000.0
+        self.mode = mode
+        self.devices = frozenset(devices)
+        self.max_pending = max_pending
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        self._samples: List[Dict[str, Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        # Early flush started by add() when the buffer fills before the tick.
+        self._early: Optional[asyncio.Task] = None
+
+        self.received = 0
+        self.flushed_updates = 0
+        self.flushes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def accepts(self, device_id: str) -> bool:
+        return self.enabled and (not self.devices or device_id in self.devices)
+
+    @property
+    def pending(self) -> int:
+        return len(self._latest) if self.mode == "latest" else len(self._samples)
+
+    def add(self, update: Dict[str, Any]) -> None:
+        """Buffer one update ({device_id, value, timestamp_utc, source}) until the next tick."""
+        self.received += 1
+        if self.mode == "latest":
+            # Re-insert so the batch lists devices in order of their last update.
+            self._latest.pop(update["device_id"], None)
+            self._latest[update["device_id"]] = update
+        else:
+            self._samples.append(update)
+        if self.pending >= self.max_pending and (self._early is None or self._early.done()):
+            self._early = asyncio.create_task(self._flush_quietly())
+
+    async def flush(self) -> None:
+        if self.mode == "latest":
+            updates = list(self._latest.values())
+            self._latest = {}
+        else:
+            updates = self._samples
+            self._samples = []
+        if not updates:
+            return
+
+        self.flushes += 1
+        self.flushed_updates += len(updates)
+        await self.publish(
+            {
+                "type": "data_update_batch",
+                "updates": updates,
+                "timestamp_utc": utc_now_iso(),
+                "source": "coalesced",
+            }
+        )
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._early is not None:
+            # It already took its updates from the buffer; let it publish them.
+            await self._early
+            self._early = None
+        await self.flush()
+
+    async def _flush_quietly(self) -> None:
+        try:
+            await self.flush()
+        except Exception:
+            # Never let one bad flush stop future ticks.
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._flush_quietly()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "interval_ms": int(self.interval * 1000),
+            "mode": self.mode,
+            "devices": sorted(self.devices),
+            "pending": self.pending,
+            "received": self.received,
+            "flushes": self.flushes,
+            "flushed_updates": self.flushed_updates,
+        }
+
+
+coalescer = BroadcastCoalescer(
+    bus.publish,
+    devices=[d.strip() for d in BROADCAST_COALESCE_DEVICES.split(",") if d.strip()],
+)
+
+
+def control_event(cmd: Any, attempt: int) -> Dict[str, Any]:
+    return {
+        "type": "control",
+        "command_id": cmd.id,
+        "target": cmd.target,
+        "command": cmd.command,
+        "args": cmd.args,
+        "require_ack": cmd.require_ack,
+        "attempt": attempt,
+        "timestamp_utc": utc_now_iso(),
+        "source": cmd.source,
+    }
+
+
+async def send_command(cmd: Any) -> int:
+    """Publish one delivery attempt of a control command.
+
+    Routed to the target's "device:<target>" subscribers and "type:control"
+    observers, but only the device's own connections (/ws?device=<target>)
+    count as having received it.
+    """
+    await bus.publish(control_event(cmd, cmd.attempts + 1))
+    return manager.device_connections(cmd.target)
+
+
+# With several workers the target may be attached to another process, so a
+# publish counts as a delivery and the ack comes back over the bus.
+commands = CommandQueue(
+    send_command,
+    ack_timeout=CONTROL_ACK_TIMEOUT_S,
+    max_attempts=CONTROL_MAX_ATTEMPTS,
+    ttl=CONTROL_TTL_S,
+    max_pending_per_target=CONTROL_MAX_PENDING,
+    max_tracked=CONTROL_MAX_TRACKED,
+    assume_delivered=bus.name != "local",
+)
+
+
+rules = RuleEngine(
+    max_rules=RULES_MAX,
+    max_window_samples=RULES_WINDOW_MAX_SAMPLES,
+    min_rate_interval=RULES_RATE_MIN_INTERVAL_MS / 1000,
+)
+
+
+async def check_rules(device_id: str, value: Any, timestamp_utc: str) -> None:
+    """Run one ingested sample through the device's rules and publish an alert per transition.
+
+    Rules run where the sample was ingested; subscribers of "type:alert" (or
+    "device:<id>") then get alerts instead of having to watch every update.
+    """
+    if not rules.watches(device_id):
+        return
+    # Rates and windows use the time the sample was stored, not when it is evaluated.
+    t = datetime.fromisoformat(timestamp_utc).timestamp()
+    for rule, state in rules.evaluate(device_id, value, t):
+        await bus.publish(
+            {
+                "type": "alert",
+                "state": state,
+                "rule_id": rule.id,
+                "name": rule.name,
+                "device_id": device_id,
+                "field": rule.field,
+                "kind": rule.kind,
+                "aggregate": rule.aggregate,
+                "observed": rule.observed,
+                "min": rule.min,
+                "max": rule.max,
+                "value": value,
+                "timestamp_utc": timestamp_utc,
+            }
+        )
+
+
+async def publish_update(event: Dict[str, Any]) -> None:
+    """Broadcast a data_update event, going through the coalescer when it applies."""
+    if coalescer.accepts(event["device_id"]):
+        coalescer.add(
+            {
+                "device_id": event["device_id"],
+                "value": event["value"],
+                "seq": event["seq"],
+                "timestamp_utc": event["timestamp_utc"],
+                "source": event["source"],
+            }
+        )
+    else:
+        await bus.publish(event)
+
+
+async def deliver_event(event: Dict[str, Any], remote: bool) -> int:
+    """Bus handler: fan an event out to this process's clients.
+
+    Updates published by another worker are first applied to local state
+    (getting local sequence numbers) so every worker serves the same data.
+    """
+    if remote:
+        event = await _apply_remote(event)
+        if event is None:
+            return 0
+    start = time.perf_counter()
+    if event.get("type") == "data_update_batch":
+        delivered = await manager.broadcast_batch(event)
+    else:
+        delivered = await manager.broadcast(event)
+    FANOUT_SECONDS.observe(time.perf_counter() - start)
+    FANOUT_DELIVERIES.inc(delivered)
+    return delivered
+
+
+async def _apply_remote(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Apply another worker's event locally; None if nothing in it is left to deliver.
+
+    Relayed updates can arrive out of order, so one older than the device's
+    current value is dropped (last writer by timestamp wins on every worker).
+    """
+    msg_type = event.get("type")
+    if msg_type == "data_update":
+        seq = await STATE.put_if_newer(event["device_id"], event["value"], event["timestamp_utc"])
+        if seq is None:
+            INGEST_REMOTE_STALE.inc()
+            return None
+        INGEST_REMOTE.inc()
+        return {**event, "seq": seq}
+    if msg_type == "data_update_batch":
+        updates = []
+        for update in event["updates"]:
+            timestamp = update.get("timestamp_utc", event["timestamp_utc"])
+            seq = await STATE.put_if_newer(update["device_id"], update["value"], timestamp)
+            if seq is not None:
+                updates.append({**update, "seq": seq})
+        INGEST_REMOTE.inc(len(updates))
+        INGEST_REMOTE_STALE.inc(len(event["updates"]) - len(updates))
+        if not updates:
+            return None
+        return {**event, "updates": updates}
+    if msg_type == "control_ack":
+        # Only the worker that issued the command knows it; others ignore the ack.
+        commands.ack(event["command_id"], event.get("ok", True), event.get("detail"))
+    elif msg_type == "rule_change":
+        # Keep every worker's rule set the same as the one that took the request.
+        rule = event["rule"]
+        if event["action"] == "add":
+            try:
+                rules.add(rule, rule["rule_id"])
+            except InvalidRule:
+                pass
+        else:
+            rules.remove(rule["rule_id"])
+    return event
+
+
+bus.set_handler(deliver_event)
+
+
+# Shared device state, sharded by device_id with one lock per shard.
+# device_id -> {"value": ..., "updated_at_utc": ..., "seq": ...}
+# Every change gets the next sequence number; the most recent changes are
+# kept so reconnecting clients can catch up with just what they missed.
+STATE = ShardedState(shards=STATE_SHARDS, changelog_size=STATE_CHANGELOG_SIZE)
+
+state_store = make_store(STATE_BACKEND, STATE_DIR, STATE_FLUSH_MS, STATE_SNAPSHOT_EVERY, STATE_FSYNC)
+history = HistoryStore(
+    max_series=HISTORY_MAX_SERIES,
+    raw_points=HISTORY_RAW_POINTS,
+    tiers=((1.0, HISTORY_SECOND_BUCKETS), (60.0, HISTORY_MINUTE_BUCKETS)),
+)
+
+STATE.add_listener(state_store.record)
+STATE.add_listener(lambda device_id, entry: history.record(device_id, entry["value"], time.time()))
+
+
+def state_etag(seq: int) -> str:
+    # Weak: the compression middleware may send the same version gzip'd or br'd.
+    return f'W/"{STATE.epoch}-{seq}"'
+
+
+class SnapshotCache:
+    """The full GET /api/data body, serialized once per state version.
+
+    Every write moves STATE.seq, so the body is rebuilt by the first read
+    after a write and reused until the next one; polling an unchanged state
+    costs one integer comparison.
+    """
+
+    def __init__(self, state: ShardedState) -> None:
+        self.state = state
+        self.seq = -1
+        self.etag = ""
+        self.body = b""
+        self.builds = 0
+        self.hits = 0
+        self.not_modified = 0
+
+    def get(self) -> Tuple[str, bytes]:
+        if self.state.seq == self.seq:
+            self.hits += 1
+            return self.etag, self.body
+        seq, data = self.state.copy()
+        message = {"timestamp_utc": utc_now_iso(), "epoch": self.state.epoch, "seq": seq, "snapshot": "full", "data": data}
+        self.body = encode_message(message).encode("utf-8")
+        self.seq = seq
+        self.etag = state_etag(seq)
+        self.builds += 1
+        return self.etag, self.body
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "seq": self.seq,
+            "bytes": len(self.body),
+            "builds": self.builds,
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+        }
+
+
+snapshot_cache = SnapshotCache(STATE)
+
+# Read at scrape time from counters the components already keep.
+METRICS.callback(
+    "wsapi_state_lock_wait_seconds_total", "Time writers spent waiting for a state shard lock",
+    lambda: STATE.lock_wait_s, kind="counter",
+)
+METRICS.callback(
+    "wsapi_state_lock_waits_total", "Shard lock acquisitions that had to wait", lambda: STATE.lock_waits, kind="counter"
+)
+METRICS.callback(
+    "wsapi_state_listener_errors_total", "State listeners (history, persistence, ...) that raised",
+    lambda: STATE.listener_errors, kind="counter",
+)
+METRICS.callback("wsapi_state_seq", "Current state sequence number", lambda: STATE.seq)
+METRICS.callback("wsapi_devices_known", "Devices in shared state", lambda: len(STATE))
+METRICS.callback("wsapi_ws_clients_connected", "Connected WebSocket clients", lambda: len(manager) - manager.sse_clients)
+METRICS.callback("wsapi_sse_clients_connected", "Connected /api/stream clients", lambda: manager.sse_clients)
+METRICS.callback("wsapi_ws_queued_messages", "Frames waiting in client send queues", manager.queued_messages)
+METRICS.callback("wsapi_ingest_in_flight", "Ingest requests in progress", lambda: ingest_slots.in_flight)
+METRICS.callback(
+    "wsapi_ingest_limit", "Configured admission limits (0 = off)",
+    lambda: {
+        ("device_rate",): INGEST_DEVICE_RATE,
+        ("device_burst",): INGEST_DEVICE_BURST,
+        ("connection_rate",): INGEST_CONN_RATE,
+        ("connection_burst",): INGEST_CONN_BURST,
+        ("max_in_flight",): INGEST_MAX_INFLIGHT,
+    },
+    labelnames=["limit"],
+)
+METRICS.callback("wsapi_control_pending", "Control commands waiting for delivery or an ack", lambda: commands.pending)
+METRICS.callback(
+    "wsapi_control_commands_total", "Control commands finished, by outcome",
+    lambda: {(status,): n for status, n in commands.counts.items()}, kind="counter", labelnames=["status"],
+)
+METRICS.callback("wsapi_rules", "Alert rules configured", lambda: len(rules))
+METRICS.callback(
+    "wsapi_rule_transitions_total", "Alert rule transitions, by new state",
+    lambda: {(state,): n for state, n in rules.transitions.items()}, kind="counter", labelnames=["state"],
+)
+METRICS.callback("wsapi_rule_evaluations_total", "Samples checked against a rule", lambda: rules.evaluations, kind="counter")
+METRICS.callback("wsapi_event_loop_lag_max_seconds", "Largest event-loop lag seen", lambda: loop_lag.max_lag)
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+device_limiter = RateLimiter(INGEST_DEVICE_RATE, INGEST_DEVICE_BURST)
+conn_limiter = RateLimiter(INGEST_CONN_RATE, INGEST_CONN_BURST)
+ingest_slots = ConcurrencyLimit(INGEST_MAX_INFLIGHT)
+
+
+def check_rate(conn_key: Any, device_id: Optional[str], source: str, cost: int = 1) -> Optional[Tuple[str, float]]:
+    """Charge an ingest against its connection's and device's buckets.
+
+    Returns None if admitted, else (limit that refused it, seconds until it would be admitted).
+    """
+    retry_after = conn_limiter.check(conn_key, cost)
+    if retry_after:
+        INGEST_REJECTED.labels("connection", source).inc(cost)
+        return "connection", retry_after
+    if device_id is not None:
+        retry_after = device_limiter.check(device_id)
+        if retry_after:
+            INGEST_REJECTED.labels("device", source).inc()
+            return "device", retry_after
+    return None
+
+
+def too_many_requests(scope: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={"message": f"{scope} ingest limit exceeded", "scope": scope, "retry_after_s": round(retry_after, 3)},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def _rest_client_key(request: Request) -> Tuple[str, str]:
+    client = request.client
+    return ("rest", f"{client.host}:{client.port}" if client else "unknown")
+
+
+def _batch_item_error(item: Any) -> Optional[str]:
+    if not isinstance(item, dict):
+        return "item must be an object"
+    device_id = item.get("device_id")
+    if not isinstance(device_id, str) or not device_id:
+        return "missing device_id"
+    if "value" not in item:
+        return "missing value"
+    return None
+
+
+async def apply_batch(items: List[Any], source: str) -> Dict[str, Any]:
+    """Store many device updates (one lock acquisition per shard) and broadcast them as one frame.
+
+    Items for devices over their rate limit are rejected individually.
+    """
+    now = utc_now_iso()
+    accepted: List[Dict[str, Any]] = []
+    rejected: List[Dict[str, Any]] = []
+    for index, item in enumerate(items):
+        error = _batch_item_error(item)
+        if error is not None:
+            rejected.append({"index": index, "error": error})
+            continue
+        retry_after = device_limiter.check(item["device_id"])
+        if retry_after:
+            INGEST_REJECTED.labels("device", source).inc()
+            rejected.append({"index": index, "error": "device rate limited", "retry_after_s": round(retry_after, 3)})
+            continue
+        accepted.append({"device_id": item["device_id"], "value": item["value"]})
+
+    if accepted:
+        await STATE.put_many(accepted, now)
+        INGEST_TOTAL.labels(source).inc(len(accepted))
+
+        if coalescer.enabled:
+            passthrough = []
+            for update in accepted:
+                if coalescer.accepts(update["device_id"]):
+                    coalescer.add({**update, "timestamp_utc": now, "source": source})
+                else:
+                    passthrough.append(update)
+        else:
+            passthrough = accepted
+
+        if passthrough:
+            await bus.publish(
+                {
+                    "type": "data_update_batch",
+                    "updates": passthrough,
+                    "timestamp_utc": now,
+                    "source": source,
+                }
+            )
+        if rules:
+            for update in accepted:
+                await check_rules(update["device_id"], update["value"], now)
+
+    return {
+        "accepted": len(accepted),
+        "rejected_count": len(rejected),
+        "rejected": rejected,
+        "timestamp_utc": now,
+    }
+
+
 # -------------------------
 # REST Models
 # -------------------------
@@ -75,10 +1566,28 @@ class DataUpdate(BaseModel):
     value: Any = Field(..., description="Payload value (number/string/object)")
 
 
+class DataBatch(BaseModel):
+    # Items are validated one by one so a bad entry rejects only itself.
+    items: List[Any] = Field(..., description="List of {device_id, value} updates")
+
+
 class ControlCommand(BaseModel):
     target: str = Field(..., min_length=1, description="Target device/client")
     command: str = Field(..., min_length=1, description="Command name")
     args: Optional[Dict[str, Any]] = Field(default=None, description="Optional command arguments")
+    require_ack: bool = Field(default=False, description="Resend until the device answers with control_ack")
+
+
+class AlertRule(BaseModel):
+    device_id: str = Field(..., min_length=1, description="Device whose telemetry the rule watches")
+    kind: str = Field(default="threshold", description="threshold, rate (change per second) or window")
+    field: Optional[str] = Field(default=None, description="Member of an object value, e.g. rpm")
+    min: Optional[float] = Field(default=None, description="Fire below this")
+    max: Optional[float] = Field(default=None, description="Fire above this")
+    hysteresis: float = Field(default=0.0, description="How far back inside the bounds before resolving")
+    window_s: Optional[float] = Field(default=None, description="Window length for window rules")
+    aggregate: str = Field(default="avg", description="avg, min, max, sum or count, for window rules")
+    name: Optional[str] = Field(default=None, description="Label copied into alerts")
 
 
 # -------------------------
@@ -178,136 +1687,631 @@ async def index():
 
 @app.get("/api/status")
 async def status() -> Dict[str, Any]:
-    async with STATE_LOCK:
-        device_count = len(STATE)
-    ws_count = await manager.count()
+    # Counts are read without taking any shard lock.
+    clients = await manager.stats()
     return {
         "ok": True,
-        "devices_known": device_count,
-        "websocket_clients_connected": ws_count,
+        "devices_known": len(STATE),
+        "state_seq": STATE.seq,
+        "state": STATE.stats(),
+        "data_snapshot_cache": snapshot_cache.stats(),
+        "websocket_clients_connected": len(clients) - manager.sse_clients,
+        "sse_clients_connected": manager.sse_clients,
+        "websocket_queued_messages": sum(c["queue_depth"] for c in clients),
+        "websocket_dropped_messages": sum(c["dropped"] for c in clients),
+        "websocket_slow_consumer_disconnects": manager.slow_consumer_disconnects,
+        "websocket_liveness": reaper.stats(),
+        "control": commands.stats(),
+        "rules": rules.stats(),
+        "ingest_limits": {
+            "per_device": device_limiter.stats(),
+            "per_connection": conn_limiter.stats(),
+            "in_flight": ingest_slots.stats(),
+        },
+        "json_backend": JSON_BACKEND,
+        "wire_encodings": sorted(ENCODERS),
+        "compression": {
+            "websocket": {"min_bytes": WS_COMPRESS_MIN_BYTES, "level": WS_COMPRESS_LEVEL, **ws_compression.stats()},
+            "http": {"min_bytes": HTTP_COMPRESS_MIN_BYTES, "brotli": brotli is not None, **http_compression.stats()},
+        },
+        "broadcast_coalescing": coalescer.stats(),
+        "persistence": state_store.stats(),
+        "event_bus": bus.stats(),
+        "history": history.stats(),
+        "capture": recorder.stats() if recorder is not None else {"enabled": False},
         "timestamp_utc": utc_now_iso(),
     }
 
 
-@app.get("/api/data")
-async def get_data() -> Dict[str, Any]:
-    async with STATE_LOCK:
-        snapshot = dict(STATE)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    # Prometheus text exposition format.
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/debug/diagnostics")
+async def diagnostics() -> Dict[str, Any]:
+    # Loop stalls with sampled stacks, plus the slowest REST/WS handlers (DIAGNOSTICS=1).
+    if stall_watchdog is None or handler_timings is None:
+        raise HTTPException(status_code=404, detail="diagnostics are off; start the server with DIAGNOSTICS=1")
     return {
+        "event_loop_lag": {
+            "last_ms": round(loop_lag.last_lag * 1000, 3),
+            "max_ms": round(loop_lag.max_lag * 1000, 3),
+        },
+        "stall_watchdog": stall_watchdog.report(),
+        **handler_timings.report(),
         "timestamp_utc": utc_now_iso(),
-        "data": snapshot,
+    }
+
+
+@app.get("/api/clients")
+async def clients() -> Dict[str, Any]:
+    # Per-connection outbound queue depth and drop counters.
+    return {
+        "policy": manager.policy,
+        "queue_limit": manager.max_queue,
+        "clients": await manager.stats(),
+        "timestamp_utc": utc_now_iso(),
+    }
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison (RFC 9110 13.1.2): W/ prefixes are ignored, "*" matches anything.
+    if not if_none_match:
+        return False
+    tag = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == tag:
+            return True
+    return False
+
+
+def _json_response(body: Union[str, bytes], etag: Optional[str] = None) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else None
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+@app.get("/api/data")
+async def get_data(request: Request, since: Optional[int] = None, epoch: Optional[str] = None) -> Response:
+    # ?since=<seq>&epoch=<epoch> returns only devices changed after that
+    # sequence number (or a full snapshot if the change log no longer reaches
+    # that far or the seq came from another process).
+    if since is not None:
+        mode, seq, data = STATE.since(since, epoch)
+        message = {"timestamp_utc": utc_now_iso(), "epoch": STATE.epoch, "seq": seq, "snapshot": mode, "data": data}
+        return _json_response(encode_message(message))
+    # Full snapshot: tagged with the state version. A poller sending the tag
+    # back in If-None-Match gets 304 until something changes; otherwise the
+    # body is the cached serialization of that version.
+    etag = state_etag(STATE.seq)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        snapshot_cache.not_modified += 1
+        return _not_modified(etag)
+    etag, body = snapshot_cache.get()
+    return _json_response(body, etag)
+
+
+@app.get("/api/data/{device_id}")
+async def get_device(device_id: str, request: Request) -> Response:
+    # One device's current entry, tagged with the seq of its last change.
+    entry = STATE.get(device_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"unknown device {device_id!r}")
+    etag = state_etag(entry["seq"])
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return _not_modified(etag)
+    return _json_response(encode_message({"device_id": device_id, "epoch": STATE.epoch, **entry}), etag)
+
+
+def _parse_time(raw: Optional[str], default: float, name: str) -> float:
+    # Epoch seconds or an ISO 8601 timestamp.
+    if raw is None or raw == "":
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        pass
+    else:
+        if not math.isfinite(value):
+            raise HTTPException(status_code=400, detail=f"{name} must be a finite number")
+        return value
+    try:
+        dt = datetime.fromisoformat(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be epoch seconds or ISO 8601")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+@app.get("/api/data/{device_id}/history")
+async def get_history(
+    device_id: str,
+    from_: Optional[str] = Query(default=None, alias="from", description="Start (epoch seconds or ISO 8601), default 1h ago"),
+    to: Optional[str] = Query(default=None, description="End (epoch seconds or ISO 8601), default now"),
+    step: Optional[float] = Query(default=None, gt=0, allow_inf_nan=False, description="Bucket size in seconds"),
+    field: Optional[str] = Query(default=None, description="Numeric field of an object value"),
+) -> Dict[str, Any]:
+    # Server-side downsampled min/max/avg/last per bucket.
+    t1 = _parse_time(to, time.time(), "to")
+    t0 = _parse_time(from_, t1 - 3600, "from")
+    if t1 <= t0:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if step is None:
+        step = max((t1 - t0) / 500, 0.001)
+    if (t1 - t0) / step > HISTORY_MAX_QUERY_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"range/step gives more than {HISTORY_MAX_QUERY_BUCKETS} buckets; use a larger step",
+        )
+
+    buckets = history.query(device_id, field, t0, t1, step)
+    if buckets is None:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "message": f"no numeric history for {device_id!r} field {field!r}",
+                "fields": history.fields(device_id),
+            },
+        )
+    return {
+        "device_id": device_id,
+        "field": field,
+        "from_utc": datetime.fromtimestamp(t0, timezone.utc).isoformat(),
+        "to_utc": datetime.fromtimestamp(t1, timezone.utc).isoformat(),
+        "step": step,
+        "buckets": buckets,
     }
 
 
 @app.post("/api/data")
-async def post_data(update: DataUpdate) -> Dict[str, Any]:
-    # Update shared state
-    async with STATE_LOCK:
-        STATE[update.device_id] = {
+async def post_data(update: DataUpdate, request: Request) -> Dict[str, Any]:
+    if recorder is not None:
+        recorder.record("rest", _rest_client_key(request)[1], "POST /api/data", update.model_dump())
+    # Admission control: per-connection and per-device rate, global in-flight cap
+    refused = check_rate(_rest_client_key(request), update.device_id, "rest")
+    if refused is not None:
+        raise too_many_requests(*refused)
+    if not ingest_slots.try_acquire():
+        INGEST_REJECTED.labels("server", "rest").inc()
+        raise too_many_requests("server", 1.0)
+    try:
+        # Update shared state
+        now = utc_now_iso()
+        seq = await STATE.put(update.device_id, update.value, now)
+        INGEST_REST.inc()
+
+        event = {
+            "type": "data_update",
+            "device_id": update.device_id,
             "value": update.value,
-            "updated_at_utc": utc_now_iso(),
+            "seq": seq,
+            "timestamp_utc": now,
+            "source": "rest",
         }
-
-    event = {
-        "type": "data_update",
-        "device_id": update.device_id,
-        "value": update.value,
-        "timestamp_utc": utc_now_iso(),
-        "source": "rest",
-    }
-    # Broadcast to all WS clients
-    await manager.broadcast(event)
+        # Broadcast to subscribed WS clients (possibly coalesced)
+        await publish_update(event)
+        await check_rules(update.device_id, update.value, now)
+    finally:
+        ingest_slots.release()
 
     return {"ok": True, "stored": True, "event": event}
 
 
+@app.post("/api/data/batch")
+async def post_data_batch(batch: DataBatch, request: Request) -> Dict[str, Any]:
+    if recorder is not None:
+        recorder.record("rest", _rest_client_key(request)[1], "POST /api/data/batch", {"items": batch.items})
+    if len(batch.items) > INGEST_MAX_BATCH:
+        raise HTTPException(
+            status_code=413, detail=f"batch larger than {INGEST_MAX_BATCH} items"
+        )
+    # Each item costs one token from the connection's bucket; device limits apply per item.
+    refused = check_rate(_rest_client_key(request), None, "rest", cost=len(batch.items))
+    if refused is not None:
+        raise too_many_requests(*refused)
+    if not ingest_slots.try_acquire():
+        INGEST_REJECTED.labels("server", "rest").inc(len(batch.items))
+        raise too_many_requests("server", 1.0)
+    try:
+        result = await apply_batch(batch.items, "rest")
+    finally:
+        ingest_slots.release()
+    return {"ok": True, **result}
+
+
 @app.post("/api/control")
-async def control(cmd: ControlCommand) -> Dict[str, Any]:
+async def control(cmd: ControlCommand, request: Request) -> Dict[str, Any]:
+    if recorder is not None:
+        recorder.record("rest", _rest_client_key(request)[1], "POST /api/control", cmd.model_dump())
     # In a real system you'd validate that target exists, permissions, etc.
-    # Here we just broadcast a "control" event.
-    event = {
-        "type": "control",
-        "target": cmd.target,
-        "command": cmd.command,
-        "args": cmd.args or {},
+    # The command is queued for the target and sent to clients subscribed to
+    # "device:<target>" (plus "type:control" observers). "status" says whether
+    # it reached the device yet; follow it on GET /api/control/{id}.
+    try:
+        queued = await commands.submit(cmd.target, cmd.command, cmd.args or {}, "rest", cmd.require_ack)
+    except QueueFull as exc:
+        raise HTTPException(status_code=429, detail=str(exc))
+    return {
+        "ok": True,
+        # Kept from the fire-and-forget API: whether it went out now, and what was sent.
+        "dispatched": queued.status != "queued",
+        "event": control_event(queued, max(queued.attempts, 1)),
+        "command_id": queued.id,
+        "status": queued.status,
+        "command": queued.to_dict(),
+    }
+
+
+@app.get("/api/control/{command_id}")
+async def control_status(command_id: str) -> Dict[str, Any]:
+    # queued / sent / acked / rejected / delivered / failed / expired
+    queued = commands.get(command_id)
+    if queued is None:
+        raise HTTPException(status_code=404, detail=f"unknown command {command_id!r}")
+    return queued.to_dict()
+
+
+def _parse_event_id(raw: str) -> Tuple[Optional[int], Optional[str]]:
+    # "<epoch>:<seq>" as written by encode_sse; (None, None) if it isn't one.
+    epoch, _, seq = raw.rpartition(":")
+    if not seq.isdigit():
+        return None, None
+    return int(seq), epoch or None
+
+
+def _visible_snapshot(topics: Iterable[str], snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    # Only the devices whose updates the stream will carry.
+    topics = set(topics)
+    if topics & {WILDCARD_TOPIC, "type:data_update", "type:data_update_batch"}:
+        return snapshot
+    visible = {}
+    for topic in topics:
+        if topic.startswith("device:") and topic[len("device:"):] in snapshot:
+            visible[topic[len("device:"):]] = snapshot[topic[len("device:"):]]
+    return visible
+
+
+@app.get("/api/stream")
+async def stream(
+    request: Request,
+    topics: Optional[str] = None,
+    devices: Optional[str] = Query(None, alias="device"),
+    types: Optional[str] = Query(None, alias="type"),
+    since: Optional[int] = None,
+    epoch: Optional[str] = None,
+) -> StreamingResponse:
+    # Server-Sent Events from the same broadcast pipeline as /ws.
+    # Filters: ?device=a,b and/or ?type=data_update,control (or ?topics= as on /ws);
+    # an event is sent if it matches any of them. No filter = every event ("*").
+    wanted: List[str] = []
+    if topics is not None:
+        parsed = parse_topics(topics)
+        if parsed is None:
+            raise HTTPException(status_code=400, detail=f"invalid topics {topics!r}")
+        wanted.extend(parsed)
+    for kind, raw in (("device", devices), ("type", types)):
+        if raw is not None:
+            parsed = parse_topics([f"{kind}:{name.strip()}" for name in raw.split(",")])
+            if parsed is None:
+                raise HTTPException(status_code=400, detail=f"invalid {kind} filter {raw!r}")
+            wanted.extend(parsed)
+
+    # Resume: EventSource sends the last id it saw as Last-Event-ID when it
+    # reconnects; ?since=<seq>&epoch=<epoch> does the same for a first connect.
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        since, epoch = _parse_event_id(last_event_id)
+
+    transport = SSETransport()
+    conn = await manager.connect(transport, wanted or DEFAULT_TOPICS, "sse")
+    mode, seq, snapshot = STATE.since(since, epoch)
+    conn.send(
+        {
+            "type": "hello",
+            "message": "connected",
+            "timestamp_utc": utc_now_iso(),
+            "encoding": "sse",
+            "topics": sorted(conn.topics),
+            "epoch": STATE.epoch,
+            "seq": seq,
+            "snapshot": mode,
+            "data_snapshot": _visible_snapshot(conn.topics, snapshot),
+        }
+    )
+
+    async def body() -> AsyncIterator[str]:
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            async for frame in transport.frames():
+                yield frame
+                # Each frame that got out (heartbeats included) proves the stream is alive.
+                manager.touch(conn)
+        finally:
+            await manager.disconnect(transport)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/rules")
+async def list_rules(device_id: Optional[str] = None) -> Dict[str, Any]:
+    # Every rule with its state ("firing" / "ok") and last observed metric.
+    return {
+        "rules": [rule.to_dict() for rule in rules.rules(device_id)],
         "timestamp_utc": utc_now_iso(),
-        "source": "rest",
     }
-    await manager.broadcast(event)
-    return {"ok": True, "dispatched": True, "event": event}
+
+
+@app.post("/api/rules")
+async def add_rule(spec: AlertRule) -> Dict[str, Any]:
+    try:
+        rule = rules.add(spec.model_dump())
+    except InvalidRule as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    await bus.publish({"type": "rule_change", "action": "add", "rule": rule.spec(), "timestamp_utc": utc_now_iso()})
+    return {"ok": True, "rule": rule.to_dict()}
+
+
+@app.delete("/api/rules/{rule_id}")
+async def delete_rule(rule_id: str) -> Dict[str, Any]:
+    rule = rules.remove(rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail=f"unknown rule {rule_id!r}")
+    await bus.publish({"type": "rule_change", "action": "remove", "rule": rule.spec(), "timestamp_utc": utc_now_iso()})
+    if rule.firing:
+        # Don't leave consumers holding an alert nothing will ever resolve.
+        await bus.publish(
+            {
+                "type": "alert",
+                "state": "resolved",
+                "reason": "rule removed",
+                "rule_id": rule.id,
+                "name": rule.name,
+                "device_id": rule.device_id,
+                "field": rule.field,
+                "kind": rule.kind,
+                "timestamp_utc": utc_now_iso(),
+            }
+        )
+    return {"ok": True, "rule": rule.to_dict()}
 
 
 # -------------------------
 # WebSocket Endpoint
 # -------------------------
+def send_throttle(conn: ClientConnection, scope: str, retry_after: float, device_id: Optional[str] = None) -> None:
+    """Tell a client it is over an ingest limit; at most one notice per retry period."""
+    conn.throttled += 1
+    now = time.monotonic()
+    if now < conn.throttled_until:
+        return
+    conn.throttled_until = now + retry_after
+    conn.send(
+        {
+            "type": "throttle",
+            "scope": scope,
+            "device_id": device_id,
+            "retry_after_ms": int(math.ceil(retry_after * 1000)),
+            "timestamp_utc": utc_now_iso(),
+            "message": f"{scope} ingest limit exceeded; messages are being dropped",
+        }
+    )
+
+
+# Field specs for every client message type, built once.
+ws_validator = MessageValidator(max_batch=INGEST_MAX_BATCH)
+
+
+def send_error(conn: ClientConnection, message: str, msg: Any = None, errors: Optional[List[Dict[str, str]]] = None) -> None:
+    """Reply with an error for one message; the connection stays open."""
+    reply: Dict[str, Any] = {"type": "error", "timestamp_utc": utc_now_iso(), "message": message}
+    if isinstance(msg, dict):
+        reply["request_type"] = msg.get("type")
+        if "id" in msg:
+            # Lets clients match the error to the message they sent.
+            reply["id"] = msg["id"]
+    if errors:
+        reply["errors"] = errors
+    conn.send(reply)
+
+
+async def handle_ws_message(conn: ClientConnection, msg: Dict[str, Any]) -> None:
+    """Handle one message a client sent on /ws."""
+    errors = ws_validator.validate(msg)
+    if errors is not None:
+        send_error(conn, "invalid message", msg, errors)
+        return
+
+    # Basic protocol:
+    # {"type":"telemetry","device_id":"device_one","value":123}
+    msg_type = msg["type"]
+    if msg_type == "telemetry":
+        device_id = msg["device_id"]
+        refused = check_rate(("ws", conn.client_id), device_id, "websocket")
+        if refused is not None:
+            send_throttle(conn, *refused, device_id=device_id)
+            return
+        if not ingest_slots.try_acquire():
+            INGEST_REJECTED.labels("server", "websocket").inc()
+            send_throttle(conn, "server", 1.0, device_id=device_id)
+            return
+        try:
+            value = msg["value"]
+            now = utc_now_iso()
+            seq = await STATE.put(device_id, value, now)
+            INGEST_WS.inc()
+
+            event = {
+                "type": "data_update",
+                "device_id": device_id,
+                "value": value,
+                "seq": seq,
+                "timestamp_utc": now,
+                "source": "websocket",
+            }
+            await publish_update(event)
+            await check_rules(device_id, value, now)
+        finally:
+            ingest_slots.release()
+
+    elif msg_type == "telemetry_batch":
+        # {"type":"telemetry_batch","items":[{"device_id":"a","value":1}, ...]}
+        items = msg["items"]
+        refused = check_rate(("ws", conn.client_id), None, "websocket", cost=len(items))
+        if refused is not None:
+            send_throttle(conn, *refused)
+            return
+        if not ingest_slots.try_acquire():
+            INGEST_REJECTED.labels("server", "websocket").inc(len(items))
+            send_throttle(conn, "server", 1.0)
+            return
+        try:
+            result = await apply_batch(items, "websocket")
+        finally:
+            ingest_slots.release()
+        conn.send({"type": "batch_result", **result})
+
+    elif msg_type in ("subscribe", "unsubscribe"):
+        # {"type":"subscribe","topics":["device:device_one","type:control"]}
+        topics = parse_topics(msg["topics"])
+        if topics is None:
+            send_error(conn, f"{msg_type} requires topics like '*', 'type:<type>' or 'device:<id>'", msg)
+            return
+        if msg_type == "subscribe":
+            await manager.subscribe(conn, topics)
+        else:
+            await manager.unsubscribe(conn, topics)
+        conn.send(
+            {
+                "type": "subscriptions",
+                "timestamp_utc": utc_now_iso(),
+                "topics": sorted(conn.topics),
+            }
+        )
+
+    elif msg_type == "ping":
+        conn.send({"type": "pong", "timestamp_utc": utc_now_iso()})
+
+    elif msg_type == "pong":
+        # Reply to a server heartbeat; receiving it already marked the client alive.
+        pass
+
+    elif msg_type == "control":
+        try:
+            queued = await commands.submit(
+                msg["target"], msg["command"], msg.get("args") or {}, "websocket", msg.get("require_ack") is True
+            )
+        except QueueFull as exc:
+            send_error(conn, str(exc), msg)
+            return
+        reply = {"type": "control_status", "timestamp_utc": utc_now_iso(), **queued.to_dict()}
+        if "id" in msg:
+            reply["id"] = msg["id"]
+        conn.send(reply)
+
+    elif msg_type == "control_ack":
+        # {"type":"control_ack","command_id":"...","ok":true,"detail":...} from the device
+        event = {
+            "type": "control_ack",
+            "command_id": msg["command_id"],
+            "ok": msg.get("ok") is not False,
+            "detail": msg.get("detail"),
+            "timestamp_utc": utc_now_iso(),
+            "source": "websocket",
+        }
+        acked = commands.ack(event["command_id"], event["ok"], event["detail"])
+        if acked is not None:
+            event["target"] = acked.target
+            event["command"] = acked.command
+        # Observers ("type:control_ack") and the other workers see it too.
+        await bus.publish(event)
+
+    else:
+        # Unknown message type: echo it back for debugging
+        conn.send(
+            {
+                "type": "echo",
+                "timestamp_utc": utc_now_iso(),
+                "received": msg,
+                "note": "Unrecognized message type",
+            }
+        )
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket) -> None:
-    await manager.connect(websocket)
+    # Optional initial subscriptions: /ws?topics=device:device_one,type:control
+    requested = websocket.query_params.get("topics")
+    topics = parse_topics(requested) if requested is not None else None
+    # A device connects as itself with /ws?device=<id>: it is subscribed to
+    # "device:<id>" (and, without ?topics=, nothing else) and control
+    # commands for <id> count as delivered only to such a connection.
+    device_id = websocket.query_params.get("device")
+    # Wire encoding: /ws?encoding=msgpack or a "msgpack"/"cbor" subprotocol; JSON by default
+    encoding, subprotocol = negotiate_encoding(websocket)
+    if (requested is not None and topics is None) or device_id == "":
+        # Never fall back to "*" for a filter we could not parse.
+        await websocket.accept(subprotocol=subprotocol)
+        await websocket.close(code=1008, reason="invalid topics" if device_id != "" else "invalid device")
+        return
+    if topics is None:
+        topics = [] if device_id else list(DEFAULT_TOPICS)
+    # /ws?compress=deflate: frames of at least WS_COMPRESS_MIN_BYTES are sent deflated
+    compress = websocket.query_params.get("compress") == "deflate"
+    conn = await manager.connect(websocket, topics, encoding, subprotocol, compress, device_id)
 
-    # Send initial snapshot on connect
-    async with STATE_LOCK:
-        snapshot = dict(STATE)
+    # Send initial snapshot on connect; /ws?since=<seq>&epoch=<epoch> gets only what changed
+    since_raw = websocket.query_params.get("since")
+    since = int(since_raw) if since_raw and since_raw.isdigit() else None
+    mode, seq, snapshot = STATE.since(since, websocket.query_params.get("epoch"))
 
-    await websocket.send_json(
+    conn.send(
         {
             "type": "hello",
             "message": "connected",
             "timestamp_utc": utc_now_iso(),
+            "encoding": encoding,
+            "compression": {"codec": "deflate", "min_bytes": WS_COMPRESS_MIN_BYTES} if compress else None,
+            "epoch": STATE.epoch,
+            "seq": seq,
+            "snapshot": mode,
             "data_snapshot": snapshot,
         }
     )
+    # A reconnecting device gets the commands queued while it was away.
+    if device_id:
+        await commands.flush_target(device_id)
+    capture_key = f"ws-{conn.client_id}"
+    if recorder is not None:
+        recorder.record("ws", capture_key, "open", websocket.url.query)
 
     try:
         while True:
             # Client can push events too
-            msg = await websocket.receive_json()
-
-            # Basic protocol:
-            # {"type":"telemetry","device_id":"device_one","value":123}
-            msg_type = msg.get("type")
-            if msg_type == "telemetry":
-                device_id = msg.get("device_id")
-                if not device_id:
-                    raise HTTPException(status_code=400, detail="telemetry missing device_id")
-
-                value = msg.get("value")
-                async with STATE_LOCK:
-                    STATE[device_id] = {"value": value, "updated_at_utc": utc_now_iso()}
-
-                event = {
-                    "type": "data_update",
-                    "device_id": device_id,
-                    "value": value,
-                    "timestamp_utc": utc_now_iso(),
-                    "source": "websocket",
-                }
-                await manager.broadcast(event)
-
-            elif msg_type == "ping":
-                await websocket.send_json({"type": "pong", "timestamp_utc": utc_now_iso()})
-            
-            elif msg_type == "control":
-                event = {
-                    "type": "control",
-                    "target": msg.get("target"),
-                    "command": msg.get("command"),
-                    "args": msg.get("args") or {},
-                    "timestamp_utc": utc_now_iso(),
-                    "source": "websocket",
-                }
-                await manager.broadcast(event)
-
-
-            else:
-                # Unknown message type: echo it back for debugging
-                await websocket.send_json(
-                    {
-                        "type": "echo",
-                        "timestamp_utc": utc_now_iso(),
-                        "received": msg,
-                        "note": "Unrecognized message type",
-                    }
-                )
+            try:
+                msg = await conn.receive()
+            except MalformedFrame as exc:
+                manager.touch(conn)
+                send_error(conn, str(exc))
+                continue
+            manager.touch(conn)
+            if recorder is not None:
+                recorder.record("ws", capture_key, "message", msg)
+            start = time.perf_counter()
+            await handle_ws_message(conn, msg)
+            if handler_timings is not None:
+                msg_type = msg.get("type") if isinstance(msg, dict) else None
+                handler_timings.record("ws", str(msg_type), time.perf_counter() - start, f"client {conn.client_id}")
 
     except WebSocketDisconnect:
         await manager.disconnect(websocket)
@@ -315,3 +2319,7 @@ async def websocket_endpoint(websocket: WebSocket) -> None:
         # Ensure cleanup on unexpected errors
         await manager.disconnect(websocket)
         raise
+    finally:
+        conn_limiter.forget(("ws", conn.client_id))
+        if recorder is not None:
+            recorder.record("ws", capture_key, "close")
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# A check returns None if the value is fine, else a short error string.
+Check = Callable[[Any], Optional[str]]
+# (field name, required, check or None for "any value")
+FieldSpec = Tuple[str, bool, Optional[Check]]
+
+_MISSING = object()
+
+
+def non_empty_str(v: Any) -> Optional[str]:
+    if type(v) is str and v:
+        return None
+    return "must be a non-empty string"
+
+
+# Types JSON can hold; a stored or forwarded value is re-sent as JSON
+# (snapshots, SSE, persistence) whatever encoding it arrived in.
+JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def json_value(v: Any) -> Optional[str]:
+    """None if ``v`` has a JSON form, else why not.
+
+    JSON text always does; msgpack and CBOR frames can carry bytes, tags,
+    non-string keys and the like, which are refused here.
+    """
+    stack = [v]
+    while stack:
+        v = stack.pop()
+        t = type(v)
+        if t is dict:
+            for key, item in v.items():
+                if type(key) is not str:
+                    return f"has a non-string object key ({type(key).__name__})"
+                if type(item) not in JSON_SCALARS:
+                    stack.append(item)
+        elif t is list:
+            for item in v:
+                if type(item) not in JSON_SCALARS:
+                    stack.append(item)
+        elif t not in JSON_SCALARS:
+            return f"has no JSON form ({t.__name__})"
+    return None
+
+
+def optional_object(v: Any) -> Optional[str]:
+    if v is None or type(v) is dict:
+        return None
+    return "must be an object"
+
+
+def optional_bool(v: Any) -> Optional[str]:
+    if v is None or type(v) is bool:
+        return None
+    return "must be true or false"
+
+
+def list_of_at_most(limit: int) -> Check:
+    def check(v: Any) -> Optional[str]:
+        if type(v) is not list:
+            return "must be a list"
+        if len(v) > limit:
+            return f"must have at most {limit} entries"
+        return None
+
+    return check
+
+
+def topic_list(v: Any) -> Optional[str]:
+    # Topic syntax itself is checked by parse_topics when applying the change.
+    if type(v) is str or type(v) is list:
+        return None
+    return "must be a list of topics or a comma-separated string"
+
+
+def schemas(max_batch: int) -> Dict[str, Tuple[FieldSpec, ...]]:
+    """Field specs for every message type a client may send on /ws."""
+    return {
+        "telemetry": (("device_id", True, non_empty_str), ("value", True, None)),
+        "telemetry_batch": (("items", True, list_of_at_most(max_batch)),),
+        "subscribe": (("topics", True, topic_list),),
+        "unsubscribe": (("topics", True, topic_list),),
+        "control": (
+            ("target", True, non_empty_str),
+            ("command", True, non_empty_str),
+            ("args", False, optional_object),
+            ("require_ack", False, optional_bool),
+        ),
+        "control_ack": (("command_id", True, non_empty_str), ("ok", False, optional_bool), ("detail", False, None)),
+        "ping": (),
+        "pong": (),
+    }
+
+
+class MessageValidator:
+    """Validates decoded /ws messages against per-type field specs built once up front.
+
+    A valid message costs one pass over its type's spec with a single dict
+    lookup per field; non-empty-string checks (the common case) run inline,
+    without a call, and nothing is allocated. Only an invalid message takes
+    the slow path that lists every bad field. Types without a spec pass
+    through (the endpoint echoes them).
+    """
+
+    def __init__(self, max_batch: int) -> None:
+        self._schemas = schemas(max_batch)
+
+    @property
+    def types(self) -> List[str]:
+        return sorted(self._schemas)
+
+    def validate(self, msg: Any) -> Optional[List[Dict[str, str]]]:
+        """None if ``msg`` is valid, else a list of {"field", "error"}."""
+        if type(msg) is not dict:
+            return [{"field": "", "error": "message must be a JSON object"}]
+        msg_type = msg.get("type")
+        if type(msg_type) is not str:
+            return [{"field": "type", "error": "must be a string"}]
+        spec = self._schemas.get(msg_type)
+        if spec is None:
+            return None
+        for name, required, check in spec:
+            value = msg.get(name, _MISSING)
+            if value is _MISSING:
+                if required:
+                    return self._errors(msg, spec)
+                continue
+            if check is None:
+                continue
+            if check is non_empty_str:
+                if type(value) is str and value:
+                    continue
+            elif check(value) is None:
+                continue
+            return self._errors(msg, spec)
+        return None
+
+    def _errors(self, msg: Dict[str, Any], spec: Tuple[FieldSpec, ...]) -> List[Dict[str, str]]:
+        errors = []
+        for name, required, check in spec:
+            value = msg.get(name, _MISSING)
+            if value is _MISSING:
+                if required:
+                    errors.append({"field": name, "error": "is required"})
+            elif check is not None:
+                error = check(value)
+                if error is not None:
+                    errors.append({"field": name, "error": error})
+        return errors
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Instruments are plain attribute updates with no locks: everything that
+# records runs on the event loop, and a scrape just reads the current numbers.
+
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, int) or float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """The child for these label values (create once, keep it for hot paths)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.value += amount
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            yield f"{self.name}{_labels(self.labelnames, values)} {_fmt(child.value)}"
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.bounds, math.inf), child.counts):
+                cumulative += count
+                le = f'le="{_fmt(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {_fmt(child.sum)}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {child.count}"
+
+
+class Callback(_Metric):
+    """A gauge or counter whose value is read from ``fn()`` at scrape time.
+
+    ``fn`` returns a number, or for labelled metrics a {label values tuple: number} dict.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], object], kind: str = "gauge", labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def _samples(self) -> Iterable[str]:
+        value = self.fn()
+        if isinstance(value, dict):
+            for values, v in value.items():
+                yield f"{self.name}{_labels(self.labelnames, values)} {_fmt(v)}"
+        else:
+            yield f"{self.name} {_fmt(value)}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(
+        self, name: str, help: str, fn: Callable[[], object], kind: str = "gauge", labelnames: Sequence[str] = ()
+    ) -> Callback:
+        return self.register(Callback(name, help, fn, kind, labelnames))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Measures event-loop lag: how late a timer scheduled every ``interval`` seconds actually fires.
+
+    A lag of tens of milliseconds means something is running on the loop
+    without yielding (a large encode, a blocking call, ...).
+    """
+
+    def __init__(self, histogram: Histogram, interval: float = 0.1) -> None:
+        self.histogram = histogram
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.last_lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            self.histogram.observe(lag)
@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# (seq, device_id -> {"value", "updated_at_utc", "seq"})
+Snapshot = Tuple[int, Dict[str, Dict[str, Any]]]
+
+
+class StateStore:
+    """Persistence backend for device state. The default keeps nothing (in-memory only)."""
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self.load_ms = 0.0
+        self.loaded_devices = 0
+
+    def load(self) -> Snapshot:
+        return 0, {}
+
+    def record(self, device_id: str, entry: Dict[str, Any]) -> None:
+        pass
+
+    def start(self, snapshot: Callable[[], Snapshot]) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "load_ms": round(self.load_ms, 3),
+            "loaded_devices": self.loaded_devices,
+        }
+
+
+class FileStateStore(StateStore):
+    """Append-only change log plus a periodically compacted snapshot on local disk.
+
+    ``record`` only appends to an in-memory buffer; a background task writes the
+    buffer to ``state.log`` every ``flush_interval_ms`` in a worker thread, so the
+    ingest path never waits on disk. After ``snapshot_every`` logged records the
+    current state is written to ``state.snapshot.json`` and the log is truncated.
+    On startup the snapshot is loaded and the log tail (records newer than the
+    snapshot's seq) is replayed on top of it.
+    """
+
+    name = "file"
+    LOG_NAME = "state.log"
+    SNAPSHOT_NAME = "state.snapshot.json"
+
+    def __init__(
+        self,
+        directory: str,
+        flush_interval_ms: int = 200,
+        snapshot_every: int = 10000,
+        fsync: bool = False,
+    ) -> None:
+        super().__init__()
+        self.directory = directory
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.log_path = os.path.join(directory, self.LOG_NAME)
+        self.snapshot_path = os.path.join(directory, self.SNAPSHOT_NAME)
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._log = None
+        self._snapshot: Optional[Callable[[], Snapshot]] = None
+        self._task: Optional[asyncio.Task] = None
+        # A cancelled flush's worker thread may still be writing; never overlap two.
+        self._flush_lock = asyncio.Lock()
+        self._since_snapshot = 0
+
+        self.replayed_records = 0
+        self.flushed_records = 0
+        self.flushes = 0
+        self.snapshots = 0
+        self.last_flush_ms = 0.0
+        self.write_errors = 0
+        # Records (and snapshot entries) JSON can't encode; they are skipped, not retried.
+        self.dropped_records = 0
+
+    # -- startup --------------------------------------------------------
+    def load(self) -> Snapshot:
+        start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+
+        seq, state = 0, {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            seq, state = snap["seq"], snap["data"]
+
+        replayed = 0
+        if os.path.exists(self.log_path):
+            good_bytes = 0
+            torn = False
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # Torn final write from a crash; everything before it is good.
+                        torn = True
+                        break
+                    good_bytes += len(line)
+                    if rec["seq"] <= seq:
+                        continue
+                    seq = rec["seq"]
+                    state[rec["device_id"]] = {
+                        "value": rec["value"],
+                        "updated_at_utc": rec["updated_at_utc"],
+                        "seq": rec["seq"],
+                    }
+                    replayed += 1
+                    self._since_snapshot += 1
+            if torn:
+                # Cut the partial record so new appends start on a clean line.
+                os.truncate(self.log_path, good_bytes)
+
+        self.replayed_records = replayed
+        self.loaded_devices = len(state)
+        self.load_ms = (time.perf_counter() - start) * 1000
+        return seq, state
+
+    # -- ingest path ----------------------------------------------------
+    def record(self, device_id: str, entry: Dict[str, Any]) -> None:
+        self._buffer.append({"device_id": device_id, **entry})
+
+    # -- background writer ----------------------------------------------
+    def start(self, snapshot: Callable[[], Snapshot]) -> None:
+        self._snapshot = snapshot
+        os.makedirs(self.directory, exist_ok=True)
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            # Shutdown goes on; whatever couldn't be written is lost either way.
+            self.write_errors += 1
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Keep the records for the next attempt rather than dying.
+                self.write_errors += 1
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if self._buffer and self._log is not None:
+            records, self._buffer = self._buffer, []
+            start = time.perf_counter()
+            try:
+                written = await asyncio.to_thread(self._write_records, records)
+            except Exception:
+                # An I/O error: the records are fine, so keep them for the next attempt.
+                self._buffer[:0] = records
+                raise
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.flushed_records += written
+            self.dropped_records += len(records) - written
+            self._since_snapshot += written
+
+        if self._since_snapshot >= self.snapshot_every and self._snapshot is not None:
+            await self.compact()
+
+    def _write_records(self, records: List[Dict[str, Any]]) -> int:
+        """Append the records JSON can encode; returns how many were written.
+
+        Each record is encoded on its own, so one that can't be (it could
+        never be written) is skipped instead of failing, and then blocking,
+        everything flushed with it.
+        """
+        lines = []
+        for r in records:
+            try:
+                lines.append(json.dumps(r, separators=(",", ":")) + "\n")
+            except (TypeError, ValueError):
+                continue
+        self._log.write("".join(lines))
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        return len(lines)
+
+    async def compact(self) -> None:
+        """Write a full snapshot and truncate the log.
+
+        Every record already in the log was stored before the snapshot was
+        taken, so the snapshot covers them; records still buffered have
+        seq <= snapshot seq or newer ones and are replayed correctly either way.
+        """
+        seq, data = self._snapshot()
+        self.dropped_records += await asyncio.to_thread(self._write_snapshot, seq, data)
+        self._since_snapshot = 0
+        self.snapshots += 1
+
+    def _write_snapshot(self, seq: int, data: Dict[str, Dict[str, Any]]) -> int:
+        """Write the snapshot and truncate the log; returns how many entries JSON couldn't encode."""
+        dropped = 0
+        try:
+            body = json.dumps({"seq": seq, "data": data}, separators=(",", ":"))
+        except (TypeError, ValueError):
+            # Rare: find the offending entries rather than never compacting again.
+            kept = {}
+            for device_id, entry in data.items():
+                try:
+                    json.dumps(entry)
+                except (TypeError, ValueError):
+                    dropped += 1
+                    continue
+                kept[device_id] = entry
+            body = json.dumps({"seq": seq, "data": kept}, separators=(",", ":"))
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self._log.truncate(0)
+        self._log.seek(0)
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "directory": self.directory,
+            "replayed_records": self.replayed_records,
+            "pending_records": len(self._buffer),
+            "flushed_records": self.flushed_records,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "snapshots": self.snapshots,
+            "write_errors": self.write_errors,
+            "dropped_records": self.dropped_records,
+        }
+
+
+def make_store(backend: str, directory: str, flush_interval_ms: int, snapshot_every: int, fsync: bool) -> StateStore:
+    if backend == "memory":
+        return StateStore()
+    if backend == "file":
+        return FileStateStore(directory, flush_interval_ms, snapshot_every, fsync)
+    raise RuntimeError(f"STATE_BACKEND must be 'memory' or 'file', got {backend!r}")
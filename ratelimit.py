@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, Hashable, List, Optional
+
+
+class RateLimiter:
+    """Token buckets keyed by device, connection, ... (``rate`` tokens/s, up to ``burst``).
+
+    A bucket is just [tokens, last refill time]. Buckets that have refilled
+    completely carry no information, so when more than ``max_keys`` are held
+    the full ones are dropped; memory stays bounded by the keys that are
+    actually being limited.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self._buckets: Dict[Hashable, List[float]] = {}
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, key: Hashable, cost: float = 1.0, now: Optional[float] = None) -> float:
+        """Take ``cost`` tokens. Returns 0.0 if allowed, else seconds until it would be.
+
+        A cost above ``burst`` (a large batch) could never be covered, so it is
+        admitted once the bucket is full and leaves it in debt: the full cost
+        is still charged, and nothing else gets in until it is paid back.
+        """
+        if self.rate <= 0:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= min(cost, self.burst):
+            bucket[0] -= cost
+            return 0.0
+        self.rejected += 1
+        return (min(cost, self.burst) - bucket[0]) / self.rate
+
+    def forget(self, key: Hashable) -> None:
+        self._buckets.pop(key, None)
+
+    def _prune(self, now: float) -> None:
+        full = [
+            key for key, (tokens, at) in self._buckets.items()
+            if tokens + (now - at) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self._buckets[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate_per_s": self.rate,
+            "burst": self.burst,
+            "tracked_keys": len(self._buckets),
+            "rejected": self.rejected,
+        }
+
+
+class ConcurrencyLimit:
+    """Non-blocking cap on work in progress: over the limit, callers are turned away, not queued."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        if self.limit > 0 and self.in_flight >= self.limit:
+            self.rejected += 1
+            return False
+        self.in_flight += 1
+        if self.in_flight > self.peak:
+            self.peak = self.in_flight
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "peak": self.peak,
+            "rejected": self.rejected,
+        }
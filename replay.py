@@ -0,0 +1,260 @@
+"""Replays a traffic capture (CAPTURE_FILE, see capture.py) against a server.
+
+Each captured client gets its own connection: a keep-alive HTTP connection for
+a REST client, a WebSocket (opened with the captured query string) for a /ws
+client. Each client's requests are sent in their captured order; different
+clients run concurrently. Timing follows the capture scaled by --speed, or
+goes as fast as the server accepts with --speed max. The capture is streamed,
+so files larger than memory replay fine. Prints one JSON report on stdout.
+
+    python replay.py capture.jsonl --speed 1     # real time
+    python replay.py capture.jsonl --speed 10    # 10x faster
+    python replay.py capture.jsonl --speed max   # throughput benchmark
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from array import array
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import websockets
+
+from client import HttpConnection
+
+# Query parameters that only made sense for the original connection.
+SESSION_PARAMS = ("since", "epoch")
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.records = 0
+        self.skipped = 0
+        self.sent: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.status: Dict[str, int] = {}
+        self.rest_latencies = array("d")
+        self.ws_connects = 0
+        self.ws_received = 0
+        self.max_lag = 0.0
+
+    def count(self, table: Dict[str, int], key: str) -> None:
+        table[key] = table.get(key, 0) + 1
+
+
+def read_capture(path: str, stats: Stats) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                # A torn last line from a server that was killed mid-write.
+                stats.skipped += 1
+                continue
+            stats.records += 1
+            yield rec
+
+
+class RestClient:
+    """Replays one captured REST client over one keep-alive connection."""
+
+    def __init__(self, args: argparse.Namespace, stats: Stats) -> None:
+        self.conn = HttpConnection(args.host, args.port, args.tls)
+        self.stats = stats
+
+    async def handle(self, rec: Dict[str, Any]) -> None:
+        method, _, path = rec["op"].partition(" ")
+        body = json.dumps(rec["body"]).encode("utf-8") if rec.get("body") is not None else None
+        start = time.perf_counter()
+        try:
+            resp = await self.conn.request(method, path, body)
+        except Exception:
+            self.stats.count(self.stats.errors, rec["op"])
+            return
+        self.stats.rest_latencies.append(time.perf_counter() - start)
+        self.stats.count(self.stats.sent, rec["op"])
+        self.stats.count(self.stats.status, str(resp.status))
+
+    async def close(self) -> None:
+        await self.conn.close()
+
+
+class WsClient:
+    """Replays one captured /ws client; replies to heartbeats and counts what it receives."""
+
+    def __init__(self, args: argparse.Namespace, stats: Stats) -> None:
+        self.ws_url = args.ws_url
+        self.stats = stats
+        self.ws: Any = None
+        self.drainer: Optional[asyncio.Task] = None
+
+    async def handle(self, rec: Dict[str, Any]) -> None:
+        op = rec["op"]
+        if op == "open" or (op == "message" and self.ws is None):
+            await self.open(rec["body"] if op == "open" else "")
+            if op == "open":
+                return
+        if op == "close":
+            await self.close()
+            return
+        if self.ws is None:
+            return
+        try:
+            await self.ws.send(json.dumps(rec["body"]))
+            msg_type = rec["body"].get("type") if isinstance(rec["body"], dict) else None
+            self.stats.count(self.stats.sent, f"ws {msg_type}")
+        except Exception:
+            self.stats.count(self.stats.errors, "ws message")
+
+    async def open(self, query: str) -> None:
+        await self.close()
+        params = [(k, v) for k, v in parse_qsl(query or "") if k not in SESSION_PARAMS]
+        url = self.ws_url + ("?" + urlencode(params) if params else "")
+        try:
+            self.ws = await websockets.connect(url, max_size=None)
+        except Exception:
+            self.stats.count(self.stats.errors, "ws open")
+            return
+        self.stats.ws_connects += 1
+        self.drainer = asyncio.create_task(self.drain(self.ws))
+
+    async def drain(self, ws: Any) -> None:
+        try:
+            async for raw in ws:
+                self.stats.ws_received += 1
+                if isinstance(raw, str) and '"heartbeat"' in raw:
+                    await ws.send('{"type":"pong"}')
+        except Exception:
+            pass
+
+    async def close(self) -> None:
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
+        if self.drainer is not None:
+            self.drainer.cancel()
+            self.drainer = None
+
+
+async def client_worker(client: Any, queue: asyncio.Queue) -> None:
+    while True:
+        rec = await queue.get()
+        if rec is None:
+            await client.close()
+            return
+        await client.handle(rec)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stats = Stats()
+    queues: Dict[str, asyncio.Queue] = {}
+    workers = []
+    first_ts: Optional[float] = None
+    last_ts = 0.0
+    start = time.perf_counter()
+
+    for rec in read_capture(args.capture, stats):
+        if args.limit and stats.records > args.limit:
+            break
+        src = rec.get("src")
+        if src not in ("rest", "ws") or (args.only and src != args.only):
+            continue
+        ts = rec["ts"]
+        if first_ts is None:
+            first_ts = ts
+        last_ts = ts
+        if args.speed is not None:
+            due = start + (ts - first_ts) / args.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > stats.max_lag:
+                stats.max_lag = -delay
+
+        key = f"{src}:{rec['conn']}"
+        queue = queues.get(key)
+        if queue is None:
+            # Bounded, so at --speed max a slow client holds the reader back instead of buffering the file.
+            queue = queues[key] = asyncio.Queue(maxsize=1000)
+            client = RestClient(args, stats) if src == "rest" else WsClient(args, stats)
+            workers.append(asyncio.create_task(client_worker(client, queue)))
+        await queue.put(rec)
+
+    for queue in queues.values():
+        await queue.put(None)
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - start
+
+    sent_total = sum(stats.sent.values())
+    lat = sorted(stats.rest_latencies)
+
+    def pct(p: float) -> Optional[float]:
+        if not lat:
+            return None
+        return round(lat[min(len(lat) - 1, math.ceil(p / 100 * len(lat)) - 1)] * 1000, 3)
+
+    capture_span = (last_ts - first_ts) if first_ts is not None else 0.0
+    return {
+        "capture": args.capture,
+        "speed": "max" if args.speed is None else args.speed,
+        "records": stats.records,
+        "skipped_lines": stats.skipped,
+        "clients": len(queues),
+        "capture_span_s": round(capture_span, 3),
+        "elapsed_s": round(elapsed, 3),
+        "sent_total": sent_total,
+        "send_rate_per_s": round(sent_total / elapsed, 1) if elapsed > 0 else None,
+        "sent": stats.sent,
+        "errors": stats.errors,
+        "rest_status": stats.status,
+        "rest_latency_ms": {"p50": pct(50), "p90": pct(90), "p99": pct(99), "max": pct(100)},
+        "ws_connects": stats.ws_connects,
+        "ws_received": stats.ws_received,
+        "max_behind_schedule_ms": round(stats.max_lag * 1000, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a traffic capture against the REST + WebSocket server.")
+    parser.add_argument("capture", help="capture file written with CAPTURE_FILE")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server base URL")
+    parser.add_argument("--speed", default="1", help="time scale: 1 = as captured, 10 = 10x faster, max = no pauses")
+    parser.add_argument("--only", choices=("rest", "ws"), help="replay only one transport")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many records")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.speed == "max":
+        args.speed = None
+    else:
+        try:
+            args.speed = float(args.speed)
+        except ValueError:
+            parser.error("--speed must be a number or 'max'")
+        if args.speed <= 0:
+            parser.error("--speed must be > 0")
+    parts = urlsplit(args.url)
+    args.host = parts.hostname or "127.0.0.1"
+    args.tls = parts.scheme == "https"
+    args.port = parts.port or (443 if args.tls else 80)
+    args.ws_url = ("wss" if parts.scheme == "https" else "ws") + f"://{parts.netloc}/ws"
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(
+        f"sent {report['sent_total']} requests/messages from {report['records']} records in {report['elapsed_s']} s "
+        f"({report['send_rate_per_s']}/s; captured over {report['capture_span_s']} s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
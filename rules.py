@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import json
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from history import is_number
+
+# Every rule bounds one metric of a device's numeric telemetry:
+#   threshold -> the sample itself
+#   rate      -> change per second since the device's previous sample (at least
+#                min_rate_interval earlier, so a burst doesn't divide by ~0)
+#   window    -> avg / min / max / sum / count of the samples in the last window_s seconds
+# A rule fires when its metric leaves [min, max] and resolves once the metric
+# is back inside by at least `hysteresis`. Only those two transitions are
+# reported; a rule that stays firing (or quiet) emits nothing.
+KINDS = ("threshold", "rate", "window")
+AGGREGATES = ("avg", "min", "max", "sum", "count")
+
+
+class InvalidRule(ValueError):
+    pass
+
+
+class _Window:
+    """Samples of the last ``span`` seconds with O(1) amortized aggregates.
+
+    The sum is kept as a running total; min and max (only when the rule
+    needs them) use monotonic deques, so no aggregate ever rescans the
+    window. At most ``max_samples`` samples are kept; beyond that the
+    oldest are dropped early.
+    """
+
+    __slots__ = ("span", "max_samples", "samples", "total", "extremes", "_n")
+
+    def __init__(self, span: float, max_samples: int, aggregate: str) -> None:
+        self.span = span
+        self.max_samples = max_samples
+        # (n, t, v), oldest first
+        self.samples: Deque[Tuple[int, float, float]] = deque()
+        self.total = 0.0
+        # For min/max: (n, v) with values increasing (min) or decreasing (max) from the front.
+        self.extremes: Optional[Deque[Tuple[int, float]]] = deque() if aggregate in ("min", "max") else None
+        self._n = 0
+
+    def add(self, t: float, v: float, aggregate: str) -> float:
+        self._n += 1
+        samples = self.samples
+        samples.append((self._n, t, v))
+        self.total += v
+        extremes = self.extremes
+        if extremes is not None:
+            if aggregate == "min":
+                while extremes and extremes[-1][1] >= v:
+                    extremes.pop()
+            else:
+                while extremes and extremes[-1][1] <= v:
+                    extremes.pop()
+            extremes.append((self._n, v))
+
+        cutoff = t - self.span
+        while samples[0][1] <= cutoff or len(samples) > self.max_samples:
+            self.total -= samples.popleft()[2]
+        if extremes is not None:
+            oldest = samples[0][0]
+            while extremes[0][0] < oldest:
+                extremes.popleft()
+
+        if aggregate == "avg":
+            return self.total / len(samples)
+        if aggregate == "sum":
+            return self.total
+        if aggregate == "count":
+            return float(len(samples))
+        return extremes[0][1]
+
+
+class Rule:
+    __slots__ = (
+        "id", "name", "device_id", "field", "kind", "min", "max", "hysteresis", "window_s", "aggregate",
+        "firing", "observed", "fired", "created_at", "changed_at", "min_rate_interval", "_prev", "_window",
+    )
+
+    def __init__(
+        self,
+        spec: Dict[str, Any],
+        rule_id: Optional[str] = None,
+        max_window_samples: int = 10000,
+        min_rate_interval: float = 0.01,
+    ) -> None:
+        device_id = spec.get("device_id")
+        if not isinstance(device_id, str) or not device_id:
+            raise InvalidRule("device_id must be a non-empty string")
+        kind = spec.get("kind") or "threshold"
+        if kind not in KINDS:
+            raise InvalidRule(f"kind must be one of {KINDS}")
+        low, high = spec.get("min"), spec.get("max")
+        for name, bound in (("min", low), ("max", high)):
+            if bound is not None and not is_number(bound):
+                raise InvalidRule(f"{name} must be a number")
+        if low is None and high is None:
+            raise InvalidRule("at least one of min and max is required")
+        if low is not None and high is not None and low > high:
+            raise InvalidRule("min must not be greater than max")
+        hysteresis = spec.get("hysteresis") or 0.0
+        if not is_number(hysteresis) or hysteresis < 0:
+            raise InvalidRule("hysteresis must be a number >= 0")
+        if low is not None and high is not None and 2 * hysteresis > high - low:
+            # Otherwise no value could ever resolve the alert.
+            raise InvalidRule("hysteresis must be at most half of max - min")
+        field = spec.get("field")
+        if field is not None and (not isinstance(field, str) or not field):
+            raise InvalidRule("field must be a non-empty string")
+
+        window_s = spec.get("window_s")
+        aggregate = spec.get("aggregate") or "avg"
+        if kind == "window":
+            if not is_number(window_s) or window_s <= 0:
+                raise InvalidRule("window rules need window_s > 0")
+            if aggregate not in AGGREGATES:
+                raise InvalidRule(f"aggregate must be one of {AGGREGATES}")
+
+        self.id = rule_id or uuid.uuid4().hex
+        self.name = spec.get("name")
+        self.device_id = device_id
+        self.field = field
+        self.kind = kind
+        self.min = float(low) if low is not None else None
+        self.max = float(high) if high is not None else None
+        self.hysteresis = float(hysteresis)
+        self.window_s = float(window_s) if kind == "window" else None
+        self.aggregate = aggregate if kind == "window" else None
+
+        self.firing = False
+        self.observed: Optional[float] = None
+        self.fired = 0
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        self.changed_at: Optional[str] = None
+        self.min_rate_interval = min_rate_interval
+        self._prev: Optional[Tuple[float, float]] = None
+        self._window = _Window(self.window_s, max_window_samples, aggregate) if kind == "window" else None
+
+    def _metric(self, v: float, t: float) -> Optional[float]:
+        if self.kind == "threshold":
+            return v
+        if self.kind == "rate":
+            prev = self._prev
+            if prev is None:
+                self._prev = (t, v)
+                return None
+            if t - prev[0] < self.min_rate_interval:
+                # Too close to the reference sample (a batch or burst): keep the
+                # older reference so the next sample is measured over a real interval.
+                return None
+            self._prev = (t, v)
+            return (v - prev[1]) / (t - prev[0])
+        return self._window.add(t, v, self.aggregate)
+
+    def update(self, v: float, t: float) -> Optional[str]:
+        """Feed one sample; returns "firing" or "resolved" on a transition, else None."""
+        m = self._metric(v, t)
+        if m is None:
+            return None
+        self.observed = m
+        if self.firing:
+            h = self.hysteresis
+            if (self.max is None or m <= self.max - h) and (self.min is None or m >= self.min + h):
+                self.firing = False
+                self.changed_at = datetime.now(timezone.utc).isoformat()
+                return "resolved"
+        elif (self.max is not None and m > self.max) or (self.min is not None and m < self.min):
+            self.firing = True
+            self.fired += 1
+            self.changed_at = datetime.now(timezone.utc).isoformat()
+            return "firing"
+        return None
+
+    def spec(self) -> Dict[str, Any]:
+        """The definition alone, enough to recreate the rule (e.g. on another worker)."""
+        return {
+            "rule_id": self.id,
+            "name": self.name,
+            "device_id": self.device_id,
+            "field": self.field,
+            "kind": self.kind,
+            "min": self.min,
+            "max": self.max,
+            "hysteresis": self.hysteresis,
+            "window_s": self.window_s,
+            "aggregate": self.aggregate,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.spec(),
+            "state": "firing" if self.firing else "ok",
+            "observed": self.observed,
+            "fired": self.fired,
+            "created_utc": self.created_at,
+            "changed_utc": self.changed_at,
+        }
+
+
+class RuleEngine:
+    """Alert rules indexed by device, evaluated incrementally on every ingested sample.
+
+    ``evaluate`` costs one dict lookup for a device without rules and O(1)
+    amortized work per rule of that device otherwise. The sample is the
+    value itself or, for rules with a ``field``, that member of an object
+    value; non-numeric samples are skipped.
+    """
+
+    def __init__(self, max_rules: int = 10000, max_window_samples: int = 10000, min_rate_interval: float = 0.01) -> None:
+        self.max_rules = max_rules
+        self.max_window_samples = max_window_samples
+        self.min_rate_interval = min_rate_interval
+        self._rules: Dict[str, Rule] = {}
+        self._by_device: Dict[str, List[Rule]] = {}
+        self.evaluations = 0
+        self.transitions: Dict[str, int] = {"firing": 0, "resolved": 0}
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def add(self, spec: Dict[str, Any], rule_id: Optional[str] = None) -> Rule:
+        """Create a rule. Raises InvalidRule for a bad spec or when ``max_rules`` exist."""
+        if rule_id is not None and rule_id in self._rules:
+            raise InvalidRule(f"rule {rule_id!r} already exists")
+        if len(self._rules) >= self.max_rules:
+            raise InvalidRule(f"at most {self.max_rules} rules")
+        rule = Rule(spec, rule_id, self.max_window_samples, self.min_rate_interval)
+        self._rules[rule.id] = rule
+        self._by_device.setdefault(rule.device_id, []).append(rule)
+        return rule
+
+    def remove(self, rule_id: str) -> Optional[Rule]:
+        rule = self._rules.pop(rule_id, None)
+        if rule is not None:
+            rules = self._by_device[rule.device_id]
+            rules.remove(rule)
+            if not rules:
+                del self._by_device[rule.device_id]
+        return rule
+
+    def watches(self, device_id: str) -> bool:
+        return device_id in self._by_device
+
+    def get(self, rule_id: str) -> Optional[Rule]:
+        return self._rules.get(rule_id)
+
+    def rules(self, device_id: Optional[str] = None) -> List[Rule]:
+        if device_id is not None:
+            return list(self._by_device.get(device_id, ()))
+        return list(self._rules.values())
+
+    def evaluate(self, device_id: str, value: Any, t: float) -> List[Tuple[Rule, str]]:
+        """Feed one sample taken at ``t`` (epoch seconds) to the device's rules.
+
+        Returns the (rule, "firing" | "resolved") transitions.
+        """
+        rules = self._by_device.get(device_id)
+        if not rules:
+            return []
+        transitions = []
+        for rule in rules:
+            if rule.field is None:
+                sample = value
+            else:
+                sample = value.get(rule.field) if isinstance(value, dict) else None
+            if not is_number(sample):
+                continue
+            self.evaluations += 1
+            state = rule.update(float(sample), t)
+            if state is not None:
+                self.transitions[state] += 1
+                transitions.append((rule, state))
+        return transitions
+
+    def load(self, specs: Iterable[Dict[str, Any]]) -> int:
+        count = 0
+        for spec in specs:
+            if not isinstance(spec, dict):
+                raise InvalidRule("each rule must be an object")
+            # Without an explicit rule_id, derive one from the spec so every
+            # worker loading the same file agrees on the IDs.
+            rule_id = spec.get("rule_id") or uuid.uuid5(uuid.NAMESPACE_OID, json.dumps(spec, sort_keys=True)).hex
+            self.add(spec, rule_id)
+            count += 1
+        return count
+
+    def load_file(self, path: str) -> int:
+        """Add the rules in a JSON file holding a list of rule specs."""
+        with open(path, "r", encoding="utf-8") as f:
+            specs = json.load(f)
+        if not isinstance(specs, list):
+            raise InvalidRule(f"{path}: expected a JSON list of rules")
+        return self.load(specs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rules": len(self._rules),
+            "devices_with_rules": len(self._by_device),
+            "firing_now": sum(1 for rule in self._rules.values() if rule.firing),
+            "evaluations": self.evaluations,
+            "transitions": dict(self.transitions),
+        }
@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+# device_id -> {"value": ..., "updated_at_utc": ..., "seq": ...}
+Entry = Dict[str, Any]
+Listener = Callable[[str, Entry], None]
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedState:
+    """Device state split across N shards, each with its own lock.
+
+    Writers only lock the shard their device hashes to, so updates for
+    different devices don't queue behind each other. Every write gets the next
+    global sequence number and is recorded in a bounded change log so readers
+    can ask for just what changed since a given seq.
+
+    Single-device reads, counts and ``since`` are lock-free: they never await,
+    so on the event loop they can't observe a half-applied write.
+    """
+
+    def __init__(self, shards: int = 16, changelog_size: int = 10000) -> None:
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self._shards: List[Dict[str, Entry]] = [{} for _ in range(shards)]
+        self._locks = [asyncio.Lock() for _ in range(shards)]
+        self._changelog: Deque[Tuple[int, str]] = deque(maxlen=changelog_size)
+        self._listeners: List[Listener] = []
+        self._count = 0
+        self.seq = 0
+        # Identifies this process's seq numbering; a since= from another
+        # process (or an earlier run) must not be read as a delta point.
+        self.epoch = uuid.uuid4().hex[:12]
+        self.lock_wait_s = 0.0
+        self.lock_waits = 0
+        self.listener_errors = 0
+
+    # -- shard lookup ---------------------------------------------------
+    def shard_index(self, device_id: str) -> int:
+        # crc32 rather than hash(): stable across processes and restarts.
+        return zlib.crc32(device_id.encode("utf-8")) % len(self._shards)
+
+    @property
+    def shard_count(self) -> int:
+        return len(self._shards)
+
+    def add_listener(self, listener: Listener) -> None:
+        """Call ``listener(device_id, entry)`` after every write (persistence, history, ...).
+
+        The write is already applied when listeners run, so an exception from
+        one is logged and counted, never raised to the writer.
+        """
+        self._listeners.append(listener)
+
+    # -- reads ----------------------------------------------------------
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, device_id: str) -> Optional[Entry]:
+        return self._shards[self.shard_index(device_id)].get(device_id)
+
+    def copy(self) -> Tuple[int, Dict[str, Entry]]:
+        """Point-in-time (seq, full copy) without awaiting; entries are never mutated in place."""
+        data: Dict[str, Entry] = {}
+        for shard in self._shards:
+            data.update(shard)
+        return self.seq, data
+
+    def since(self, since: Optional[int], epoch: Optional[str] = None) -> Tuple[str, int, Dict[str, Entry]]:
+        """Return ("full" | "delta", current seq, data).
+
+        A delta holds the current entry of every device changed after ``since``.
+        Falls back to a full snapshot when ``since`` is missing, from another
+        epoch, ahead of the server or older than the change log reaches.
+        """
+        if since is None or since > self.seq or (epoch is not None and epoch != self.epoch):
+            return ("full", *self.copy())
+        log = self._changelog
+        oldest = log[0][0] if log else self.seq + 1
+        if since < oldest - 1:
+            return ("full", *self.copy())
+
+        delta: Dict[str, Entry] = {}
+        for seq, device_id in reversed(log):
+            if seq <= since:
+                break
+            if device_id not in delta:
+                delta[device_id] = self.get(device_id)
+        return "delta", self.seq, delta
+
+    # -- writes ---------------------------------------------------------
+    async def acquire(self, lock: asyncio.Lock) -> None:
+        """Acquire a shard lock, accounting any time spent waiting for it."""
+        if lock.locked():
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await lock.acquire()
+            self.lock_wait_s += loop.time() - start
+            self.lock_waits += 1
+        else:
+            await lock.acquire()
+
+    def _write(self, shard: Dict[str, Entry], device_id: str, value: Any, updated_at_utc: str) -> int:
+        self.seq += 1
+        entry = {"value": value, "updated_at_utc": updated_at_utc, "seq": self.seq}
+        if device_id not in shard:
+            self._count += 1
+        shard[device_id] = entry
+        self._changelog.append((self.seq, device_id))
+        for listener in self._listeners:
+            try:
+                listener(device_id, entry)
+            except Exception:
+                self.listener_errors += 1
+                logger.exception("state listener %r failed for device %r", listener, device_id)
+        return self.seq
+
+    async def put(self, device_id: str, value: Any, updated_at_utc: str) -> int:
+        """Write one device value and return its sequence number."""
+        idx = self.shard_index(device_id)
+        lock = self._locks[idx]
+        await self.acquire(lock)
+        try:
+            return self._write(self._shards[idx], device_id, value, updated_at_utc)
+        finally:
+            lock.release()
+
+    async def put_if_newer(self, device_id: str, value: Any, updated_at_utc: str) -> Optional[int]:
+        """put() unless the device already holds a newer write; returns None if skipped.
+
+        For updates relayed from other workers, which can arrive in any order:
+        every worker keeps the write with the latest ``updated_at_utc`` (ISO-8601
+        UTC strings, which sort chronologically). Writes stamped in the same
+        microsecond are ordered by their value, so all workers still agree.
+        """
+        idx = self.shard_index(device_id)
+        lock = self._locks[idx]
+        await self.acquire(lock)
+        try:
+            shard = self._shards[idx]
+            current = shard.get(device_id)
+            if current is not None and not _is_newer(updated_at_utc, value, current):
+                return None
+            return self._write(shard, device_id, value, updated_at_utc)
+        finally:
+            lock.release()
+
+    async def put_many(self, updates: Iterable[Dict[str, Any]], updated_at_utc: str) -> None:
+        """Write many {device_id, value} updates, locking each shard once.
+
+        Sets ``update["seq"]`` on every item. Only one shard lock is held at a
+        time, so a large batch never blocks writers to the other shards.
+        """
+        by_shard: Dict[int, List[Dict[str, Any]]] = {}
+        for update in updates:
+            by_shard.setdefault(self.shard_index(update["device_id"]), []).append(update)
+
+        for idx in sorted(by_shard):
+            lock = self._locks[idx]
+            await self.acquire(lock)
+            try:
+                shard = self._shards[idx]
+                for update in by_shard[idx]:
+                    update["seq"] = self._write(shard, update["device_id"], update["value"], updated_at_utc)
+            finally:
+                lock.release()
+
+    def load(self, seq: int, data: Dict[str, Entry]) -> None:
+        """Replace all state (warm start). Listeners are not called."""
+        for shard in self._shards:
+            shard.clear()
+        for device_id, entry in data.items():
+            self._shards[self.shard_index(device_id)][device_id] = entry
+        self._count = len(data)
+        self._changelog.clear()
+        self.seq = seq
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shards": len(self._shards),
+            "largest_shard": max(len(s) for s in self._shards),
+            "lock_waits": self.lock_waits,
+            "lock_wait_ms": round(self.lock_wait_s * 1000, 3),
+        }
+
+
+def _is_newer(updated_at_utc: str, value: Any, current: Entry) -> bool:
+    if updated_at_utc != current["updated_at_utc"]:
+        return updated_at_utc > current["updated_at_utc"]
+    return _order_key(value) > _order_key(current["value"])
+
+
+def _order_key(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, default=str)
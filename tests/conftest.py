@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One lifespan for the whole run: main's state and tasks are module globals.
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,24 @@
+import asyncio
+
+from main import BroadcastCoalescer
+
+
+def test_full_buffer_flushes_once_before_the_tick():
+    async def run():
+        published = []
+
+        async def publish(msg):
+            await asyncio.sleep(0)
+            published.append([u["device_id"] for u in msg["updates"]])
+
+        coalescer = BroadcastCoalescer(publish, interval_ms=60_000, mode="all", max_pending=2)
+        coalescer.start()
+        for i in range(3):
+            coalescer.add({"device_id": f"d{i}", "value": i})
+        # One early flush is in flight, and it takes what the buffer holds when it runs.
+        assert coalescer._early is not None
+        await coalescer.stop()
+        assert coalescer.flushes == 1
+        return published
+
+    assert asyncio.run(run()) == [["d0", "d1", "d2"]]
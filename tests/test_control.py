@@ -0,0 +1,33 @@
+def _post_command(client, target):
+    r = client.post("/api/control", json={"target": target, "command": "set_threshold", "args": {"max": 28}})
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_viewer_of_device_topic_does_not_count_as_the_device(client):
+    target = "control-viewer-target"
+    with client.websocket_connect(f"/ws?topics=device:{target}") as viewer:
+        assert viewer.receive_json()["type"] == "hello"
+        reply = _post_command(client, target)
+        # The viewer sees the command, but the device itself is absent.
+        assert reply["status"] == "queued"
+        assert reply["dispatched"] is False
+        event = viewer.receive_json()
+        assert event["type"] == "control" and event["command_id"] == reply["command_id"]
+
+        with client.websocket_connect(f"/ws?device={target}") as device:
+            assert device.receive_json()["type"] == "hello"
+            # Queued while the device was away, delivered once it connects.
+            event = device.receive_json()
+            assert event["type"] == "control" and event["command_id"] == reply["command_id"]
+            assert client.get(f"/api/control/{reply['command_id']}").json()["status"] == "delivered"
+
+
+def test_command_to_connected_device_is_delivered(client):
+    target = "control-device-target"
+    with client.websocket_connect(f"/ws?device={target}") as device:
+        assert device.receive_json()["type"] == "hello"
+        reply = _post_command(client, target)
+        assert reply["status"] == "delivered"
+        assert reply["dispatched"] is True
+        assert device.receive_json()["command_id"] == reply["command_id"]
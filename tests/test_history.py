@@ -0,0 +1,20 @@
+import pytest
+
+DEVICE_ID = "history-finite"
+
+
+@pytest.mark.parametrize("query", ["from=nan", "to=inf", "from=-inf", "to=NaN"])
+def test_non_finite_time_is_refused(client, query):
+    assert client.post("/api/data", json={"device_id": DEVICE_ID, "value": 1.5}).status_code == 200
+
+    r = client.get(f"/api/data/{DEVICE_ID}/history?{query}")
+    assert r.status_code == 400
+    assert "finite" in r.json()["detail"]
+    assert client.get(f"/api/data/{DEVICE_ID}/history").status_code == 200
+
+
+@pytest.mark.parametrize("step", ["inf", "nan"])
+def test_non_finite_step_is_refused(client, step):
+    assert client.post("/api/data", json={"device_id": DEVICE_ID, "value": 1.5}).status_code == 200
+
+    assert client.get(f"/api/data/{DEVICE_ID}/history?step={step}").status_code == 422
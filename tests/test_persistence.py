@@ -0,0 +1,36 @@
+import asyncio
+
+from persistence import FileStateStore
+
+
+def _entry(seq, value):
+    return {"value": value, "updated_at_utc": "2026-01-01T00:00:00+00:00", "seq": seq}
+
+
+def test_unencodable_record_is_dropped_not_retried(tmp_path):
+    async def run():
+        store = FileStateStore(str(tmp_path), flush_interval_ms=60000, snapshot_every=3)
+        state = {}
+        store.start(lambda: (max(e["seq"] for e in state.values()), dict(state)))
+        for seq, (device_id, value) in enumerate([("a", 1), ("bad", b"\x00"), ("b", 2)], start=1):
+            state[device_id] = _entry(seq, value)
+            store.record(device_id, state[device_id])
+        await store.flush()
+        stats = store.stats()
+        assert stats["pending_records"] == 0
+        assert stats["flushed_records"] == 2
+        assert stats["dropped_records"] == 1
+
+        # Later records are written too; the third one triggers compaction, which skips the bad entry.
+        state["c"] = _entry(4, 3)
+        store.record("c", state["c"])
+        await store.flush()
+        await store.stop()
+        assert store.stats()["snapshots"] == 1
+        assert store.stats()["flushed_records"] == 3
+        assert store.stats()["dropped_records"] == 2
+
+        seq, data = FileStateStore(str(tmp_path)).load()
+        assert {device_id: e["value"] for device_id, e in data.items()} == {"a": 1, "b": 2, "c": 3}
+
+    asyncio.run(run())
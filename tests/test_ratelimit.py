@@ -0,0 +1,22 @@
+from ratelimit import RateLimiter
+
+
+def test_cost_above_burst_is_charged_in_full():
+    limiter = RateLimiter(rate=1000, burst=2000)
+    # A full bucket admits a 3000-item batch and is left 1000 tokens in debt.
+    assert limiter.check("conn", cost=3000, now=0.0) == 0.0
+    assert limiter.stats()["rejected"] == 0
+    # Refused until the debt and the next batch's (clamped) cost are covered: 3 s.
+    assert limiter.check("conn", cost=3000, now=0.0) == 3.0
+    assert limiter.check("conn", cost=1, now=0.5) > 0
+    assert limiter.stats()["rejected"] == 2
+    assert limiter.check("conn", cost=3000, now=3.0) == 0.0
+
+
+def test_cost_above_burst_waits_for_a_full_bucket():
+    limiter = RateLimiter(rate=1000, burst=2000)
+    assert limiter.check("conn", cost=500, now=0.0) == 0.0
+    assert limiter.check("conn", cost=3000, now=0.0) == 0.5
+    assert limiter.check("conn", cost=3000, now=0.5) == 0.0
+    assert limiter.stats()["rejected"] == 1
+    assert limiter.check("conn", cost=1, now=0.5) > 0
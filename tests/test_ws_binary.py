@@ -0,0 +1,38 @@
+import cbor2
+import msgpack
+import pytest
+
+CODECS = {
+    "msgpack": (msgpack.packb, msgpack.unpackb),
+    "cbor": (cbor2.dumps, cbor2.loads),
+}
+# Values the binary encodings can carry but JSON cannot.
+NO_JSON_FORM = {
+    "msgpack": [b"\x00\x01", {1: "int key"}, msgpack.ExtType(5, b"x")],
+    "cbor": [b"\x00\x01", cbor2.CBORTag(4000, "tagged"), {1: "int key"}],
+}
+
+
+@pytest.mark.parametrize("encoding", sorted(CODECS))
+def test_value_without_json_form_is_refused(client, encoding):
+    dumps, loads = CODECS[encoding]
+    device_id = f"binary-{encoding}"
+    with client.websocket_connect(f"/ws?encoding={encoding}") as ws:
+        assert loads(ws.receive_bytes())["type"] == "hello"
+        for value in NO_JSON_FORM[encoding]:
+            ws.send_bytes(dumps({"type": "telemetry", "device_id": device_id, "value": value}))
+            assert loads(ws.receive_bytes())["type"] == "error"
+        ws.send_bytes(dumps({"type": "telemetry_batch", "items": [{"device_id": device_id, "value": b"\x00"}]}))
+        assert loads(ws.receive_bytes())["type"] == "error"
+
+        # The socket stays open and a valid reading still goes through.
+        ws.send_bytes(dumps({"type": "telemetry", "device_id": device_id, "value": {"rpm": 5}}))
+        ws.send_bytes(dumps({"type": "ping"}))
+        while loads(ws.receive_bytes())["type"] != "pong":
+            pass
+
+    r = client.get("/api/data")
+    assert r.status_code == 200
+    assert r.json()["data"][device_id]["value"] == {"rpm": 5}
+    with client.websocket_connect("/ws") as ws:
+        assert ws.receive_json()["type"] == "hello"